@@ -0,0 +1,38 @@
+"""Add the materialized loan_schedule_row table
+
+Revision ID: 5f3c2a9d7e41
+Revises: 444915460a1b
+Create Date: 2026-10-17 10:12:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5f3c2a9d7e41'
+down_revision: Union[str, None] = '444915460a1b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('loan_schedule_row',
+        sa.Column('loan_id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Integer(), nullable=False),
+        sa.Column('balance_cents', sa.BigInteger(), nullable=False),
+        sa.Column('payment_cents', sa.BigInteger(), nullable=False),
+        sa.Column('cumulative_principal_cents', sa.BigInteger(), nullable=False),
+        sa.Column('cumulative_interest_cents', sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(['loan_id'], ['loan.id']),
+        sa.PrimaryKeyConstraint('loan_id', 'month'),
+        sqlite_with_rowid=False
+    )
+    op.create_index('ix_loan_schedule_row_month_balance', 'loan_schedule_row', ['month', 'balance_cents'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_loan_schedule_row_month_balance', table_name='loan_schedule_row')
+    op.drop_table('loan_schedule_row')
@@ -0,0 +1,51 @@
+"""Add loan events, their checkpoints and loan.modification_count
+
+Revision ID: 9a4e6c1d2b73
+Revises: 5f3c2a9d7e41
+Create Date: 2026-10-17 15:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a4e6c1d2b73'
+down_revision: Union[str, None] = '5f3c2a9d7e41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('loan', sa.Column('modification_count', sa.Integer(), server_default='0', nullable=False))
+    op.create_table('loan_event',
+        sa.Column('kind', sa.Enum('prepayment', 'rate_reset', name='loaneventkind'), nullable=False),
+        sa.Column('month', sa.Integer(), nullable=False),
+        sa.Column('amount', sa.Numeric(precision=18, scale=6), nullable=True),
+        sa.Column('annual_interest_rate', sa.Numeric(precision=8, scale=5), nullable=True),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('loan_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['loan_id'], ['loan.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_loan_event_loan_id_month', 'loan_event', ['loan_id', 'month'], unique=False)
+    op.create_table('loan_checkpoint',
+        sa.Column('loan_id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Integer(), nullable=False),
+        sa.Column('balance', sa.Numeric(precision=18, scale=6), nullable=False),
+        sa.Column('annual_interest_rate', sa.Numeric(precision=8, scale=5), nullable=False),
+        sa.Column('interest_paid', sa.Numeric(precision=18, scale=6), nullable=False),
+        sa.ForeignKeyConstraint(['loan_id'], ['loan.id']),
+        sa.PrimaryKeyConstraint('loan_id', 'month'),
+        sqlite_with_rowid=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('loan_checkpoint')
+    op.drop_index('ix_loan_event_loan_id_month', table_name='loan_event')
+    op.drop_table('loan_event')
+    with op.batch_alter_table('loan') as batch_op:
+        batch_op.drop_column('modification_count')
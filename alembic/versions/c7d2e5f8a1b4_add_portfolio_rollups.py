@@ -0,0 +1,44 @@
+"""Add portfolio rollups
+
+Revision ID: c7d2e5f8a1b4
+Revises: 9a4e6c1d2b73
+Create Date: 2026-10-17 18:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7d2e5f8a1b4'
+down_revision: Union[str, None] = '9a4e6c1d2b73'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# The tables start out empty: run `python -m cli rebuild-portfolios` after upgrading, before serving writes
+def upgrade() -> None:
+    op.create_table('portfolio',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('loan_count', sa.Integer(), nullable=False),
+        sa.Column('term_months', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_table('portfolio_month',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('month', sa.Integer(), nullable=False),
+        sa.Column('balance_cents', sa.BigInteger(), nullable=False),
+        sa.Column('cumulative_principal_cents', sa.BigInteger(), nullable=False),
+        sa.Column('cumulative_interest_cents', sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('user_id', 'month'),
+        sqlite_with_rowid=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('portfolio_month')
+    op.drop_table('portfolio')
@@ -0,0 +1,32 @@
+"""Add remote_loan_link for loans shared across shards
+
+Revision ID: e3b8f1c6d2a9
+Revises: c7d2e5f8a1b4
+Create Date: 2026-10-17 21:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3b8f1c6d2a9'
+down_revision: Union[str, None] = 'c7d2e5f8a1b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('remote_loan_link',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('loan_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('user_id', 'loan_id'),
+        sqlite_with_rowid=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('remote_loan_link')
@@ -0,0 +1,194 @@
+import json
+
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import config
+from app.materialized_schedules import materialize_loans_async
+from app.portfolios import add_links_async, compute_contributions
+from app.sharding import group_by_shard, insert_returning_ids, on_shard
+from app.models import User, UserCreate, Loan, LoanCreate, UserLoanLink
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-seq")
+
+class InvalidItem:
+    # stands in for an NDJSON line that could not be parsed, so it is reported at its position
+    def __init__(self, detail):
+        self.detail = detail
+
+async def iter_request_items(request: Request):
+    # Bulk bodies are either one JSON array or NDJSON (one object per line). NDJSON is parsed as it streams
+    # in, so a large upload is never held in memory as a whole.
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in NDJSON_MEDIA_TYPES:
+        try:
+            items = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
+        for item in items:
+            yield item
+        return
+    buffer = b""
+    async for body_chunk in request.stream():
+        buffer += body_chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _parse_ndjson_line(line)
+    if buffer.strip():
+        yield _parse_ndjson_line(buffer)
+
+def _parse_ndjson_line(line):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return InvalidItem(f"Invalid JSON: {e}")
+
+async def iter_chunks(items, chunk_size):
+    chunk = []
+    async for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _validate(model, item):
+    if isinstance(item, InvalidItem):
+        return None, item.detail
+    try:
+        return model.model_validate(item), None
+    except ValidationError as e:
+        return None, "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors())
+
+class BulkResult:
+    def __init__(self):
+        self.results = []
+        self.inserted = 0
+        self.failed = 0
+
+    def ok(self, index, record_id):
+        self.results.append({"index": index, "id": record_id})
+        self.inserted += 1
+
+    def error(self, index, detail):
+        self.results.append({"index": index, "error": detail})
+        self.failed += 1
+
+    def as_response(self):
+        self.results.sort(key=lambda result: result["index"])
+        return {"inserted": self.inserted, "failed": self.failed, "results": self.results}
+
+async def bulk_insert_users(session: AsyncSession, items, chunk_size, router=None):
+    # with sharded storage (router, see app.sharding) each chunk is split by the users' shards
+    result = BulkResult()
+    seen_emails = set()
+    index = 0
+    async for chunk in iter_chunks(items, chunk_size):
+        candidates = []
+        for item in chunk:
+            user, error = _validate(UserCreate, item)
+            if error:
+                result.error(index, error)
+            elif user.email in seen_emails:
+                result.error(index, "Email already exists")
+            else:
+                seen_emails.add(user.email)
+                candidates.append((index, user))
+            index += 1
+        for shard, shard_candidates in group_by_shard(router, candidates, lambda candidate: router.shard_for_email(candidate[1].email)).items():
+            async with on_shard(router, session, shard) as shard_session:
+                await _insert_users(router, session, shard_session, shard, shard_candidates, result)
+    return result.as_response()
+
+async def _existing_emails(session, emails):
+    return set((await session.execute(select(User.email).where(User.email.in_(emails)))).scalars())
+
+async def _insert_users(router, session, shard_session, shard, candidates, result):
+    # one lookup per chunk replaces the per-user existence check that create_user does; users created before
+    # the database was sharded are all on shard 0 (session), whatever shard their email belongs on
+    emails = [user.email for _, user in candidates]
+    existing_emails = await _existing_emails(shard_session, emails)
+    if router is not None and shard != 0:
+        existing_emails |= await _existing_emails(session, emails)
+    rows = []
+    for position, user in candidates:
+        if user.email in existing_emails:
+            result.error(position, "Email already exists")
+        else:
+            rows.append((position, user.model_dump()))
+    if not rows:
+        return
+    # the whole chunk goes in as one executemany and one commit
+    try:
+        user_ids = await insert_returning_ids(shard_session, User, [row for _, row in rows], shard)
+        await shard_session.commit()
+    except IntegrityError:
+        # a concurrent writer took an email between the lookup and the insert; retry row by row so only
+        # the conflicting users are rejected
+        await shard_session.rollback()
+        for position, row in rows:
+            try:
+                user_id, = await insert_returning_ids(shard_session, User, [row], shard)
+                await shard_session.commit()
+            except IntegrityError:
+                await shard_session.rollback()
+                result.error(position, "Email already exists")
+            else:
+                result.ok(position, user_id)
+        return
+    for (position, _), user_id in zip(rows, user_ids):
+        result.ok(position, user_id)
+
+async def bulk_insert_loans(session: AsyncSession, items, chunk_size, router=None):
+    # with sharded storage each chunk is split by the shards of the loans' owners
+    result = BulkResult()
+    index = 0
+    async for chunk in iter_chunks(items, chunk_size):
+        candidates = []
+        for item in chunk:
+            loan, error = _validate(LoanCreate, item)
+            if error:
+                result.error(index, error)
+            else:
+                candidates.append((index, loan))
+            index += 1
+        for shard, shard_candidates in group_by_shard(router, candidates, lambda candidate: router.shard_for_id(candidate[1].user_id)).items():
+            async with on_shard(router, session, shard) as shard_session:
+                await _insert_loans(shard_session, shard, shard_candidates, result)
+    return result.as_response()
+
+async def _insert_loans(session, shard, candidates, result):
+    existing_user_ids = set((await session.execute(
+        select(User.id).where(User.id.in_({loan.user_id for _, loan in candidates})))).scalars())
+    rows = []
+    for position, loan in candidates:
+        if loan.user_id not in existing_user_ids:
+            result.error(position, "User not found")
+        else:
+            rows.append((position, loan))
+    if not rows:
+        return
+    # computed before the chunk's transaction starts
+    contributions = await compute_contributions([loan for _, loan in rows]) if config.PORTFOLIO_ROLLUPS else None
+    loan_rows = [loan.model_dump(exclude={"user_id"}) for _, loan in rows]
+    loan_ids = await insert_returning_ids(session, Loan, loan_rows, shard)
+    links = [(loan.user_id, loan_id) for (_, loan), loan_id in zip(rows, loan_ids)]
+    await session.execute(insert(UserLoanLink), [{"user_id": user_id, "loan_id": loan_id} for user_id, loan_id in links])
+    loans = [
+        Loan(id=loan_id, amount=loan.amount, annual_interest_rate=loan.annual_interest_rate, term_months=loan.term_months)
+        for (_, loan), loan_id in zip(rows, loan_ids)
+    ]
+    if config.MATERIALIZE_SCHEDULES:
+        await materialize_loans_async(session, loans)
+    if config.PORTFOLIO_ROLLUPS:
+        await add_links_async(session, links, contributions=dict(zip(loan_ids, contributions)))
+    await session.commit()
+    for (position, _), loan_id in zip(rows, loan_ids):
+        result.ok(position, loan_id)
@@ -0,0 +1,129 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app import config
+from app.metrics import timed_calculation
+
+# Decimal amortization is pure-Python CPU work that holds the GIL, so a few long schedules computed in the
+# threadpool stall every other request of the worker. Calculations of at least offload_threshold work units
+# (schedule rows or summaries) are run in a pool of worker processes instead; smaller ones stay inline, where
+# they are cheaper than the round trip. At most max_pending_tasks tasks are queued or running at once: beyond
+# that the pool refuses new work with ComputePoolFull, which the app answers with 503 and Retry-After.
+
+class ComputePoolFull(Exception):
+    pass
+
+class ComputeTimeout(Exception):
+    pass
+
+def _initialize_worker(rounding_policy):
+    # workers are spawned with a fresh interpreter, so the parent's engine settings are carried over explicitly
+    config.ROUNDING_POLICY = rounding_policy
+
+class ComputePool:
+    def __init__(self, workers, max_pending_tasks, task_timeout, chunk_size, offload_threshold):
+        self.workers = workers
+        self.max_pending_tasks = max_pending_tasks
+        self.task_timeout = task_timeout
+        self.chunk_size = chunk_size
+        self.offload_threshold = offload_threshold
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pending_tasks = 0
+        self.offloaded_tasks = 0
+        self.rejected_requests = 0
+        self.timeouts = 0
+
+    def offloads(self, work_units):
+        return self.workers > 0 and work_units >= self.offload_threshold
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn rather than fork: forking a process that is running threads can deadlock the child
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_initialize_worker,
+                initargs=(config.ROUNDING_POLICY,))
+        return self._executor
+
+    def _task_done(self, future):
+        with self._lock:
+            self.pending_tasks -= 1
+
+    def _submit(self, function, task_arguments):
+        with self._lock:
+            if self.pending_tasks + len(task_arguments) > self.max_pending_tasks:
+                self.rejected_requests += 1
+                raise ComputePoolFull()
+            self.pending_tasks += len(task_arguments)
+            self.offloaded_tasks += len(task_arguments)
+            executor = self._get_executor()
+        futures = []
+        try:
+            for arguments in task_arguments:
+                future = executor.submit(function, *arguments)
+                future.add_done_callback(self._task_done)
+                futures.append(future)
+        except BrokenProcessPool:
+            # a worker died; the next request starts a fresh pool
+            with self._lock:
+                self.pending_tasks -= len(task_arguments) - len(futures)
+                if self._executor is executor:
+                    self._executor = None
+            raise
+        return futures
+
+    def _results(self, futures):
+        # the timeout covers the whole request: queueing behind other tasks counts against it
+        deadline = time.monotonic() + self.task_timeout
+        try:
+            return [future.result(timeout=max(deadline - time.monotonic(), 0)) for future in futures]
+        except TimeoutError:
+            for future in futures:
+                future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise ComputeTimeout()
+
+    @timed_calculation
+    def run(self, work_units, function, *args):
+        # function(*args), in a worker process when the work is large enough; function and args must be picklable
+        if not self.offloads(work_units):
+            return function(*args)
+        return self._results(self._submit(function, [args]))[0]
+
+    @timed_calculation
+    def map_chunks(self, work_units, function, items):
+        # function(chunk) for consecutive chunks of chunk_size items, one task per chunk; returns the results in
+        # chunk order. The whole batch is admitted or refused at once, so a request never half-runs.
+        if not self.offloads(work_units):
+            return [function(items)]
+        chunks = [(items[start:start + self.chunk_size],) for start in range(0, len(items), self.chunk_size)]
+        return self._results(self._submit(function, chunks))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "pending_tasks": self.pending_tasks,
+                "offloaded_tasks": self.offloaded_tasks,
+                "rejected_requests": self.rejected_requests,
+                "timeouts": self.timeouts,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+compute_pool = ComputePool(
+    config.COMPUTE_POOL_WORKERS,
+    config.COMPUTE_POOL_MAX_PENDING_TASKS,
+    config.COMPUTE_TASK_TIMEOUT_SECONDS,
+    config.COMPUTE_CHUNK_SIZE,
+    config.COMPUTE_OFFLOAD_THRESHOLD)
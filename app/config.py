@@ -0,0 +1,78 @@
+import os
+
+# Runtime settings, read once from the environment at import time.
+
+# Amortization schedule cache (see app.schedule_cache); setting either limit to 0 disables caching
+SCHEDULE_CACHE_MAX_ENTRIES = int(os.getenv("SCHEDULE_CACHE_MAX_ENTRIES", "1024"))
+SCHEDULE_CACHE_MAX_BYTES = int(os.getenv("SCHEDULE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Default and maximum number of rows written per transaction by the bulk ingestion endpoints
+BULK_INSERT_CHUNK_SIZE = int(os.getenv("BULK_INSERT_CHUNK_SIZE", "1000"))
+BULK_INSERT_MAX_CHUNK_SIZE = int(os.getenv("BULK_INSERT_MAX_CHUNK_SIZE", "10000"))
+
+# Upper bound on the limit= page size of GET /users/{user_id}/loans
+LOANS_PAGE_MAX_LIMIT = int(os.getenv("LOANS_PAGE_MAX_LIMIT", "1000"))
+
+# How the calculation engine (see app.financial_calculations) rounds results to the cent: "bankers" (ties to even)
+# or "half_up" (ties away from zero)
+ROUNDING_POLICY = os.getenv("ROUNDING_POLICY", "bankers")
+
+# SQLite database file and connection profile (see app.database.SQLiteProfile). SQLITE_CACHE_SIZE follows the
+# PRAGMA's convention: negative values are KiB, positive values are pages.
+DATABASE_PATH = os.getenv("DATABASE_PATH", "test.db")
+# With DATABASE_SHARDS > 1, users and the loans they own are spread over that many files (see
+# app.database.ShardRouter): DATABASE_PATH is the first and the others are named after it (test-shard1.db, ...)
+DATABASE_SHARDS = int(os.getenv("DATABASE_SHARDS", "1"))
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "wal")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "normal")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Connection pools: each engine keeps DATABASE_POOL_SIZE connections (DATABASE_READ_POOL_SIZE for the read-only
+# engines) and opens up to DATABASE_MAX_OVERFLOW more under load, waiting DATABASE_POOL_TIMEOUT seconds for one.
+# Set DATABASE_READ_ONLY_POOL=false to serve reads from the read-write pools.
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+DATABASE_READ_POOL_SIZE = int(os.getenv("DATABASE_READ_POOL_SIZE", "10"))
+DATABASE_READ_ONLY_POOL = os.getenv("DATABASE_READ_ONLY_POOL", "true").lower() in ("1", "true", "yes", "on")
+
+# Log every SQL statement (SQLAlchemy echo); off by default because it is very expensive under load
+DATABASE_ECHO = os.getenv("DATABASE_ECHO", "false").lower() in ("1", "true", "yes", "on")
+
+# SQL statements taking at least this many milliseconds are logged to the app.slow_queries logger
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "100"))
+
+# Write each loan's schedule to loan_schedule_row when it is created and serve schedules and summaries from it
+# (see app.materialized_schedules); existing loans are materialized with `python -m cli backfill-schedules`
+MATERIALIZE_SCHEDULES = os.getenv("MATERIALIZE_SCHEDULES", "false").lower() in ("1", "true", "yes", "on")
+
+# Keep each user's portfolio rollup (see app.portfolios) up to date as loans are created, shared and modified, so
+# /users/{id}/portfolio is a primary-key lookup. Off by default: every loan write then also computes the loan's
+# schedule and updates its users' rollups. Rollups are rebuilt with `python -m cli rebuild-portfolios`
+PORTFOLIO_ROLLUPS = os.getenv("PORTFOLIO_ROLLUPS", "false").lower() in ("1", "true", "yes", "on")
+
+# Cache-Control sent with the schedule, summary and summaries responses (which also carry ETags); empty omits it.
+# The default lets clients and CDNs keep responses but revalidate them, which is answered with a cheap 304.
+CACHE_CONTROL_SCHEDULE = os.getenv("CACHE_CONTROL_SCHEDULE", "public, no-cache")
+CACHE_CONTROL_SUMMARY = os.getenv("CACHE_CONTROL_SUMMARY", "public, no-cache")
+CACHE_CONTROL_SUMMARIES = os.getenv("CACHE_CONTROL_SUMMARIES", "public, no-cache")
+
+# Stateless quotes (POST /quotes/schedule and /quotes/summary): most quotes accepted per request, longest term
+# accepted, and how many computed quote summaries are memoized (quote schedules share the schedule cache)
+QUOTES_MAX_BATCH_SIZE = int(os.getenv("QUOTES_MAX_BATCH_SIZE", "1000"))
+QUOTES_MAX_TERM_MONTHS = int(os.getenv("QUOTES_MAX_TERM_MONTHS", "1200"))
+QUOTE_SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("QUOTE_SUMMARY_CACHE_MAX_ENTRIES", "65536"))
+
+# Process pool for large calculations (see app.compute_pool); 0 workers (the default) computes everything in the
+# request thread. Calculations of at least COMPUTE_OFFLOAD_THRESHOLD schedule rows or summaries are offloaded,
+# batches as one task per COMPUTE_CHUNK_SIZE loans. Once COMPUTE_POOL_MAX_PENDING_TASKS tasks are queued or
+# running, requests needing the pool get 503 with Retry-After: COMPUTE_RETRY_AFTER_SECONDS, as do requests whose
+# offloaded work takes longer than COMPUTE_TASK_TIMEOUT_SECONDS.
+COMPUTE_POOL_WORKERS = int(os.getenv("COMPUTE_POOL_WORKERS", "0"))
+COMPUTE_OFFLOAD_THRESHOLD = int(os.getenv("COMPUTE_OFFLOAD_THRESHOLD", "2000"))
+COMPUTE_CHUNK_SIZE = int(os.getenv("COMPUTE_CHUNK_SIZE", "16"))
+COMPUTE_POOL_MAX_PENDING_TASKS = int(os.getenv("COMPUTE_POOL_MAX_PENDING_TASKS", "64"))
+COMPUTE_TASK_TIMEOUT_SECONDS = float(os.getenv("COMPUTE_TASK_TIMEOUT_SECONDS", "30"))
+COMPUTE_RETRY_AFTER_SECONDS = int(os.getenv("COMPUTE_RETRY_AFTER_SECONDS", "1"))
@@ -1,20 +1,259 @@
+import asyncio
+import zlib
+from pathlib import Path
+
+from fastapi import Depends, Request
 from sqlmodel import SQLModel, create_engine
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app import config
+
+JOURNAL_MODES = ("delete", "truncate", "persist", "memory", "wal", "off")
+SYNCHRONOUS_MODES = ("off", "normal", "full", "extra")
+
+class SQLiteProfile:
+    # Connection settings shared by every engine on one database file. The constructor defaults are SQLite's
+    # own; from_config() reads the environment, whose defaults are tuned for concurrent use: in WAL mode readers
+    # never block the writer, synchronous=NORMAL only syncs at checkpoints (still safe against corruption, but
+    # the last commits can be lost on power failure), and busy_timeout makes a writer wait for the lock
+    # instead of failing with "database is locked".
+    def __init__(self, journal_mode="delete", synchronous="full", mmap_size=0, cache_size=-2000, busy_timeout_ms=5000,
+                 pool_size=5, max_overflow=10, pool_timeout=30, read_pool_size=10, echo=False):
+        if journal_mode.lower() not in JOURNAL_MODES:
+            raise ValueError(f"Unknown SQLite journal mode {journal_mode!r}; choose from {list(JOURNAL_MODES)}")
+        if synchronous.lower() not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Unknown SQLite synchronous mode {synchronous!r}; choose from {list(SYNCHRONOUS_MODES)}")
+        self.journal_mode = journal_mode.lower()
+        self.synchronous = synchronous.lower()
+        self.mmap_size = int(mmap_size)
+        self.cache_size = int(cache_size)
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.read_pool_size = read_pool_size
+        self.echo = echo
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            journal_mode=config.SQLITE_JOURNAL_MODE,
+            synchronous=config.SQLITE_SYNCHRONOUS,
+            mmap_size=config.SQLITE_MMAP_SIZE,
+            cache_size=config.SQLITE_CACHE_SIZE,
+            busy_timeout_ms=config.SQLITE_BUSY_TIMEOUT_MS,
+            pool_size=config.DATABASE_POOL_SIZE,
+            max_overflow=config.DATABASE_MAX_OVERFLOW,
+            pool_timeout=config.DATABASE_POOL_TIMEOUT,
+            read_pool_size=config.DATABASE_READ_POOL_SIZE,
+            echo=config.DATABASE_ECHO,
+        )
+
+    def pragmas(self, read_only=False):
+        statements = [
+            f"PRAGMA busy_timeout = {self.busy_timeout_ms}",
+            f"PRAGMA synchronous = {self.synchronous}",
+            f"PRAGMA cache_size = {self.cache_size}",
+            f"PRAGMA mmap_size = {self.mmap_size}",
+            # not a tunable: the write endpoints rely on the foreign keys to reject links to missing rows
+            "PRAGMA foreign_keys = ON",
+        ]
+        if read_only:
+            # the journal mode is persisted in the file by the writers; readers only refuse to write
+            statements.append("PRAGMA query_only = ON")
+        else:
+            statements.insert(1, f"PRAGMA journal_mode = {self.journal_mode}")
+        return statements
+
+def _apply_pragmas_on_connect(sync_engine, pragmas):
+    @event.listens_for(sync_engine, "connect")
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+def create_sqlite_engine(database_path, profile, read_only=False):
+    pool_size = profile.read_pool_size if read_only else profile.pool_size
+    engine = create_engine(
+        f"sqlite:///{database_path}",
+        echo=profile.echo,
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=profile.max_overflow,
+        pool_timeout=profile.pool_timeout,
+    )
+    _apply_pragmas_on_connect(engine, profile.pragmas(read_only))
+    return engine
+
+def create_async_sqlite_engine(database_path, profile, read_only=False):
+    # aiosqlite defaults to NullPool, which opens a connection (and its worker thread) per session
+    pool_size = profile.read_pool_size if read_only else profile.pool_size
+    async_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{database_path}",
+        echo=profile.echo,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=pool_size,
+        max_overflow=profile.max_overflow,
+        pool_timeout=profile.pool_timeout,
+    )
+    _apply_pragmas_on_connect(async_engine.sync_engine, profile.pragmas(read_only))
+    return async_engine
+
+# Sharded storage: every record id carries its shard in the bits above SHARD_ID_BITS, so an id alone says which
+# file holds the user or loan (ids stay below 2**53, safe as JSON numbers, for up to 8192 shards). Ids below
+# 2**SHARD_ID_BITS are shard 0's, so an existing single-file database becomes shard 0 as it is.
+SHARD_ID_BITS = 40
+
+def shard_database_paths(database_path, shard_count):
+    path = Path(database_path)
+    return [path] + [path.with_name(f"{path.stem}-shard{shard}{path.suffix}") for shard in range(1, shard_count)]
+
+class ShardRouter:
+    # Engines and sessions for each shard file. New users are placed on a shard by a hash of their email (so
+    # each shard's unique index keeps emails unique) and get an id in that shard's range; their loans live on
+    # the same shard with ids in the same range. Sessions carry their shard in session.info["shard"].
+    def __init__(self, database_paths, profile, read_only_pool=True):
+        self.database_paths = list(database_paths)
+        self.engines = [create_sqlite_engine(path, profile) for path in self.database_paths]
+        self.async_engines = [create_async_sqlite_engine(path, profile) for path in self.database_paths]
+        if read_only_pool:
+            self.read_engines = [create_sqlite_engine(path, profile, read_only=True) for path in self.database_paths]
+            self.async_read_engines = [create_async_sqlite_engine(path, profile, read_only=True) for path in self.database_paths]
+        else:
+            self.read_engines = self.engines
+            self.async_read_engines = self.async_engines
+        self._session_makers = [self._session_maker(engine, shard) for shard, engine in enumerate(self.engines)]
+        self._read_session_makers = [self._session_maker(engine, shard) for shard, engine in enumerate(self.read_engines)]
+        self._async_session_makers = [self._async_session_maker(engine, shard) for shard, engine in enumerate(self.async_engines)]
+        self._async_read_session_makers = [
+            self._async_session_maker(engine, shard) for shard, engine in enumerate(self.async_read_engines)]
+
+    @classmethod
+    def from_config(cls):
+        return cls(shard_database_paths(config.DATABASE_PATH, config.DATABASE_SHARDS), SQLiteProfile.from_config(),
+                   config.DATABASE_READ_ONLY_POOL)
+
+    @staticmethod
+    def _session_maker(engine, shard):
+        return sessionmaker(autocommit=False, autoflush=False, bind=engine, info={"shard": shard})
+
+    @staticmethod
+    def _async_session_maker(async_engine, shard):
+        return async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False, info={"shard": shard})
+
+    @property
+    def shard_count(self):
+        return len(self.database_paths)
+
+    def shard_for_id(self, record_id):
+        # ids past the last shard's range can't exist; they go to the last shard, which reports them missing
+        return min(max(record_id, 0) >> SHARD_ID_BITS, self.shard_count - 1)
+
+    def shard_for_email(self, email):
+        return zlib.crc32(email.encode()) % self.shard_count
+
+    def shard_for_request(self, request: Request):
+        # routes by the user or loan id in the path; requests without one start on shard 0 and pick their shards
+        # themselves (see app.sharding)
+        for name in ("user_id", "loan_id"):
+            if name in request.path_params:
+                try:
+                    return self.shard_for_id(int(request.path_params[name]))
+                except ValueError:
+                    return 0
+        return 0
+
+    def session(self, shard):
+        return self._session_makers[shard]()
+
+    def read_session(self, shard):
+        return self._read_session_makers[shard]()
 
-sqlite_file_name = "test.db"
-sqlite_url = f"sqlite:///{sqlite_file_name}"
+    def async_session(self, shard):
+        return self._async_session_makers[shard]()
 
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, echo=True, connect_args=connect_args)
+    def async_read_session(self, shard):
+        return self._async_read_session_makers[shard]()
+
+    def create_all(self):
+        for engine in self.engines:
+            SQLModel.metadata.create_all(engine)
+
+    def dispose(self):
+        async def dispose_async_engines():
+            for async_engine in {*self.async_engines, *self.async_read_engines}:
+                await async_engine.dispose()
+        asyncio.run(dispose_async_engines())
+        for engine in {*self.engines, *self.read_engines}:
+            engine.dispose()
+
+sqlite_file_name = config.DATABASE_PATH
+sqlite_profile = SQLiteProfile.from_config()
+
+engine = create_sqlite_engine(sqlite_file_name, sqlite_profile)
+
+# The async engine serves the CRUD endpoints from the event loop; the sync engine above is kept for
+# table creation, Alembic, the compute-bound schedule endpoints and the tests.
+async_engine = create_async_sqlite_engine(sqlite_file_name, sqlite_profile)
+
+# Read-only engines for the endpoints that only query (the GETs and the batch summary), so readers draw from
+# their own pool and never queue behind writers for a connection
+if config.DATABASE_READ_ONLY_POOL:
+    read_engine = create_sqlite_engine(sqlite_file_name, sqlite_profile, read_only=True)
+    async_read_engine = create_async_sqlite_engine(sqlite_file_name, sqlite_profile, read_only=True)
+else:
+    read_engine = engine
+    async_read_engine = async_engine
+
+shard_router = ShardRouter.from_config() if config.DATABASE_SHARDS > 1 else None
 
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    if shard_router is not None:
+        shard_router.create_all()
+    else:
+        SQLModel.metadata.create_all(engine)
+
+def write_engines():
+    # every database file's read-write engine, for the maintenance commands that go through all of them
+    return shard_router.engines if shard_router is not None else [engine]
+
+def read_engines():
+    return shard_router.read_engines if shard_router is not None else [read_engine]
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# objects are handed back to FastAPI after the commit, so they must not expire and lazy-load outside the loop
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
-def get_session():
-    session = SessionLocal()
+def get_shard_router():
+    # None with a single database file
+    return shard_router
+
+def get_session(request: Request, router: ShardRouter = Depends(get_shard_router)):
+    session = router.session(router.shard_for_request(request)) if router else SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+def get_read_session(request: Request, router: ShardRouter = Depends(get_shard_router)):
+    session = router.read_session(router.shard_for_request(request)) if router else ReadSessionLocal()
     try:
         yield session
     finally:
         session.close()
+
+async def get_async_session(request: Request, router: ShardRouter = Depends(get_shard_router)):
+    async with (router.async_session(router.shard_for_request(request)) if router else AsyncSessionLocal()) as session:
+        yield session
+
+async def get_async_read_session(request: Request, router: ShardRouter = Depends(get_shard_router)):
+    async with (router.async_read_session(router.shard_for_request(request)) if router else AsyncReadSessionLocal()) as session:
+        yield session
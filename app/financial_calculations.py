@@ -1,42 +1,193 @@
+from app.metrics import timed_calculation
 from app.models import Loan
+from app.rounding import default_rounding
+from bisect import bisect_left
 from decimal import Decimal
+from itertools import islice
 
-def amortization_schedule(loan: Loan):
-  schedule = []
-  i = loan.annual_interest_rate / Decimal("100") / Decimal("12")
-  l = loan.amount
-  n = loan.term_months
-  monthly_payment = l * ((i * (Decimal("1") + i) ** n) / ((Decimal("1") + i) ** n - Decimal("1")))
-  for m in range(1, n + 1):
-    obj = {
+# Part of every schedule and summary ETag (see app.http_caching): bump it whenever a change alters computed results
+ENGINE_VERSION = "2"
+
+ONE = Decimal("1")
+CENTS = Decimal("1.00")
+ZERO_BALANCE = Decimal("0.00")
+
+def monthly_interest_rate(annual_interest_rate):
+  return annual_interest_rate / Decimal("100") / Decimal("12")
+
+def monthly_payment(amount, i, n):
+  # a zero-rate loan has no interest to spread, so the closed form (which divides by zero) doesn't apply
+  if not i:
+    return amount / n
+  growth = (ONE + i) ** n
+  return amount * ((i * growth) / (growth - ONE))
+
+# An Amortization is one set of loan terms. balances() yields the unrounded balance after each month, built from
+# the previous one (B_m = B_(m-1) * (1 + i) - P) so a schedule takes linear time; balance_after(m) is the closed
+# form B_m = L * ((1 + i)^n - (1 + i)^m) / ((1 + i)^n - 1) for jumping straight to one month. Arithmetic is
+# Decimal at the default context's 28 significant digits, and balances stay unrounded until to_cents().
+
+class Amortization:
+  def __init__(self, amount, annual_interest_rate, term_months, rounding=None):
+    self.amount = amount
+    self.term_months = term_months
+    self.rounding = rounding or default_rounding()
+    self.i = monthly_interest_rate(annual_interest_rate)
+    self.growth_factor = ONE + self.i
+    self.growth_over_term = self.growth_factor ** term_months
+    self.payment = monthly_payment(amount, self.i, term_months)
+    self.rounded_payment = self.to_cents(self.payment)
+
+  def to_cents(self, value):
+    # + 0 turns the -0.00 that residue just below zero rounds to into 0.00
+    return value.quantize(CENTS, rounding=self.rounding) + 0
+
+  def balances(self, start_month=1):
+    # balances from start_month on; a later start jumps there with the closed form instead of walking 1..start
+    balance = self.balance_after(start_month - 1) if start_month > 1 else self.amount
+    for m in range(start_month, self.term_months):
+      balance = balance * self.growth_factor - self.payment
+      yield balance
+    # reconciliation: the final payment retires the loan, so any residue left by the recurrence is absorbed here
+    yield ZERO_BALANCE
+
+  def balance_after(self, month):
+    if not self.i:
+      return self.amount - self.payment * month
+    return self.amount * ((self.growth_over_term - self.growth_factor ** month) / (self.growth_over_term - ONE))
+
+  def summary(self, month, current_principal_balance):
+    # principal paid is whatever the balance has dropped by, and interest is the rest of the m payments
+    principal_already_paid = self.amount - current_principal_balance
+    interest_already_paid = self.payment * month - principal_already_paid
+    return {
+      "current principal balance": self.to_cents(current_principal_balance),
+      "principal already paid": self.to_cents(principal_already_paid),
+      "interest already paid": self.to_cents(interest_already_paid)
+    }
+
+class ModifiedAmortization:
+  # A loan modified by prepayments or rate resets (see app.loan_modifications), described by its checkpoints:
+  # (month, balance, annual_interest_rate, interest_paid) tuples in month order, each the state at the end of a
+  # month (after that month's payment and any prepayment) with the rate that applies from the next month on.
+  # At a checkpoint the rest of the loan is re-amortized over the months left in the term, so the stretch after
+  # it is an ordinary amortization of its balance and any month is computed from the checkpoint before it,
+  # without replaying the months in between. Months before the first checkpoint are the unmodified loan's.
+  def __init__(self, amount, annual_interest_rate, term_months, checkpoints):
+    self.amount = amount
+    self.term_months = term_months
+    checkpoints = list(checkpoints)
+    if not checkpoints or checkpoints[0][0] > 0:
+      checkpoints.insert(0, (0, amount, annual_interest_rate, ZERO_BALANCE))
+    self.checkpoints = checkpoints
+    self.months = [checkpoint[0] for checkpoint in checkpoints]
+    self.calculations = [
+      amortization(balance, rate, term_months - month) for month, balance, rate, _ in checkpoints]
+    self.rounding = self.calculations[0].rounding
+
+  def _stretch(self, month):
+    # index of the checkpoint month is computed from: the last one before it
+    return bisect_left(self.months, month) - 1
+
+  def rate_after(self, month):
+    return self.checkpoints[self._stretch(month + 1)][2]
+
+  def _to_cents(self, value):
+    return value.quantize(CENTS, rounding=self.rounding) + 0
+
+  def _checkpoint_summary(self, index):
+    _, balance, _, interest_paid = self.checkpoints[index]
+    return {
+      "current principal balance": self._to_cents(balance),
+      "principal already paid": self._to_cents(self.amount - balance),
+      "interest already paid": self._to_cents(interest_paid)
+    }
+
+  def _summary(self, index, month, balance):
+    # the stretch's own summary, shifted by what had been paid by its checkpoint
+    start, opening_balance, _, interest_paid = self.checkpoints[index]
+    summary = self.calculations[index].summary(month - start, balance)
+    return {
+      "current principal balance": summary["current principal balance"],
+      "principal already paid": self._to_cents(self.amount - opening_balance + summary["principal already paid"]),
+      "interest already paid": self._to_cents(interest_paid + summary["interest already paid"])
+    }
+
+  def _walk(self, from_month, to_month):
+    # (month, stretch index, unrounded balance) for from_month..to_month; the balance is None at a checkpoint's
+    # month, whose state is the checkpoint's (it includes the month's prepayment)
+    to_month = min(to_month or self.term_months, self.term_months)
+    for index in range(self._stretch(from_month), len(self.checkpoints)):
+      start = self.months[index]
+      if start >= to_month:
+        return
+      last_index = index + 1 == len(self.checkpoints)
+      end = self.term_months if last_index else self.months[index + 1]
+      first = max(from_month, start + 1)
+      last = min(end, to_month)
+      balances = islice(self.calculations[index].balances(first - start), last - first + 1)
+      for month, balance in enumerate(balances, start=first):
+        yield month, index, None if month == end and not last_index else balance
+
+  def iter_schedule(self, from_month=1, to_month=None):
+    for month, index, balance in self._walk(from_month, to_month):
+      calculation = self.calculations[index]
+      yield {
+          "Month": month,
+          "Remaining balance": self._to_cents(self.checkpoints[index + 1][1]) if balance is None else calculation.to_cents(balance),
+          "Monthly payment": calculation.rounded_payment,
+      }
+
+  def iter_months(self, from_month=1, to_month=None):
+    # (month, rounded payment, summary) for each month, with the summaries of the schedule's own balances
+    for month, index, balance in self._walk(from_month, to_month):
+      summary = self._checkpoint_summary(index + 1) if balance is None else self._summary(index, month, balance)
+      yield month, self.calculations[index].rounded_payment, summary
+
+  def summary(self, month):
+    index = self._stretch(month)
+    if index + 1 < len(self.checkpoints) and self.months[index + 1] == month:
+      return self._checkpoint_summary(index + 1)
+    return self._summary(index, month, self.calculations[index].balance_after(month - self.months[index]))
+
+@timed_calculation
+def amortization(amount, annual_interest_rate, term_months):
+  return Amortization(amount, annual_interest_rate, term_months)
+
+@timed_calculation
+def iter_amortization_schedule(amount, annual_interest_rate, term_months, from_month=1, to_month=None, checkpoints=()):
+  # rows from_month..to_month (default: to the end of the term); the cost is proportional to the window
+  if checkpoints:
+    yield from ModifiedAmortization(amount, annual_interest_rate, term_months, checkpoints).iter_schedule(from_month, to_month)
+    return
+  calculation = amortization(amount, annual_interest_rate, term_months)
+  to_month = min(to_month or term_months, term_months)
+  balances = islice(calculation.balances(from_month), max(to_month - from_month + 1, 0))
+  for m, balance in enumerate(balances, start=from_month):
+    yield {
         "Month": m,
-        "Remaining balance": (l * (((Decimal("1") + i) ** n - (Decimal("1") + i) ** m) / ((Decimal("1") + i) ** n - Decimal("1")))).quantize(Decimal("1.00")),
-        "Monthly payment": monthly_payment.quantize(Decimal("1.00")),
+        "Remaining balance": calculation.to_cents(balance),
+        "Monthly payment": calculation.rounded_payment,
     }
-    schedule.append(obj)
-  return schedule
+
+def amortization_schedule(loan: Loan):
+  return list(iter_amortization_schedule(loan.amount, loan.annual_interest_rate, loan.term_months))
+
+@timed_calculation
+def iter_loan_summaries(amount, annual_interest_rate, term_months, months, checkpoints=()):
+  # each month is evaluated with the closed form, so it costs one exponentiation instead of a walk over 1..m
+  if checkpoints:
+    calculation = ModifiedAmortization(amount, annual_interest_rate, term_months, checkpoints)
+    for month in months:
+      yield calculation.summary(month)
+    return
+  calculation = amortization(amount, annual_interest_rate, term_months)
+  for month in months:
+    yield calculation.summary(month, calculation.balance_after(month))
 
 def loan_summary_for_month(month, loan: Loan):
-  i = loan.annual_interest_rate / Decimal("100") / Decimal("12")
-  n = loan.term_months
-  current_principal_balance = loan.amount
-  monthly_payment = current_principal_balance * ((i * (Decimal("1") + i) ** n) / ((Decimal("1") + i) ** n - Decimal("1")))
-
-  total_payment_remaining = monthly_payment * n
-  interest_paid_this_month = Decimal("0")
-  principal_already_paid = Decimal("0")
-  interest_already_paid = Decimal("0")
-
-  for m in range(1, month + 1):
-    interest_paid_this_month = current_principal_balance * i
-    principal_paid_this_month = monthly_payment - interest_paid_this_month
-    principal_already_paid += principal_paid_this_month
-    interest_already_paid += interest_paid_this_month
-    current_principal_balance -= principal_paid_this_month
-    total_payment_remaining -= monthly_payment
-
-  return {
-    "current principal balance": current_principal_balance.quantize(Decimal("1.00")),
-    "principal already paid": principal_already_paid.quantize(Decimal("1.00")),
-    "interest already paid": interest_already_paid.quantize(Decimal("1.00"))
-  }
+  return next(iter_loan_summaries(loan.amount, loan.annual_interest_rate, loan.term_months, [month]))
+
+def loan_summaries_for_months(months, loan: Loan):
+  summaries = iter_loan_summaries(loan.amount, loan.annual_interest_rate, loan.term_months, months)
+  return [{"Month": month, **summary} for month, summary in zip(months, summaries)]
@@ -0,0 +1,39 @@
+import hashlib
+
+from fastapi import Response
+
+from app import config
+from app.financial_calculations import ENGINE_VERSION
+from app.schedule_cache import normalize_checkpoints, normalize_loan_terms
+
+# Conditional requests for the computed loan endpoints. A response is a pure function of the loan's terms, the
+# calculation engine (version and rounding policy) and the request's own parameters, so those alone
+# make a strong ETag that can be checked against If-None-Match before any amortization work is done. A modified
+# loan's checkpoints (see app.loan_modifications) are part of its terms.
+
+def loan_etag(loan, *representation, checkpoints=()):
+    # representation distinguishes the responses derived from one loan (endpoint, month(s), window, format)
+    parts = (
+        *normalize_loan_terms(loan.amount, loan.annual_interest_rate, loan.term_months),
+        *normalize_checkpoints(checkpoints),
+        ENGINE_VERSION, config.ROUNDING_POLICY,
+        *representation,
+    )
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+def matches_if_none_match(if_none_match, etag):
+    # If-None-Match uses the weak comparison, so a W/ prefix added by an intermediary still matches
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+def cache_headers(etag, cache_control):
+    headers = {"ETag": etag}
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    return headers
+
+def not_modified(headers):
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,60 @@
+import json
+from decimal import Decimal
+
+from fastapi import Response
+
+# Endpoints with large, fixed-shape responses return already-encoded bodies, skipping response_model validation
+# and jsonable_encoder. As in app.streaming, quantized Decimals are written with str() as JSON numbers.
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+_encoded_keys = {}
+
+def _encode_key(key):
+    encoded = _encoded_keys.get(key)
+    if encoded is None:
+        encoded = _encoded_keys[key] = json.dumps(key)
+    return encoded
+
+def _encode_value(value):
+    if isinstance(value, Decimal) or (isinstance(value, int) and not isinstance(value, bool)):
+        return str(value)
+    return json.dumps(value)
+
+def encode_object(values):
+    return "{" + ",".join(f"{_encode_key(key)}:{_encode_value(value)}" for key, value in values.items()) + "}"
+
+def encode_objects(objects):
+    return "[" + ",".join(encode_object(values) for values in objects) + "]"
+
+def encode_schedule(rows):
+    # the row shape is fixed, so it is formatted directly rather than key by key
+    return "[" + ",".join(
+        f'{{"Month":{row["Month"]},"Remaining balance":{row["Remaining balance"]},"Monthly payment":{row["Monthly payment"]}}}'
+        for row in rows
+    ) + "]"
+
+def encode_columnar_schedule(rows):
+    months, balances, payments = [], [], []
+    for row in rows:
+        months.append(str(row["Month"]))
+        balances.append(str(row["Remaining balance"]))
+        payments.append(str(row["Monthly payment"]))
+    return f'{{"month":[{",".join(months)}],"balance":[{",".join(balances)}],"payment":[{",".join(payments)}]}}'
+
+def _encode_loan_fields(loan, fields):
+    # loans are rows of the selected columns; Decimals are quoted, as pydantic serializes them
+    return ",".join(
+        f'{_encode_key(field)}:"{value}"' if isinstance(value, Decimal) else f"{_encode_key(field)}:{_encode_value(value)}"
+        for field, value in zip(fields, loan)
+    )
+
+def encode_loans(loans, fields):
+    return "[" + ",".join("{" + _encode_loan_fields(loan, fields) + "}" for loan in loans) + "]"
+
+def encode_loans_with_summaries(loans, fields, summaries):
+    return "[" + ",".join(
+        "{" + _encode_loan_fields(loan, fields) + ',"summary":' + encode_object(summary) + "}"
+        for loan, summary in zip(loans, summaries)
+    ) + "]"
@@ -0,0 +1,246 @@
+import csv
+import json
+import os
+from contextlib import nullcontext
+from decimal import Decimal
+
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Session
+
+from app import config
+from app.batch_calculations import batch_loan_summaries, cents_to_decimal
+from app.financial_calculations import ModifiedAmortization
+from app.loan_modifications import checkpoints_by_loan
+from app.materialized_schedules import materialize_loans
+from app.portfolios import add_links
+from app.sharding import group_by_shard, on_shards
+from app.models import User, UserRead, Loan, LoanImport, UserLoanLink, RemoteLoanLink
+
+# Streaming import and export of the loan book (users, loans and the user-loan shares), used by `python -m cli
+# import` and `python -m cli export` to move it between environments. Records keep their ids, so loans and
+# shares refer to the same users on both sides. Files are CSV or JSONL and are read and written one record at
+# a time, so memory use does not grow with their size.
+
+class LoanBookError(Exception):
+    pass
+
+class BookKind:
+    def __init__(self, name, table, fields, validate):
+        self.name = name
+        self.table = table
+        self.fields = fields
+        self.validate = validate
+
+def _validate_model(model):
+    def validate(record):
+        try:
+            return model.model_validate(record).model_dump()
+        except ValidationError as e:
+            raise ValueError("; ".join(
+                f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()))
+    return validate
+
+def _validate_share(record):
+    try:
+        return {"user_id": int(record["user_id"]), "loan_id": int(record["loan_id"])}
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("user_id and loan_id must be integers")
+
+# import the users and loans before the shares that refer to them
+KINDS = {
+    "users": BookKind("users", User, ("id", "email", "first_name", "last_name"), _validate_model(UserRead)),
+    "loans": BookKind("loans", Loan, ("id", "amount", "annual_interest_rate", "term_months"), _validate_model(LoanImport)),
+    "shares": BookKind("shares", UserLoanLink, ("user_id", "loan_id"), _validate_share),
+}
+
+# with sharded storage, shares of loans on another shard than the user's are RemoteLoanLink rows; they are
+# exported with the other shares
+REMOTE_SHARES = BookKind("shares", RemoteLoanLink, ("user_id", "loan_id"), _validate_share)
+
+def export_kinds(kind):
+    return (kind, REMOTE_SHARES) if kind is KINDS["shares"] else (kind,)
+
+SUMMARY_FIELDS = ("current principal balance", "principal already paid", "interest already paid")
+
+def file_format(path, requested_format=None):
+    if requested_format:
+        return requested_format
+    extension = os.path.splitext(str(path))[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise LoanBookError(f"Cannot tell the format of {path}; use --format csv or --format jsonl")
+
+def iter_records(stream, format):
+    if format == "csv":
+        yield from csv.DictReader(stream)
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise LoanBookError(f"line {line_number}: invalid JSON: {e}")
+
+# Checkpoints record how many records of a file are committed. They are written after each chunk's commit;
+# a crash between the two only means the chunk is offered again on resume, and rows whose id (or email) is
+# already present are skipped rather than inserted twice.
+def read_checkpoint(path, kind):
+    try:
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except FileNotFoundError:
+        return 0
+    if checkpoint.get("kind") != kind.name:
+        raise LoanBookError(f"{path} is a checkpoint of a {checkpoint.get('kind')} import, not {kind.name}")
+    return checkpoint["records"]
+
+def write_checkpoint(path, kind, records):
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as checkpoint_file:
+        json.dump({"kind": kind.name, "records": records}, checkpoint_file)
+    os.replace(temporary_path, path)
+
+def _insert_chunk(session: Session, kind, rows):
+    # ON CONFLICT DO NOTHING keeps re-imports and resumed imports idempotent; RETURNING yields only new rows
+    statement = insert(kind.table).on_conflict_do_nothing()
+    if kind.table is UserLoanLink:
+        # checked up front (the foreign keys would also refuse them) so that the error names the missing rows
+        user_ids = {row["user_id"] for row in rows}
+        loan_ids = {row["loan_id"] for row in rows}
+        missing_user_ids = user_ids - set(session.execute(select(User.id).where(User.id.in_(user_ids))).scalars())
+        missing_loan_ids = loan_ids - set(session.execute(select(Loan.id).where(Loan.id.in_(loan_ids))).scalars())
+        if missing_user_ids or missing_loan_ids:
+            session.rollback()
+            raise LoanBookError(f"shares refer to users {sorted(missing_user_ids)} and loans {sorted(missing_loan_ids)}, "
+                                "which do not exist; import the users and loans first")
+        links = session.execute(statement.returning(UserLoanLink.user_id, UserLoanLink.loan_id), rows).all()
+        if config.PORTFOLIO_ROLLUPS:
+            add_links(session, links)
+        return len(links)
+    inserted_ids = set(session.execute(statement.returning(kind.table.id), rows).scalars())
+    if kind.table is Loan and config.MATERIALIZE_SCHEDULES and inserted_ids:
+        materialize_loans(session, [Loan(**row) for row in rows if row["id"] in inserted_ids])
+    return len(inserted_ids)
+
+def _insert_remote_shares(router, session, rows):
+    user_ids = {row["user_id"] for row in rows}
+    missing_user_ids = user_ids - set(session.execute(select(User.id).where(User.id.in_(user_ids))).scalars())
+    existing_loan_ids = on_shards(router, session, list({row["loan_id"] for row in rows}), lambda shard_session, loan_ids: {
+        loan_id: True for loan_id in shard_session.execute(select(Loan.id).where(Loan.id.in_(loan_ids))).scalars()})
+    missing_loan_ids = {row["loan_id"] for row in rows} - set(existing_loan_ids)
+    if missing_user_ids or missing_loan_ids:
+        session.rollback()
+        raise LoanBookError(f"shares refer to users {sorted(missing_user_ids)} and loans {sorted(missing_loan_ids)}, "
+                            "which do not exist; import the users and loans first")
+    return len(session.execute(insert(RemoteLoanLink).on_conflict_do_nothing().returning(RemoteLoanLink.loan_id), rows).all())
+
+def _insert_sharded_chunk(router, session, kind, rows):
+    # Users and loans go to the shard of their id, and shares to the user's shard (as a RemoteLoanLink when the
+    # loan is on another one). session is shard 0's. Each shard's rows are committed separately; a chunk
+    # interrupted between two shards is offered again on resume, like any other.
+    shard_key = "user_id" if kind.table is UserLoanLink else "id"
+    inserted = 0
+    for shard, shard_rows in group_by_shard(router, rows, lambda row: router.shard_for_id(row[shard_key])).items():
+        with (nullcontext(session) if shard == 0 else router.session(shard)) as shard_session:
+            local_rows = [row for row in shard_rows if kind.table is not UserLoanLink or router.shard_for_id(row["loan_id"]) == shard]
+            remote_rows = [row for row in shard_rows if kind.table is UserLoanLink and router.shard_for_id(row["loan_id"]) != shard]
+            if local_rows:
+                inserted += _insert_chunk(shard_session, kind, local_rows)
+            if remote_rows:
+                inserted += _insert_remote_shares(router, shard_session, remote_rows)
+            shard_session.commit()
+    return inserted
+
+def import_records(session: Session, kind, records, chunk_size=10000, checkpoint_path=None, progress=None, router=None):
+    # Inserts the records chunk_size per transaction. With a checkpoint_path, records committed by an earlier
+    # run are skipped and the checkpoint is advanced after every chunk. Returns (records read, rows inserted);
+    # rows already in the database are counted as read but not inserted. An invalid record stops the import
+    # with its record number, after the chunks before it have been committed. With sharded storage (router),
+    # session is shard 0's and the records are spread over the shards by their ids.
+    skip = read_checkpoint(checkpoint_path, kind) if checkpoint_path else 0
+    counts = {"read": 0, "inserted": 0}
+    chunk = []
+
+    def commit_chunk():
+        if router is not None:
+            counts["inserted"] += _insert_sharded_chunk(router, session, kind, chunk)
+        else:
+            counts["inserted"] += _insert_chunk(session, kind, chunk)
+            session.commit()
+        counts["read"] += len(chunk)
+        chunk.clear()
+        if checkpoint_path:
+            write_checkpoint(checkpoint_path, kind, skip + counts["read"])
+        if progress:
+            progress(counts["read"])
+
+    for record_number, record in enumerate(records, start=1):
+        if record_number <= skip:
+            continue
+        try:
+            chunk.append(kind.validate(record))
+        except ValueError as e:
+            raise LoanBookError(f"{kind.name} record {record_number}: {e}")
+        if len(chunk) == chunk_size:
+            commit_chunk()
+    if chunk:
+        commit_chunk()
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return counts["read"], counts["inserted"]
+
+def iter_export(connection, kind, summary_month=None, chunk_size=10000):
+    # Yields one dict per record, in id order. The rows come through a streaming cursor chunk_size at a time
+    # (SQLite's cursors step through the result lazily, so nothing is prefetched), and month summaries are
+    # evaluated per chunk with the vectorized batch calculator, so memory stays constant however large the book
+    # is. Loans whose term ends before summary_month report as paid off.
+    # Modified loans (see app.loan_modifications) are summarized from their checkpoints instead.
+    statement = select(*(getattr(kind.table, field) for field in kind.fields)).order_by(
+        *kind.table.__table__.primary_key.columns)
+    result = connection.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(statement)
+    for rows in result.partitions(chunk_size):
+        records = [dict(zip(kind.fields, row)) for row in rows]
+        if summary_month is not None and records:
+            summaries = batch_loan_summaries(
+                [record["amount"] for record in records],
+                [record["annual_interest_rate"] for record in records],
+                [record["term_months"] for record in records],
+                summary_month)
+            checkpoints = checkpoints_by_loan(connection, [record["id"] for record in records])
+            for index, record in enumerate(records):
+                record["month"] = summary_month
+                for field in SUMMARY_FIELDS:
+                    record[field] = cents_to_decimal(summaries[field][index])
+                if record["id"] in checkpoints:
+                    record.update(ModifiedAmortization(
+                        record["amount"], record["annual_interest_rate"], record["term_months"], checkpoints[record["id"]]
+                    ).summary(min(summary_month, record["term_months"])))
+        yield from records
+
+def export_fields(kind, summary_month=None):
+    if summary_month is None:
+        return kind.fields
+    return kind.fields + ("month",) + SUMMARY_FIELDS
+
+def write_records(stream, format, fields, records, progress=None, progress_every=10000):
+    # Decimals are written as strings, so amounts survive the round trip with their full precision
+    if format == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(fields)
+    written = 0
+    for record in records:
+        if format == "csv":
+            writer.writerow([record[field] for field in fields])
+        else:
+            stream.write(json.dumps(
+                {field: str(record[field]) if isinstance(record[field], Decimal) else record[field] for field in fields}) + "\n")
+        written += 1
+        if progress and written % progress_every == 0:
+            progress(written)
+    if progress and written % progress_every:
+        progress(written)
+    return written
@@ -0,0 +1,131 @@
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.financial_calculations import ModifiedAmortization, ZERO_BALANCE
+from app.models import Loan, LoanCheckpoint, LoanEvent, LoanEventKind
+
+# Loan modifications: prepayments and rate resets are recorded as dated events (loan_event), and from them each
+# modified loan keeps checkpoints (loan_checkpoint): its balance, interest paid and rate at the end of the month
+# before the rest of the loan is re-amortized. Reads compute a modified loan from its checkpoints (see
+# ModifiedAmortization). A new event only recomputes the checkpoints from the month it takes effect, starting
+# from the last checkpoint before it, so the months before it are left exactly as they were.
+
+# SQLite caps the number of bound parameters per statement, so large IN (...) lookups are split up
+LOAN_ID_LOOKUP_CHUNK_SIZE = 10000
+
+class LoanModification:
+    def __init__(self, loan, event_id, previous_checkpoints, checkpoints, from_month):
+        self.loan = loan
+        self.event_id = event_id
+        self.previous_checkpoints = previous_checkpoints
+        self.checkpoints = checkpoints
+        # the first month whose schedule row or summary may have changed
+        self.from_month = from_month
+
+def checkpoint_month(event):
+    # a prepayment lowers the balance at the end of its month; a rate reset changes the months from its own on
+    return event.month if event.kind is LoanEventKind.prepayment else event.month - 1
+
+def validate_event(event, term_months):
+    if event.month > term_months:
+        raise ValueError(f"Month must be less than or equal to the loan term of {term_months} months")
+    if event.kind is LoanEventKind.prepayment and event.month == term_months:
+        raise ValueError(f"The loan is paid off by its final payment in month {term_months}; a prepayment must come before it")
+
+def rebuild_checkpoints(amount, annual_interest_rate, term_months, checkpoints, events, from_month):
+    # The loan's checkpoints with those from from_month on recomputed from the events that take effect there or
+    # later (in the order given); the ones before from_month are kept. Raises ValueError for a prepayment
+    # larger than the balance left at its month.
+    checkpoints = [checkpoint for checkpoint in checkpoints if checkpoint[0] < from_month]
+    events_by_month = {}
+    for event in events:
+        month = checkpoint_month(event)
+        if month >= from_month:
+            events_by_month.setdefault(month, []).append(event)
+    for month in sorted(events_by_month):
+        calculation = ModifiedAmortization(amount, annual_interest_rate, term_months, checkpoints)
+        if month:
+            summary = calculation.summary(month)
+            balance, interest_paid = summary["current principal balance"], summary["interest already paid"]
+        else:
+            balance, interest_paid = amount, ZERO_BALANCE
+        rate = calculation.rate_after(month)
+        for event in events_by_month[month]:
+            if event.kind is LoanEventKind.rate_reset:
+                rate = event.annual_interest_rate
+            elif event.amount > balance:
+                raise ValueError(
+                    f"The prepayment of {event.amount} in month {event.month} exceeds the remaining balance of {balance}")
+            else:
+                balance -= event.amount
+        checkpoints.append((month, balance, rate, interest_paid))
+    return tuple(checkpoints)
+
+def _select_checkpoints(loan_ids):
+    return (
+        select(LoanCheckpoint.loan_id, LoanCheckpoint.month, LoanCheckpoint.balance,
+               LoanCheckpoint.annual_interest_rate, LoanCheckpoint.interest_paid)
+        .where(LoanCheckpoint.loan_id.in_(loan_ids))
+        .order_by(LoanCheckpoint.loan_id, LoanCheckpoint.month))
+
+def _group_checkpoints(rows, checkpoints):
+    # plain tuples, so that they can be hashed into cache keys and sent to the compute pool
+    for loan_id, *checkpoint in rows:
+        checkpoints.setdefault(loan_id, []).append(tuple(checkpoint))
+
+def checkpoints_by_loan(session, loan_ids):
+    # {loan id: checkpoints} for the modified loans among loan_ids; session may also be a Connection
+    loan_ids = list(loan_ids)
+    checkpoints = {}
+    for start in range(0, len(loan_ids), LOAN_ID_LOOKUP_CHUNK_SIZE):
+        _group_checkpoints(session.execute(_select_checkpoints(loan_ids[start:start + LOAN_ID_LOOKUP_CHUNK_SIZE])), checkpoints)
+    return {loan_id: tuple(loan_checkpoints) for loan_id, loan_checkpoints in checkpoints.items()}
+
+async def checkpoints_by_loan_async(session: AsyncSession, loan_ids):
+    loan_ids = list(loan_ids)
+    checkpoints = {}
+    for start in range(0, len(loan_ids), LOAN_ID_LOOKUP_CHUNK_SIZE):
+        rows = await session.execute(_select_checkpoints(loan_ids[start:start + LOAN_ID_LOOKUP_CHUNK_SIZE]))
+        _group_checkpoints(rows, checkpoints)
+    return {loan_id: tuple(loan_checkpoints) for loan_id, loan_checkpoints in checkpoints.items()}
+
+def loan_checkpoints(session, loan):
+    # the checkpoints of a loan row or object; unmodified loans have none and need no query
+    if not loan.modification_count:
+        return ()
+    return checkpoints_by_loan(session, [loan.id]).get(loan.id, ())
+
+async def add_loan_event(session: AsyncSession, loan_id, event):
+    # Records the event and recomputes the loan's checkpoints from the month it takes effect, in the caller's
+    # transaction (the caller commits, or rolls back on ValueError). Returns a LoanModification, or None when
+    # the loan does not exist.
+    # The count is bumped first: that takes SQLite's write lock, so the checkpoints read next can't be changed
+    # by a concurrent modification of the same loan before this one commits.
+    loan = (await session.execute(
+        update(Loan).where(Loan.id == loan_id).values(modification_count=Loan.modification_count + 1)
+        .returning(Loan.id, Loan.amount, Loan.annual_interest_rate, Loan.term_months, Loan.modification_count))).first()
+    if loan is None:
+        return None
+    validate_event(event, loan.term_months)
+    from_month = checkpoint_month(event)
+    previous_checkpoints = ()
+    later_events = []
+    if loan.modification_count > 1:
+        previous_checkpoints = (await checkpoints_by_loan_async(session, [loan_id])).get(loan_id, ())
+        # a superset of the events taking effect from from_month on; rebuild_checkpoints picks them out
+        later_events = (await session.execute(
+            select(LoanEvent.kind, LoanEvent.month, LoanEvent.amount, LoanEvent.annual_interest_rate)
+            .where(LoanEvent.loan_id == loan_id, LoanEvent.month >= from_month)
+            .order_by(LoanEvent.id))).all()
+    checkpoints = rebuild_checkpoints(
+        loan.amount, loan.annual_interest_rate, loan.term_months, previous_checkpoints, [*later_events, event], from_month)
+    event_id = (await session.execute(
+        insert(LoanEvent).values(loan_id=loan_id, **event.model_dump()).returning(LoanEvent.id))).scalar_one()
+    if any(checkpoint[0] >= from_month for checkpoint in previous_checkpoints):
+        await session.execute(
+            delete(LoanCheckpoint).where(LoanCheckpoint.loan_id == loan_id, LoanCheckpoint.month >= from_month))
+    await session.execute(insert(LoanCheckpoint), [
+        {"loan_id": loan_id, "month": month, "balance": balance, "annual_interest_rate": rate, "interest_paid": interest_paid}
+        for month, balance, rate, interest_paid in checkpoints if month >= from_month
+    ])
+    return LoanModification(loan, event_id, previous_checkpoints, checkpoints, max(from_month, 1))
@@ -1,105 +1,496 @@
-from fastapi import FastAPI, Depends, HTTPException, Path
+from fastapi import FastAPI, Depends, HTTPException, Path, Query, Header, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import select, Session
-from typing import List
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 
-from app.database import create_db_and_tables, get_session
-from app.models import User, UserCreate, UserRead, Loan, LoanCreate, LoanRead, UserLoanLink
-from app.financial_calculations import amortization_schedule, loan_summary_for_month
+from app import config
+from app.database import ShardRouter, create_db_and_tables, get_session, get_read_session, get_async_session, get_async_read_session, get_shard_router
+from app.models import User, UserCreate, UserRead, Loan, LoanCreate, LoanRead, UserLoanLink, RemoteLoanLink, LoanEvent, LoanEventCreate, LoanEventRead, LoanBatchSummaryRequest, QuoteScheduleRequest, QuoteSummaryRequest
+from app.metrics import MetricsMiddleware, metrics_registry
+from app.compute_pool import ComputePoolFull, ComputeTimeout, compute_pool
+from app.schedule_cache import schedule_cache
+from app.single_flight import SingleFlight
+from app.http_caching import loan_etag, matches_if_none_match, cache_headers, not_modified
+from app.quotes import quote_schedules, quote_summary
+from app.materialized_schedules import materialize_loans_async, rematerialize_tail_async, fetch_materialized_schedule, fetch_materialized_summaries
+from app.loan_modifications import add_loan_event, checkpoints_by_loan, checkpoints_by_loan_async, loan_checkpoints
+from app.batch_calculations import batch_loan_summaries, cents_to_decimal
+from app.portfolios import add_links_async, compute_contributions, modify_loan_async, portfolio_summary, select_portfolio_month, stored_contributions_async
+from app.sharding import email_predates_sharding, merge_loan_pages, next_id, on_shard, on_shards, on_shards_async, remote_loans
+from app.bulk import iter_request_items, bulk_insert_users, bulk_insert_loans
+from app.streaming import ScheduleFormat, MEDIA_TYPES, negotiate_schedule_format, iter_schedule_ndjson, iter_schedule_csv
+from app.json_encoding import FastJSONResponse, encode_object, encode_objects, encode_schedule, encode_columnar_schedule, encode_loans, encode_loans_with_summaries
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
+
+# Identical concurrent requests (e.g. a popular shared loan opened by many servicers at once) share one
+# computation of the response body. The keys are the responses' ETags, which cover the loan terms, the
+# calculation engine and every parameter of the representation.
+schedule_flight = SingleFlight("schedule")
+summary_flight = SingleFlight("summary")
+summaries_flight = SingleFlight("summaries")
+
+# SQLite caps the number of bound parameters per statement, so large IN (...) lookups are split up
+LOAN_ID_LOOKUP_CHUNK_SIZE = 10000
 
 @app.on_event("startup")
 def on_startup():
     create_db_and_tables()
 
+@app.on_event("shutdown")
+def on_shutdown():
+    compute_pool.shutdown()
+
+@app.exception_handler(ComputePoolFull)
+def compute_pool_full_handler(request: Request, exc: ComputePoolFull):
+    # backpressure: the compute pool's queue is full, so the client should retry shortly rather than pile on
+    return JSONResponse(status_code=503, content={"detail": "Calculation capacity exhausted, retry later"},
+                        headers={"Retry-After": str(config.COMPUTE_RETRY_AFTER_SECONDS)})
+
+@app.exception_handler(ComputeTimeout)
+def compute_timeout_handler(request: Request, exc: ComputeTimeout):
+    return JSONResponse(status_code=503, content={"detail": "Calculation timed out, retry later"},
+                        headers={"Retry-After": str(config.COMPUTE_RETRY_AFTER_SECONDS)})
+
 @app.post("/users/", response_model=UserRead)
-def create_user(user: UserCreate, session: Session = Depends(get_session)):
-    # check if user email already exists
-    statement = select(User).where(User.email == user.email)
-    result = session.execute(statement)
-    existing_user = result.scalars().first()
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Email already exists")
-    # assuming email doesn't already exist, add the user to the db:
-    db_user = User.model_validate(user)
-    session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
-    return db_user
+async def create_user(user: UserCreate, session: AsyncSession = Depends(get_async_session),
+                      router: ShardRouter = Depends(get_shard_router)):
+    # one statement: the unique index on email detects an existing user, in which case nothing is inserted
+    user_values = user.model_dump()
+    insert_user = insert(User).values(**user_values)
+    shard = router.shard_for_email(user.email) if router else None
+    if shard is not None:
+        if await email_predates_sharding(router, session, user.email, shard):
+            raise HTTPException(status_code=400, detail="Email already exists")
+        insert_user = insert_user.values(id=next_id(User, shard))
+    insert_user = insert_user.on_conflict_do_nothing(index_elements=["email"]).returning(User.id)
+    async with on_shard(router, session, shard) as session:
+        user_id = (await session.execute(insert_user)).scalar_one_or_none()
+        if user_id is None:
+            raise HTTPException(status_code=400, detail="Email already exists")
+        await session.commit()
+    return {"id": user_id, **user_values}
+
+@app.post("/users/bulk")
+async def create_users_bulk(request: Request,
+                            chunk_size: int = Query(config.BULK_INSERT_CHUNK_SIZE, ge=1, le=config.BULK_INSERT_MAX_CHUNK_SIZE),
+                            session: AsyncSession = Depends(get_async_session),
+                            router: ShardRouter = Depends(get_shard_router)):
+    # accepts a JSON array or an NDJSON stream of users; each result carries the index of the item it belongs to
+    return await bulk_insert_users(session, iter_request_items(request), chunk_size, router)
 
 @app.post("/loans/", response_model=LoanRead)
-def create_loan(loan_create: LoanCreate, session: Session = Depends(get_session)):
-    # check that the User for whom the loan is being created exists
-    user = session.get(User, loan_create.user_id)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    # Create and add the new loan to the session
-    loan = Loan(
-        amount=loan_create.amount, 
-        annual_interest_rate=loan_create.annual_interest_rate, 
-        term_months=loan_create.term_months)
-    db_loan = Loan.model_validate(loan)
-    session.add(db_loan)
-    session.commit()
-    session.refresh(db_loan)
-    # Link the loan to the user
-    loan_user_record = UserLoanLink(
-        user_id=loan_create.user_id, 
-        loan_id=db_loan.id)
-    session.add(loan_user_record)
-    session.commit()
-
-    return db_loan
+async def create_loan(loan_create: LoanCreate, session: AsyncSession = Depends(get_async_session),
+                      router: ShardRouter = Depends(get_shard_router)):
+    # One transaction: the loan is inserted and linked to the user, and the link's foreign key rejects a user
+    # that doesn't exist, which rolls the loan back too. RETURNING hands back the values as stored. With
+    # sharded storage, the loan goes to its owner's shard. The loan's portfolio contribution is computed before
+    # the transaction starts.
+    contributions = await compute_contributions([loan_create]) if config.PORTFOLIO_ROLLUPS else None
+    insert_loan = insert(Loan).values(**loan_create.model_dump(exclude={"user_id"}))
+    shard = router.shard_for_id(loan_create.user_id) if router else None
+    if shard is not None:
+        insert_loan = insert_loan.values(id=next_id(Loan, shard))
+    insert_loan = insert_loan.returning(Loan.id, Loan.amount, Loan.annual_interest_rate, Loan.term_months)
+    async with on_shard(router, session, shard) as session:
+        loan = (await session.execute(insert_loan)).one()
+        try:
+            await session.execute(insert(UserLoanLink).values(user_id=loan_create.user_id, loan_id=loan.id))
+        except IntegrityError:
+            await session.rollback()
+            raise HTTPException(status_code=404, detail="User not found")
+        if config.MATERIALIZE_SCHEDULES:
+            await materialize_loans_async(session, [loan])
+        if config.PORTFOLIO_ROLLUPS:
+            await add_links_async(session, [(loan_create.user_id, loan.id)], contributions={loan.id: contributions[0]})
+        await session.commit()
+    return loan._asdict()
+
+@app.post("/loans/bulk")
+async def create_loans_bulk(request: Request,
+                            chunk_size: int = Query(config.BULK_INSERT_CHUNK_SIZE, ge=1, le=config.BULK_INSERT_MAX_CHUNK_SIZE),
+                            session: AsyncSession = Depends(get_async_session),
+                            router: ShardRouter = Depends(get_shard_router)):
+    # each chunk inserts its loans and their UserLoanLink rows in a single transaction (one per shard)
+    return await bulk_insert_loans(session, iter_request_items(request), chunk_size, router)
 
 @app.get("/loan/{loan_id}/schedule")
 def fetch_loan_schedule(
+    request: Request,
     loan_id: int = Path(..., description="The ID of the loan to fetch the schedule for"), 
-    session: Session = Depends(get_session)):
+    format: Optional[ScheduleFormat] = Query(None, description="Response format; streaming formats can also be requested via the Accept header"),
+    from_month: Optional[int] = Query(None, ge=1, description="First month of the window to return (default 1)"),
+    to_month: Optional[int] = Query(None, ge=1, description="Last month of the window to return (default and maximum: the loan term)"),
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    session: Session = Depends(get_read_session)):
+    from_month = from_month or 1
+    if to_month is not None and to_month < from_month:
+        raise HTTPException(status_code=400, detail="to_month must be greater than or equal to from_month")
     loan = session.get(Loan, loan_id)
     if not loan:
         raise HTTPException(status_code=404, detail="Loan not found")
-    schedule = amortization_schedule(loan)
-    return schedule
+    if from_month > loan.term_months:
+        raise HTTPException(status_code=400, detail=f"from_month must be less than or equal to the loan term of {loan.term_months} months")
+    to_month = min(to_month or loan.term_months, loan.term_months)
+    checkpoints = loan_checkpoints(session, loan)
+    schedule_format = negotiate_schedule_format(format, accept)
+    etag = loan_etag(loan, "schedule", schedule_format.value, from_month, to_month, checkpoints=checkpoints)
+    # the format can be negotiated through Accept, so caches must key on it
+    headers = {**cache_headers(etag, config.CACHE_CONTROL_SCHEDULE), "Vary": "Accept"}
+    if to_month < loan.term_months:
+        window_size = to_month - from_month + 1
+        next_window_url = request.url.include_query_params(from_month=to_month + 1, to_month=to_month + window_size)
+        headers["Link"] = f'<{next_window_url}>; rel="next"'
+    if matches_if_none_match(if_none_match, etag):
+        return not_modified(headers)
+    # a materialized window is one indexed range read; otherwise the window is computed
+    schedule = fetch_materialized_schedule(session, loan_id, from_month, to_month) if config.MATERIALIZE_SCHEDULES else None
+    if schedule_format in (ScheduleFormat.ndjson, ScheduleFormat.csv):
+        # stream the rows as they are generated rather than building the whole schedule first
+        if schedule is not None:
+            rows = iter(schedule)
+        else:
+            rows = schedule_cache.iter_schedule(
+                loan.amount, loan.annual_interest_rate, loan.term_months, from_month, to_month, checkpoints)
+        if schedule_format is ScheduleFormat.csv:
+            headers["Content-Disposition"] = f'attachment; filename="loan-{loan_id}-schedule.csv"'
+            return StreamingResponse(iter_schedule_csv(rows), media_type=MEDIA_TYPES[schedule_format], headers=headers)
+        return StreamingResponse(iter_schedule_ndjson(rows), media_type=MEDIA_TYPES[schedule_format], headers=headers)
+
+    def schedule_body():
+        rows = schedule
+        if rows is None:
+            if from_month == 1 and to_month == loan.term_months:
+                rows = schedule_cache.schedule(loan.amount, loan.annual_interest_rate, loan.term_months, checkpoints)
+            else:
+                rows = schedule_cache.window(
+                    from_month, to_month, loan.amount, loan.annual_interest_rate, loan.term_months, checkpoints)
+        if schedule_format is ScheduleFormat.columnar:
+            return encode_columnar_schedule(rows)
+        return encode_schedule(rows)
+
+    return FastJSONResponse(schedule_flight.do(etag, schedule_body), headers=headers)
 
 @app.get("/loan/{loan_id}/summary/{month}")
 def fetch_loan_summary(loan_id: int = Path(..., description="The ID of the loan to fetch the summary for"),
                        month: int = Path(..., ge=1, description="The month number to fetch the summary for"), 
-                       session: Session = Depends(get_session)):
+                       if_none_match: Optional[str] = Header(None),
+                       session: Session = Depends(get_read_session)):
     loan = session.get(Loan, loan_id)
     if not loan:
         raise HTTPException(status_code=404, detail="Loan not found")
     if month > loan.term_months:
         raise HTTPException(status_code=400, detail=f"Month must be less than or equal to the loan term of {loan.term_months} months")
-    loan_summary = loan_summary_for_month(month, loan)
-    return loan_summary
+    checkpoints = loan_checkpoints(session, loan)
+    etag = loan_etag(loan, "summary", month, checkpoints=checkpoints)
+    headers = cache_headers(etag, config.CACHE_CONTROL_SUMMARY)
+    if matches_if_none_match(if_none_match, etag):
+        return not_modified(headers)
+
+    def summary_body():
+        if config.MATERIALIZE_SCHEDULES:
+            materialized = fetch_materialized_summaries(session, loan_id, [month])
+            if materialized is not None:
+                return encode_object(materialized[0])
+        loan_summary = schedule_cache.summary(month, loan.amount, loan.annual_interest_rate, loan.term_months, checkpoints)
+        return encode_object(loan_summary)
+
+    return FastJSONResponse(summary_flight.do(etag, summary_body), headers=headers)
+
+@app.get("/loan/{loan_id}/summaries")
+def fetch_loan_summaries(loan_id: int = Path(..., description="The ID of the loan to fetch the summaries for"),
+                         months: List[int] = Query(..., description="The month numbers to fetch summaries for"),
+                         if_none_match: Optional[str] = Header(None),
+                         session: Session = Depends(get_read_session)):
+    loan = session.get(Loan, loan_id)
+    if not loan:
+        raise HTTPException(status_code=404, detail="Loan not found")
+    if any(month < 1 or month > loan.term_months for month in months):
+        raise HTTPException(status_code=400, detail=f"Months must be between 1 and the loan term of {loan.term_months} months")
+    checkpoints = loan_checkpoints(session, loan)
+    etag = loan_etag(loan, "summaries", *months, checkpoints=checkpoints)
+    headers = cache_headers(etag, config.CACHE_CONTROL_SUMMARIES)
+    if matches_if_none_match(if_none_match, etag):
+        return not_modified(headers)
+
+    def summaries_body():
+        summaries = fetch_materialized_summaries(session, loan_id, months) if config.MATERIALIZE_SCHEDULES else None
+        if summaries is None:
+            summaries = schedule_cache.summaries(months, loan.amount, loan.annual_interest_rate, loan.term_months, checkpoints)
+        loan_summaries = [{"Month": month, **summary} for month, summary in zip(months, summaries)]
+        return encode_objects(loan_summaries)
+
+    return FastJSONResponse(summaries_flight.do(etag, summaries_body), headers=headers)
+
+def find_loans_by_id(session, loan_ids):
+    loans_by_id = {}
+    for start in range(0, len(loan_ids), LOAN_ID_LOOKUP_CHUNK_SIZE):
+        find_loans = select(Loan.id, Loan.amount, Loan.annual_interest_rate, Loan.term_months, Loan.modification_count).where(
+            Loan.id.in_(loan_ids[start:start + LOAN_ID_LOOKUP_CHUNK_SIZE]))
+        for loan in session.execute(find_loans):
+            loans_by_id[loan.id] = loan
+    return loans_by_id
+
+@app.post("/loans/batch/summary")
+def fetch_batch_loan_summary(batch_request: LoanBatchSummaryRequest, session: Session = Depends(get_read_session),
+                             router: ShardRouter = Depends(get_shard_router)):
+    # with sharded storage the loans are looked up on each of their shards
+    loan_ids = batch_request.loan_ids
+    loans_by_id = on_shards(router, session, loan_ids, find_loans_by_id)
+    missing_loan_ids = [loan_id for loan_id in loan_ids if loan_id not in loans_by_id]
+    if missing_loan_ids:
+        raise HTTPException(status_code=404, detail=f"Loans not found: {missing_loan_ids}")
+    loans = [loans_by_id[loan_id] for loan_id in loan_ids]
+    if any(batch_request.month > loan.term_months for loan in loans):
+        raise HTTPException(status_code=400, detail="Month must be less than or equal to the loan term of every loan in the batch")
+    summaries = batch_loan_summaries(
+        [loan.amount for loan in loans],
+        [loan.annual_interest_rate for loan in loans],
+        [loan.term_months for loan in loans],
+        batch_request.month)
+    columns = list(summaries.items())
+    loan_summaries = [{key: cents_to_decimal(values[index]) for key, values in columns} for index in range(len(loans))]
+    modified = [index for index, loan in enumerate(loans) if loan.modification_count]
+    if modified:
+        # the vectorized calculator only knows unmodified loans; modified ones are computed from their checkpoints
+        checkpoints = on_shards(router, session, list({loans[index].id for index in modified}), checkpoints_by_loan)
+        modified_summaries = schedule_cache.loan_summaries([
+            ((loans[index].amount, loans[index].annual_interest_rate, loans[index].term_months, checkpoints[loans[index].id]),
+             batch_request.month)
+            for index in modified
+        ])
+        for index, summary in zip(modified, modified_summaries):
+            loan_summaries[index] = summary
+    return FastJSONResponse(encode_objects(
+        {"loan_id": loan_id, **summary} for loan_id, summary in zip(loan_ids, loan_summaries)
+    ))
+
+@app.post("/quotes/schedule")
+def fetch_quote_schedules(quote_request: QuoteScheduleRequest):
+    # schedules for hypothetical loans, in request order; nothing is read from or written to the database
+    return FastJSONResponse("[" + ",".join(encode_schedule(schedule) for schedule in quote_schedules(quote_request.quotes)) + "]")
+
+@app.post("/quotes/summary")
+def fetch_quote_summaries(quote_request: QuoteSummaryRequest):
+    return FastJSONResponse(encode_objects(quote_summary(quote) for quote in quote_request.quotes))
+
+LOAN_FIELDS = ("id", "amount", "annual_interest_rate", "term_months")
+# full loans keep the field order Loan's response_model serialized them in
+LOAN_RESPONSE_FIELDS = ("annual_interest_rate", "term_months", "amount", "id")
+
+def select_loans_for_user(user_id, columns, after=None):
+    # Keyset pagination: filtering and ordering on the link's loan_id lets SQLite answer a page with a range scan
+    # of the userloanlink (user_id, loan_id) primary key index, with no OFFSET and no COUNT.
+    statement = select(*columns).join(UserLoanLink).where(UserLoanLink.user_id == user_id)
+    if after is not None:
+        statement = statement.where(UserLoanLink.loan_id > after)
+    return statement.order_by(UserLoanLink.loan_id)
+
+async def summary_loan_months(router, session, loans, month):
+    # the (loan terms, month) pairs to summarize loans at month; modified loans bring their checkpoints, read
+    # from their own shards
+    modified_loan_ids = [loan.id for loan in loans if loan.modification_count]
+    checkpoints = await on_shards_async(router, session, modified_loan_ids, checkpoints_by_loan_async) if modified_loan_ids else {}
+    return [
+        ((loan.amount, loan.annual_interest_rate, loan.term_months, checkpoints.get(loan.id, ())), min(month, loan.term_months))
+        for loan in loans
+    ]
 
 @app.get("/users/{user_id}/loans", response_model=List[Loan])
-def fetch_loans_for_user(user_id: int, session: Session = Depends(get_session)): 
-    user = session.get(User, user_id)
+async def fetch_loans_for_user(user_id: int,
+                               request: Request,
+                               limit: Optional[int] = Query(None, ge=1, le=config.LOANS_PAGE_MAX_LIMIT, description="Maximum number of loans to return"),
+                               after: Optional[int] = Query(None, description="Cursor from a previous page: only loans with a greater id are returned"),
+                               fields: Optional[str] = Query(None, description="Comma-separated loan fields to return, e.g. 'id'"),
+                               session: AsyncSession = Depends(get_async_read_session),
+                               router: ShardRouter = Depends(get_shard_router)):
+    user = await session.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    find_loans_by_user_id = select(Loan).join(UserLoanLink).where(UserLoanLink.user_id == user_id)
-    query_result = session.execute(find_loans_by_user_id)
-    loans = query_result.scalars().all()
-    if not loans:
+    response_fields = LOAN_RESPONSE_FIELDS
+    if fields is not None:
+        response_fields = list(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+        unknown_fields = [field for field in response_fields if field not in LOAN_FIELDS]
+        if unknown_fields or not response_fields:
+            raise HTTPException(status_code=400, detail=f"Unknown loan fields: {unknown_fields}; choose from {list(LOAN_FIELDS)}")
+    # Plain column rows rather than Loan objects, encoded straight to JSON: no ORM identity map and no
+    # response_model validation. The id is always selected for the cursor; encode_loans drops it when it is
+    # not one of the response fields, since it is then the trailing column.
+    columns = [getattr(Loan, field) for field in response_fields]
+    if "id" not in response_fields:
+        columns.append(Loan.id)
+    find_loans_by_user_id = select_loans_for_user(user_id, columns, after)
+    # one extra row tells us whether there is a next page
+    row_limit = limit + 1 if limit is not None else None
+    if limit is not None:
+        find_loans_by_user_id = find_loans_by_user_id.limit(row_limit)
+    query_result = await session.execute(find_loans_by_user_id)
+    loans = query_result.all()
+    # with sharded storage, loans shared with the user from other shards are merged in from theirs
+    loans = merge_loan_pages(loans, await remote_loans(router, session, user_id, columns, after, row_limit), row_limit)
+    if not loans and after is None:
         raise HTTPException(status_code=404, detail=f"No loans found for user with ID {user_id}")
-    return loans
+    headers = {}
+    if limit is not None and len(loans) > limit:
+        loans = loans[:limit]
+        next_cursor = loans[-1].id
+        headers["X-Next-Cursor"] = str(next_cursor)
+        headers["Link"] = f'<{request.url.include_query_params(after=next_cursor)}>; rel="next"'
+    return FastJSONResponse(encode_loans(loans, response_fields), headers=headers)
+
+@app.get("/users/{user_id}/loans/summary")
+async def fetch_loan_summaries_for_user(user_id: int,
+                                        request: Request,
+                                        month: int = Query(..., ge=1, description="The month number to summarize every loan at; loans with a shorter term report their final month"),
+                                        limit: Optional[int] = Query(None, ge=1, le=config.LOANS_PAGE_MAX_LIMIT, description="Maximum number of loans to return"),
+                                        after: Optional[int] = Query(None, description="Cursor from a previous page: only loans with a greater id are returned"),
+                                        session: AsyncSession = Depends(get_async_read_session),
+                                        router: ShardRouter = Depends(get_shard_router)):
+    # A user's loans, each with its month summary: the page the borrower portal used to assemble from
+    # /users/{id}/loans plus one /loan/{id}/summary/{month} per loan, in one request and one query.
+    # the trailing modification count is not encoded, like a trailing id in fetch_loans_for_user
+    columns = [getattr(Loan, field) for field in LOAN_RESPONSE_FIELDS] + [Loan.modification_count]
+    find_loans_by_user_id = select_loans_for_user(user_id, columns, after)
+    row_limit = limit + 1 if limit is not None else None
+    if limit is not None:
+        find_loans_by_user_id = find_loans_by_user_id.limit(row_limit)
+    loans = (await session.execute(find_loans_by_user_id)).all()
+    loans = merge_loan_pages(loans, await remote_loans(router, session, user_id, columns, after, row_limit), row_limit)
+    if not loans and after is None:
+        # only an empty page needs to know whether the user exists
+        if not await session.get(User, user_id):
+            raise HTTPException(status_code=404, detail="User not found")
+        raise HTTPException(status_code=404, detail=f"No loans found for user with ID {user_id}")
+    headers = {}
+    if limit is not None and len(loans) > limit:
+        loans = loans[:limit]
+        next_cursor = loans[-1].id
+        headers["X-Next-Cursor"] = str(next_cursor)
+        headers["Link"] = f'<{request.url.include_query_params(after=next_cursor)}>; rel="next"'
+    loan_months = await summary_loan_months(router, session, loans, month)
+    # the summaries are CPU work, so they are kept off the event loop
+    summaries = await run_in_threadpool(schedule_cache.loan_summaries, loan_months)
+    summaries = [{"Month": loan_month, **summary} for (_, loan_month), summary in zip(loan_months, summaries)]
+    return FastJSONResponse(encode_loans_with_summaries(loans, LOAN_RESPONSE_FIELDS, summaries), headers=headers)
+
+@app.get("/users/{user_id}/portfolio")
+async def fetch_portfolio(user_id: int,
+                          month: int = Query(..., ge=1, description="The month number to summarize the user's loans at; loans with a shorter term count as paid off"),
+                          session: AsyncSession = Depends(get_async_read_session),
+                          router: ShardRouter = Depends(get_shard_router)):
+    # The sums of the month summaries of every loan the user can see. With PORTFOLIO_ROLLUPS this reads one row
+    # of the user's rollup (see app.portfolios); otherwise, or when the user has no rollup yet (e.g. the loans
+    # predate the setting and rebuild-portfolios hasn't run), every loan is summarized. Rollups cover the loans on
+    # the user's shard, so with sharded storage the loans shared from other shards are summarized on top.
+    loan_count, totals = 0, [0, 0, 0]
+    loan_columns = [Loan.id, Loan.amount, Loan.annual_interest_rate, Loan.term_months, Loan.modification_count]
+    portfolio = None
+    if config.PORTFOLIO_ROLLUPS:
+        portfolio = (await session.execute(select_portfolio_month(user_id, month))).first()
+    if portfolio is not None:
+        loan_count, totals = portfolio.loan_count, list(portfolio[2:])
+        loans = []
+    else:
+        loans = (await session.execute(select_loans_for_user(user_id, loan_columns))).all()
+    loans += await remote_loans(router, session, user_id, loan_columns)
+    # a user without loans has an empty portfolio
+    if not loan_count and not loans and not await session.get(User, user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    if loans:
+        summaries = await run_in_threadpool(schedule_cache.loan_summaries, await summary_loan_months(router, session, loans, month))
+        loan_count += len(loans)
+        # summary amounts are Decimal cents, so scaleb(2) is exact
+        totals = [
+            total + sum(int(summary[field].scaleb(2)) for summary in summaries)
+            for total, field in zip(totals, ("current principal balance", "principal already paid", "interest already paid"))
+        ]
+    return FastJSONResponse(encode_object(portfolio_summary(loan_count, month, totals)))
 
 @app.post("/loans/{loan_id}/share")
-def share_loan(loan_id: int, target_user_id: int, session: Session = Depends(get_session)):
-    loan = session.get(Loan, loan_id)
-    if not loan:
-        raise HTTPException(status_code=404, detail="Loan not found")
-    target_user = session.get(User, target_user_id)
-    if not target_user:
+async def share_loan(loan_id: int, target_user_id: int, session: AsyncSession = Depends(get_async_session),
+                     router: ShardRouter = Depends(get_shard_router)):
+    # One statement on success: the primary key detects an existing link (nothing is inserted) and the foreign
+    # keys reject a missing loan or user. Only that failure looks up which of the two is missing.
+    if router is not None and router.shard_for_id(target_user_id) != router.shard_for_id(loan_id):
+        return await share_loan_across_shards(router, session, loan_id, target_user_id)
+    if config.PORTFOLIO_ROLLUPS:
+        # the loan's contribution is computed before the write transaction, which checks it is still current
+        loans, contributions = await stored_contributions_async(session, [loan_id])
+        if not loans:
+            raise HTTPException(status_code=404, detail="Loan not found")
+    insert_link = (insert(UserLoanLink).values(user_id=target_user_id, loan_id=loan_id)
+                   .on_conflict_do_nothing().returning(UserLoanLink.loan_id))
+    try:
+        inserted = (await session.execute(insert_link)).first()
+    except IntegrityError:
+        await session.rollback()
+        if not await session.get(Loan, loan_id):
+            raise HTTPException(status_code=404, detail="Loan not found")
         raise HTTPException(status_code=404, detail="Target user not found")
-    # check if User is already associated with Loan
-    existing_link_query = select(UserLoanLink).filter_by(user_id=target_user_id, loan_id=loan_id)
-    existing_link = session.execute(existing_link_query).first()
-    if existing_link:
+    if inserted is None:
         raise HTTPException(status_code=400, detail="User is already associated with this loan")
-    
-    loan_user_association = UserLoanLink(user_id=target_user_id, loan_id=loan_id)
-    session.add(loan_user_association)
-    session.commit()
+    if config.PORTFOLIO_ROLLUPS:
+        await add_links_async(session, [(target_user_id, loan_id)], loans, contributions)
+    await session.commit()
+    return {"message": f"Loan shared successfully with user {target_user_id}"}
+
+async def share_loan_across_shards(router, session, loan_id, target_user_id):
+    # The link is a RemoteLoanLink on the target user's shard, whose foreign key rejects a missing user; the
+    # loan's shard (the request's session) only confirms that the loan exists. Remote loans are not part of
+    # portfolio rollups, so there is nothing else to update.
+    if (await session.execute(select(Loan.id).where(Loan.id == loan_id))).first() is None:
+        raise HTTPException(status_code=404, detail="Loan not found")
+    insert_link = (insert(RemoteLoanLink).values(user_id=target_user_id, loan_id=loan_id)
+                   .on_conflict_do_nothing().returning(RemoteLoanLink.loan_id))
+    async with router.async_session(router.shard_for_id(target_user_id)) as target_session:
+        try:
+            inserted = (await target_session.execute(insert_link)).first()
+        except IntegrityError:
+            await target_session.rollback()
+            raise HTTPException(status_code=404, detail="Target user not found")
+        if inserted is None:
+            raise HTTPException(status_code=400, detail="User is already associated with this loan")
+        await target_session.commit()
     return {"message": f"Loan shared successfully with user {target_user_id}"}
+
+@app.post("/loans/{loan_id}/events", response_model=LoanEventRead)
+async def create_loan_event(loan_id: int, event: LoanEventCreate, session: AsyncSession = Depends(get_async_session)):
+    # A prepayment or rate reset. Only the loan's checkpoints (and materialized rows) from the month it takes
+    # effect are recomputed, and a cached schedule of the loan is extended from its unchanged months.
+    try:
+        modification = await add_loan_event(session, loan_id, event)
+    except ValueError as e:
+        await session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    if modification is None:
+        raise HTTPException(status_code=404, detail="Loan not found")
+    loan = modification.loan
+    if config.MATERIALIZE_SCHEDULES:
+        await rematerialize_tail_async(session, loan, modification.checkpoints, modification.from_month)
+    if config.PORTFOLIO_ROLLUPS:
+        await modify_loan_async(session, loan, modification.previous_checkpoints, modification.checkpoints, modification.from_month)
+    await session.commit()
+    await run_in_threadpool(
+        schedule_cache.modify, loan.amount, loan.annual_interest_rate, loan.term_months,
+        modification.previous_checkpoints, modification.checkpoints, modification.from_month)
+    return {"id": modification.event_id, "loan_id": loan_id, **event.model_dump()}
+
+@app.get("/loans/{loan_id}/events", response_model=List[LoanEventRead])
+async def fetch_loan_events(loan_id: int, session: AsyncSession = Depends(get_async_read_session)):
+    find_events = select(LoanEvent).where(LoanEvent.loan_id == loan_id).order_by(LoanEvent.month, LoanEvent.id)
+    events = (await session.execute(find_events)).scalars().all()
+    if not events and not await session.get(Loan, loan_id):
+        raise HTTPException(status_code=404, detail="Loan not found")
+    return events
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def fetch_metrics():
+    # Prometheus text exposition format. Rendered on the event loop, the only thread that updates the route
+    # metrics (see app.metrics.MetricsRegistry), so they can't change while they are read.
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
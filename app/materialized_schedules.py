@@ -0,0 +1,141 @@
+from decimal import Decimal
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import Session
+
+from app.financial_calculations import ModifiedAmortization, amortization
+from app.loan_modifications import checkpoints_by_loan
+from app.metrics import timed_calculation
+from app.models import Loan, LoanScheduleRow
+
+# Optional materialized schedules (MATERIALIZE_SCHEDULES): each loan's schedule is written to loan_schedule_row
+# when the loan is created, or by `python -m cli backfill-schedules` for existing loans, so schedule and summary
+# reads become primary-key range and point lookups. Amounts are integer cents, which keeps SQL-side sums exact.
+# Rows hold exactly what the computed endpoints return: balances come from the same recurrence as a cached
+# schedule, and the cumulative columns are the month's summary.
+
+def _to_cents(value):
+    return int(value.scaleb(2))
+
+def _from_cents(cents):
+    return Decimal(cents).scaleb(-2)
+
+def _schedule_row(loan_id, month, payment, summary):
+    return {
+        "loan_id": loan_id,
+        "month": month,
+        "balance_cents": _to_cents(summary["current principal balance"]),
+        "payment_cents": _to_cents(payment),
+        "cumulative_principal_cents": _to_cents(summary["principal already paid"]),
+        "cumulative_interest_cents": _to_cents(summary["interest already paid"]),
+    }
+
+@timed_calculation
+def schedule_rows(loan_id, amount, annual_interest_rate, term_months, checkpoints=(), from_month=1):
+    # the rows from from_month on; a modified loan's come from its checkpoints (see app.loan_modifications)
+    if checkpoints:
+        calculation = ModifiedAmortization(amount, annual_interest_rate, term_months, checkpoints)
+        return [_schedule_row(loan_id, month, payment, summary) for month, payment, summary in calculation.iter_months(from_month)]
+    calculation = amortization(amount, annual_interest_rate, term_months)
+    return [
+        _schedule_row(loan_id, month, calculation.rounded_payment, calculation.summary(month, balance))
+        for month, balance in enumerate(calculation.balances(from_month), start=from_month)
+    ]
+
+def _rows_for_loans(loans, checkpoints=None):
+    checkpoints = checkpoints or {}
+    return [
+        row for loan in loans
+        for row in schedule_rows(loan.id, loan.amount, loan.annual_interest_rate, loan.term_months, checkpoints.get(loan.id, ()))
+    ]
+
+def materialize_loans(session: Session, loans, checkpoints=None):
+    # one executemany for all the loans' rows; the caller commits. checkpoints maps the ids of modified loans
+    # to their checkpoints.
+    rows = _rows_for_loans(loans, checkpoints)
+    if rows:
+        session.execute(insert(LoanScheduleRow), rows)
+
+async def materialize_loans_async(session: AsyncSession, loans):
+    rows = _rows_for_loans(loans)
+    if rows:
+        await session.execute(insert(LoanScheduleRow), rows)
+
+async def rematerialize_tail_async(session: AsyncSession, loan, checkpoints, from_month):
+    # After a modification, rewrites a materialized loan's rows from from_month on. A loan without rows is left
+    # alone: a partial schedule would be read as the whole one.
+    deleted = await session.execute(
+        delete(LoanScheduleRow).where(LoanScheduleRow.loan_id == loan.id, LoanScheduleRow.month >= from_month))
+    if deleted.rowcount:
+        await session.execute(insert(LoanScheduleRow), schedule_rows(
+            loan.id, loan.amount, loan.annual_interest_rate, loan.term_months, checkpoints, from_month))
+
+def _summary_from_row(row):
+    return {
+        "current principal balance": _from_cents(row.balance_cents),
+        "principal already paid": _from_cents(row.cumulative_principal_cents),
+        "interest already paid": _from_cents(row.cumulative_interest_cents),
+    }
+
+def fetch_materialized_schedule(session: Session, loan_id, from_month=1, to_month=None):
+    # None when the window has no materialized rows (the loan does not exist, is not materialized, or ends before
+    # from_month), so the caller falls back to computing
+    statement = (
+        select(LoanScheduleRow.month, LoanScheduleRow.balance_cents, LoanScheduleRow.payment_cents)
+        .where(LoanScheduleRow.loan_id == loan_id, LoanScheduleRow.month >= from_month)
+        .order_by(LoanScheduleRow.month))
+    if to_month is not None:
+        statement = statement.where(LoanScheduleRow.month <= to_month)
+    rows = session.execute(statement).all()
+    if not rows:
+        return None
+    # the payment only changes where a modification re-amortized the loan, so each amount is converted once
+    payments = {payment_cents: _from_cents(payment_cents) for payment_cents in {row.payment_cents for row in rows}}
+    return [
+        {"Month": month, "Remaining balance": _from_cents(balance_cents), "Monthly payment": payments[payment_cents]}
+        for month, balance_cents, payment_cents in rows
+    ]
+
+def fetch_materialized_summaries(session: Session, loan_id, months):
+    # None unless every requested month is materialized; the caller then validates and computes as usual
+    rows = session.execute(
+        select(LoanScheduleRow.month, LoanScheduleRow.balance_cents, LoanScheduleRow.cumulative_principal_cents,
+               LoanScheduleRow.cumulative_interest_cents)
+        .where(LoanScheduleRow.loan_id == loan_id, LoanScheduleRow.month.in_(set(months)))).all()
+    summaries_by_month = {row.month: _summary_from_row(row) for row in rows}
+    if any(month not in summaries_by_month for month in months):
+        return None
+    return [summaries_by_month[month] for month in months]
+
+def total_outstanding_balance(session: Session, month):
+    # Reporting example: the book's outstanding principal after the given month, summed entirely in SQL over the
+    # (month, balance_cents) index. Loans whose term ends before the month have no row and owe nothing.
+    balance_cents = session.execute(
+        select(func.coalesce(func.sum(LoanScheduleRow.balance_cents), 0)).where(LoanScheduleRow.month == month)).scalar_one()
+    return _from_cents(balance_cents)
+
+def backfill_schedules(session: Session, batch_size=500, rebuild=False, progress=None):
+    # Materializes every loan without rows (every loan when rebuild is set), batch_size loans per transaction.
+    # Batches are keyed by loan id, so an interrupted backfill resumes where it stopped. Returns the loan count.
+    if rebuild:
+        session.execute(LoanScheduleRow.__table__.delete())
+        session.commit()
+    materialized = 0
+    after = 0
+    while True:
+        has_rows = select(LoanScheduleRow.loan_id).where(LoanScheduleRow.loan_id == Loan.id).exists()
+        loans = session.execute(
+            select(Loan.id, Loan.amount, Loan.annual_interest_rate, Loan.term_months, Loan.modification_count)
+            .where(Loan.id > after, ~has_rows)
+            .order_by(Loan.id)
+            .limit(batch_size)).all()
+        if not loans:
+            return materialized
+        modified_loan_ids = [loan.id for loan in loans if loan.modification_count]
+        materialize_loans(session, loans, checkpoints_by_loan(session, modified_loan_ids) if modified_loan_ids else None)
+        session.commit()
+        materialized += len(loans)
+        after = loans[-1].id
+        if progress:
+            progress(materialized)
@@ -0,0 +1,237 @@
+import bisect
+import functools
+import inspect
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import config
+
+# Per-route request instrumentation. MetricsMiddleware times every request and binds a RequestStats to the
+# request's context; the SQLAlchemy hooks below and the @timed_calculation decorator add to whichever
+# RequestStats is current, so a request's SQL and calculation time are attributed to its route. The
+# aggregates are rendered in the Prometheus text exposition format by GET /metrics.
+
+logger = logging.getLogger("app.slow_queries")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RequestStats:
+    __slots__ = ("sql_statements", "sql_seconds", "calculation_seconds", "_calculation_depth", "_calculation_start")
+
+    def __init__(self):
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.calculation_seconds = 0.0
+        self._calculation_depth = 0
+        self._calculation_start = 0.0
+
+    # timed calculations nest (a schedule builds an amortization), so only the outermost one is counted
+    def start_calculation(self):
+        if not self._calculation_depth:
+            self._calculation_start = time.perf_counter()
+        self._calculation_depth += 1
+
+    def stop_calculation(self):
+        self._calculation_depth -= 1
+        if not self._calculation_depth:
+            self.calculation_seconds += time.perf_counter() - self._calculation_start
+
+_current_request = ContextVar("current_request_stats", default=None)
+
+def timed_calculation(func):
+    # Attributes the time spent in func to the current request. Generator functions are timed one step at a
+    # time, so a streamed schedule is charged for producing rows but not for the I/O in between.
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def timed_generator(*args, **kwargs):
+            generator = func(*args, **kwargs)
+            stats = _current_request.get()
+            if stats is None:
+                yield from generator
+                return
+            while True:
+                stats.start_calculation()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    stats.stop_calculation()
+                yield item
+        return timed_generator
+
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        stats = _current_request.get()
+        if stats is None:
+            return func(*args, **kwargs)
+        stats.start_calculation()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.stop_calculation()
+    return timed
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    stats = _current_request.get()
+    if stats is not None:
+        stats.sql_statements += 1
+        stats.sql_seconds += elapsed
+    if elapsed * 1000 >= config.SLOW_QUERY_THRESHOLD_MS:
+        metrics_registry.record_slow_query()
+        # executemany parameter lists can hold thousands of rows, so only their size is logged
+        logged_parameters = f"<{len(parameters)} parameter sets>" if executemany else parameters
+        logger.warning("Slow query (%.1f ms): %s; parameters: %s", elapsed * 1000, statement, logged_parameters)
+
+class RouteMetrics:
+    __slots__ = ("bucket_counts", "duration_sum", "count", "status_counts", "sql_statements", "sql_seconds",
+                 "calculation_seconds")
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.duration_sum = 0.0
+        self.count = 0
+        self.status_counts = {}
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.calculation_seconds = 0.0
+
+class MetricsRegistry:
+    # Observations are made from the event loop thread (the middleware runs there even for sync endpoints),
+    # so the route metrics need no locking as long as they are rendered there too (GET /metrics is async). Slow queries are recorded by the SQLAlchemy hooks on whichever thread
+    # runs the statement (threadpool workers included), so their counter has a lock.
+    def __init__(self):
+        self.routes = {}
+        self.slow_queries = 0
+        self._slow_queries_lock = threading.Lock()
+        # app.single_flight.SingleFlight instances register themselves here
+        self.single_flights = []
+
+    def observe(self, method, route, status_code, duration, stats):
+        metrics = self.routes.get((method, route))
+        if metrics is None:
+            metrics = self.routes[(method, route)] = RouteMetrics()
+        metrics.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+        metrics.duration_sum += duration
+        metrics.count += 1
+        metrics.status_counts[status_code] = metrics.status_counts.get(status_code, 0) + 1
+        metrics.sql_statements += stats.sql_statements
+        metrics.sql_seconds += stats.sql_seconds
+        metrics.calculation_seconds += stats.calculation_seconds
+
+    def record_slow_query(self):
+        with self._slow_queries_lock:
+            self.slow_queries += 1
+
+    def render(self):
+        lines = []
+
+        def family(name, metric_type, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(samples)
+
+        routes = sorted(self.routes.items())
+        labels = {key: f'method="{key[0]}",route="{_escape(key[1])}"' for key, _ in routes}
+
+        histogram = []
+        for key, metrics in routes:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, metrics.bucket_counts):
+                cumulative += count
+                histogram.append(f'http_request_duration_seconds_bucket{{{labels[key]},le="{bound}"}} {cumulative}')
+            histogram.append(f'http_request_duration_seconds_bucket{{{labels[key]},le="+Inf"}} {metrics.count}')
+            histogram.append(f"http_request_duration_seconds_sum{{{labels[key]}}} {metrics.duration_sum}")
+            histogram.append(f"http_request_duration_seconds_count{{{labels[key]}}} {metrics.count}")
+        family("http_request_duration_seconds", "histogram", "Request latency by route.", histogram)
+
+        family("http_requests_total", "counter", "Requests by route and response status.", [
+            f'http_requests_total{{{labels[key]},status="{status}"}} {count}'
+            for key, metrics in routes for status, count in sorted(metrics.status_counts.items())
+        ])
+        family("http_request_sql_statements_total", "counter", "SQL statements executed by route.", [
+            f"http_request_sql_statements_total{{{labels[key]}}} {metrics.sql_statements}" for key, metrics in routes
+        ])
+        family("http_request_sql_seconds_total", "counter", "Time spent executing SQL by route.", [
+            f"http_request_sql_seconds_total{{{labels[key]}}} {metrics.sql_seconds}" for key, metrics in routes
+        ])
+        family("http_request_calculation_seconds_total", "counter", "Time spent in amortization calculations by route.", [
+            f"http_request_calculation_seconds_total{{{labels[key]}}} {metrics.calculation_seconds}"
+            for key, metrics in routes
+        ])
+        family("sql_slow_queries_total", "counter", "SQL statements slower than SLOW_QUERY_THRESHOLD_MS.", [
+            f"sql_slow_queries_total {self.slow_queries}"
+        ])
+        flights = [(_escape(flight.name), flight.stats()) for flight in self.single_flights]
+        family("single_flight_executions_total", "counter", "Computations run by each request-coalescing layer.", [
+            f'single_flight_executions_total{{flight="{name}"}} {stats["executions"]}' for name, stats in flights
+        ])
+        family("single_flight_coalesced_total", "counter", "Requests that shared an identical in-flight computation.", [
+            f'single_flight_coalesced_total{{flight="{name}"}} {stats["coalesced"]}' for name, stats in flights
+        ])
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        self.routes.clear()
+        with self._slow_queries_lock:
+            self.slow_queries = 0
+
+def _escape(label_value):
+    return label_value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+metrics_registry = MetricsRegistry()
+
+_route_paths = {}
+
+def route_label(scope):
+    # Labels are route templates (/loan/{loan_id}/schedule) rather than raw paths, so the number of series stays
+    # bounded; requests that matched no route share one label.
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    path = _route_paths.get(endpoint)
+    if path is None:
+        path = next((route.path for route in scope["app"].routes if getattr(route, "endpoint", None) is endpoint),
+                    "unmatched")
+        _route_paths[endpoint] = path
+    return path
+
+class MetricsMiddleware:
+    # A plain ASGI middleware rather than BaseHTTPMiddleware, so streamed response bodies are included in the
+    # request's latency and their calculation time is attributed to it.
+    def __init__(self, app, registry=None):
+        self.app = app
+        self.registry = registry or metrics_registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start
+            _current_request.reset(token)
+            self.registry.observe(scope["method"], route_label(scope), status_code, duration, stats)
@@ -1,13 +1,24 @@
 from sqlmodel import SQLModel, Field, Column, Relationship
-from sqlalchemy import String, Numeric
+from sqlalchemy import BigInteger, Index, Integer, String, Numeric
 from typing import Optional, List
 from decimal import Decimal
-from pydantic import EmailStr
+from enum import Enum
+from pydantic import EmailStr, model_validator
+
+from app import config
 
 class UserLoanLink(SQLModel, table=True):
     user_id: Optional[int] = Field(default=None, foreign_key="user.id", primary_key=True)
     loan_id: Optional[int] = Field(default=None, foreign_key="loan.id", primary_key=True)
 
+# With sharded storage (see app.database.ShardRouter), a loan shared with a user on another shard is linked on
+# the user's shard; the loan lives on its own shard, so there is no foreign key to it
+class RemoteLoanLink(SQLModel, table=True):
+    __tablename__ = "remote_loan_link"
+    __table_args__ = {"sqlite_with_rowid": False}
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    loan_id: int = Field(primary_key=True)
+
 # User Models:
 class UserBase(SQLModel):
     email: EmailStr = Field(sa_column=Column(String, unique=True, index=True))
@@ -32,10 +43,127 @@ class LoanBase(SQLModel):
     
 class Loan(LoanBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
+    # number of loan events recorded; reads only look for checkpoints (see LoanCheckpoint) when it isn't 0
+    modification_count: int = Field(default=0, sa_column=Column(Integer, nullable=False, server_default="0"))
     users: List["User"] = Relationship(back_populates="loans", link_model=UserLoanLink)
 
-class LoanCreate(LoanBase):
+class LoanTermsCreate(LoanBase):
+    # the terms a loan can be amortized with, as QuoteTerms; written loans are validated with these
+    amount: Decimal = Field(gt=0)
+    annual_interest_rate: Decimal = Field(ge=0)
+    term_months: int = Field(ge=1)
+
+class LoanCreate(LoanTermsCreate):
     user_id: int
 
+class LoanImport(LoanTermsCreate):
+    id: int
+
 class LoanRead(LoanBase):
     id: int
+
+# Materialized schedule rows (see app.materialized_schedules); amounts are integer cents
+class LoanScheduleRow(SQLModel, table=True):
+    __tablename__ = "loan_schedule_row"
+    # WITHOUT ROWID stores the rows clustered by (loan_id, month), so a schedule is one contiguous range; the
+    # (month, balance_cents) index covers per-month reporting across all loans
+    __table_args__ = (
+        Index("ix_loan_schedule_row_month_balance", "month", "balance_cents"),
+        {"sqlite_with_rowid": False},
+    )
+    loan_id: int = Field(foreign_key="loan.id", primary_key=True)
+    month: int = Field(primary_key=True)
+    balance_cents: int = Field(sa_column=Column(BigInteger, nullable=False))
+    payment_cents: int = Field(sa_column=Column(BigInteger, nullable=False))
+    cumulative_principal_cents: int = Field(sa_column=Column(BigInteger, nullable=False))
+    cumulative_interest_cents: int = Field(sa_column=Column(BigInteger, nullable=False))
+
+# Loan Event Models (see app.loan_modifications):
+class LoanEventKind(str, Enum):
+    prepayment = "prepayment"
+    rate_reset = "rate_reset"
+
+class LoanEventBase(SQLModel):
+    # a prepayment of amount is paid at the end of month, on top of its payment; a rate reset applies
+    # annual_interest_rate from month on. Either way the rest of the loan is re-amortized over the same term.
+    kind: LoanEventKind
+    month: int
+    amount: Optional[Decimal] = Field(default=None, sa_column=Column(Numeric(18, 6)))
+    annual_interest_rate: Optional[Decimal] = Field(default=None, sa_column=Column(Numeric(8, 5)))
+
+class LoanEvent(LoanEventBase, table=True):
+    __tablename__ = "loan_event"
+    __table_args__ = (Index("ix_loan_event_loan_id_month", "loan_id", "month"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    loan_id: int = Field(foreign_key="loan.id")
+
+class LoanEventCreate(LoanEventBase):
+    month: int = Field(ge=1)
+    amount: Optional[Decimal] = Field(default=None, gt=0)
+    annual_interest_rate: Optional[Decimal] = Field(default=None, ge=0)
+
+    @model_validator(mode="after")
+    def fields_of_kind(self):
+        if self.kind is LoanEventKind.prepayment and (self.amount is None or self.annual_interest_rate is not None):
+            raise ValueError("a prepayment takes an amount and no annual_interest_rate")
+        if self.kind is LoanEventKind.rate_reset and (self.annual_interest_rate is None or self.amount is not None):
+            raise ValueError("a rate reset takes an annual_interest_rate and no amount")
+        return self
+
+class LoanEventRead(LoanEventBase):
+    id: int
+    loan_id: int
+
+# Checkpoints of modified loans, derived from their events: the balance and interest paid at the end of month,
+# and the rate from the next month on (see app.financial_calculations.ModifiedAmortization)
+class LoanCheckpoint(SQLModel, table=True):
+    __tablename__ = "loan_checkpoint"
+    __table_args__ = {"sqlite_with_rowid": False}
+    loan_id: int = Field(foreign_key="loan.id", primary_key=True)
+    month: int = Field(primary_key=True)
+    balance: Decimal = Field(sa_column=Column(Numeric(18, 6), nullable=False))
+    annual_interest_rate: Decimal = Field(sa_column=Column(Numeric(8, 5), nullable=False))
+    interest_paid: Decimal = Field(sa_column=Column(Numeric(18, 6), nullable=False))
+
+# Portfolio rollups (see app.portfolios): for each user, the sums over every loan they can see of the loans'
+# month summaries, in integer cents. Months past a loan's term count it as paid off, so a portfolio has rows up to
+# its longest term (term_months) and later months read that last row.
+class Portfolio(SQLModel, table=True):
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    loan_count: int = Field(nullable=False)
+    term_months: int = Field(nullable=False)
+
+class PortfolioMonth(SQLModel, table=True):
+    __tablename__ = "portfolio_month"
+    __table_args__ = {"sqlite_with_rowid": False}
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    month: int = Field(primary_key=True)
+    balance_cents: int = Field(sa_column=Column(BigInteger, nullable=False))
+    cumulative_principal_cents: int = Field(sa_column=Column(BigInteger, nullable=False))
+    cumulative_interest_cents: int = Field(sa_column=Column(BigInteger, nullable=False))
+
+# Batch Models:
+class LoanBatchSummaryRequest(SQLModel):
+    loan_ids: List[int]
+    month: int = Field(ge=1)
+
+# Quote Models (hypothetical loans, never stored):
+class QuoteTerms(SQLModel):
+    amount: Decimal = Field(gt=0)
+    annual_interest_rate: Decimal = Field(ge=0)
+    term_months: int = Field(ge=1, le=config.QUOTES_MAX_TERM_MONTHS)
+
+class QuoteSummaryTerms(QuoteTerms):
+    month: int = Field(ge=1)
+
+    @model_validator(mode="after")
+    def month_within_term(self):
+        if self.month > self.term_months:
+            raise ValueError(f"month must be less than or equal to the loan term of {self.term_months} months")
+        return self
+
+class QuoteScheduleRequest(SQLModel):
+    quotes: List[QuoteTerms] = Field(min_length=1, max_length=config.QUOTES_MAX_BATCH_SIZE)
+
+class QuoteSummaryRequest(SQLModel):
+    quotes: List[QuoteSummaryTerms] = Field(min_length=1, max_length=config.QUOTES_MAX_BATCH_SIZE)
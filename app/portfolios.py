@@ -0,0 +1,288 @@
+import json
+from decimal import Decimal
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import and_, bindparam, delete, func, insert, literal, select, union_all
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import Session
+
+from app.compute_pool import compute_pool
+from app.loan_modifications import LOAN_ID_LOOKUP_CHUNK_SIZE, checkpoints_by_loan, checkpoints_by_loan_async
+from app.materialized_schedules import schedule_rows
+from app.models import Loan, Portfolio, PortfolioMonth, User, UserLoanLink
+
+# Portfolio rollups (PORTFOLIO_ROLLUPS): for each user, portfolio_month holds the sums over every loan linked to
+# them of the loans' month summaries, in integer cents, so GET /users/{id}/portfolio is one primary-key lookup
+# however many loans the user has. A loan's contribution is its materialized schedule's cumulative columns (see
+# app.materialized_schedules), carried on at its final, paid-off month after its term. Writes that link a loan
+# to a user add its contribution, and a loan event adds the difference it makes from the month it takes effect;
+# `python -m cli rebuild-portfolios` recomputes every rollup and `python -m cli check-portfolios` compares them.
+# The endpoints compute contributions in the threadpool (or the compute pool) before they write, and each user's
+# months are then updated by one INSERT ... SELECT over the contribution, which is bound as a JSON array.
+
+SUMMARY_COLUMNS = ("balance_cents", "cumulative_principal_cents", "cumulative_interest_cents")
+
+def loan_contribution(loan, checkpoints=()):
+    # an array of the loan's (balance, principal paid, interest paid) in cents, one row per month of its term;
+    # loan only needs the terms, so it can be a loan that hasn't been inserted yet
+    rows = schedule_rows(None, loan.amount, loan.annual_interest_rate, loan.term_months, checkpoints)
+    return np.array([[row[column] for column in SUMMARY_COLUMNS] for row in rows], dtype=np.int64)
+
+def _extended(contribution, term_months):
+    # a paid-off loan keeps its final month's values
+    if len(contribution) >= term_months:
+        return contribution
+    return np.vstack([contribution, np.repeat(contribution[-1:], term_months - len(contribution), axis=0)])
+
+def combine_contributions(contributions):
+    term_months = max(len(contribution) for contribution in contributions)
+    return sum(_extended(contribution, term_months) for contribution in contributions)
+
+def _month_rows(user_id, values, from_month):
+    return [
+        {"user_id": user_id, "month": month, **dict(zip(SUMMARY_COLUMNS, row))}
+        for month, row in enumerate(values.tolist(), start=from_month)
+    ]
+
+def _upsert_months(user_id, contribution, from_month):
+    # Adds the contribution's months from from_month on to the user's rollup in one statement. Months past the
+    # rollup's current term are new rows, which start from the portfolio's final month (read before the
+    # statement writes anything, as SQLite computes an INSERT's SELECT from its own table first); when the
+    # rollup runs longer than the contribution, its later months get the contribution's final values.
+    term_months = len(contribution)
+    values = func.json_each(bindparam("values", json.dumps(contribution[from_month - 1:].tolist()))).table_valued(
+        "key", "value").alias("contribution")
+    final_month = PortfolioMonth.__table__.alias("final_month")
+    month = from_month + values.c.key
+    contribution_months = (
+        select(literal(user_id), month, *(
+            func.json_extract(values.c.value, f"$[{index}]") + func.coalesce(final_month.c[column], 0)
+            for index, column in enumerate(SUMMARY_COLUMNS)))
+        .select_from(values)
+        .outerjoin(Portfolio, Portfolio.user_id == user_id)
+        .outerjoin(final_month, and_(final_month.c.user_id == Portfolio.user_id, final_month.c.month == Portfolio.term_months,
+                                     month > Portfolio.term_months)))
+    later_months = (
+        select(PortfolioMonth.user_id, PortfolioMonth.month, *(literal(value) for value in contribution[-1].tolist()))
+        .where(PortfolioMonth.user_id == user_id, PortfolioMonth.month > term_months, PortfolioMonth.month >= from_month))
+    upsert_months = sqlite_insert(PortfolioMonth).from_select(
+        ["user_id", "month", *SUMMARY_COLUMNS], union_all(contribution_months, later_months))
+    return upsert_months.on_conflict_do_update(
+        index_elements=["user_id", "month"],
+        set_={column: getattr(PortfolioMonth, column) + getattr(upsert_months.excluded, column) for column in SUMMARY_COLUMNS})
+
+def _add_to_portfolio(session, user_id, contribution, loan_count, from_month=1):
+    # the header is written after the months, whose statement reads the rollup's term from it
+    term_months = len(contribution)
+    session.execute(_upsert_months(user_id, contribution, from_month))
+    upsert_header = sqlite_insert(Portfolio).values(user_id=user_id, loan_count=loan_count, term_months=term_months)
+    session.execute(upsert_header.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={"loan_count": Portfolio.loan_count + loan_count, "term_months": func.max(Portfolio.term_months, term_months)}))
+
+def _select_loans(loan_ids):
+    return select(Loan.id, Loan.amount, Loan.annual_interest_rate, Loan.term_months, Loan.modification_count).where(
+        Loan.id.in_(loan_ids))
+
+def _contributions(session, loans):
+    # {loan id: contribution}; modified loans are computed from their checkpoints
+    modified_loan_ids = [loan.id for loan in loans if loan.modification_count]
+    checkpoints = checkpoints_by_loan(session, modified_loan_ids) if modified_loan_ids else {}
+    return {loan.id: loan_contribution(loan, checkpoints.get(loan.id, ())) for loan in loans}
+
+def _contributions_of_terms(terms):
+    # module-level so that compute_pool can run it in worker processes
+    return [
+        loan_contribution(Loan(amount=amount, annual_interest_rate=rate, term_months=term_months), checkpoints)
+        for amount, rate, term_months, checkpoints in terms
+    ]
+
+async def compute_contributions(loans, checkpoints=None):
+    # The contributions of loans (anything with the terms, such as LoanCreate), in order, computed outside the
+    # event loop: in the threadpool, or in the compute pool when the terms are long enough. checkpoints maps the
+    # ids of modified loans to their checkpoints.
+    checkpoints = checkpoints or {}
+    terms = [
+        (loan.amount, loan.annual_interest_rate, loan.term_months, checkpoints.get(getattr(loan, "id", None), ()))
+        for loan in loans
+    ]
+    if not terms:
+        return []
+    chunks = await run_in_threadpool(
+        compute_pool.map_chunks, sum(term_months for _, _, term_months, _ in terms), _contributions_of_terms, terms)
+    return [contribution for chunk in chunks for contribution in chunk]
+
+async def stored_contributions_async(session: AsyncSession, loan_ids):
+    # (loans, {loan id: contribution}) for existing loans, to be computed before a write that links them; the
+    # loans are rows with the terms and modification_count that add_links checks the contributions against
+    loans = (await session.execute(_select_loans(loan_ids))).all()
+    modified_loan_ids = [loan.id for loan in loans if loan.modification_count]
+    checkpoints = await checkpoints_by_loan_async(session, modified_loan_ids) if modified_loan_ids else {}
+    return loans, dict(zip([loan.id for loan in loans], await compute_contributions(loans, checkpoints)))
+
+def add_links(session: Session, links, loans=None, contributions=None):
+    # Adds the loans of newly inserted (user id, loan id) links to their users' rollups, in the caller's
+    # transaction. contributions maps loan ids to contributions computed beforehand, from loans: rows with the
+    # loans' id, terms and modification_count. A loan modified since then (the caller's write holds the lock now)
+    # is computed again. Without contributions they are computed here, from loans or from a lookup of them.
+    links = list(links)
+    if not links:
+        return
+    if contributions is None:
+        if loans is None:
+            loan_ids = list({loan_id for _, loan_id in links})
+            loans = [
+                loan for start in range(0, len(loan_ids), LOAN_ID_LOOKUP_CHUNK_SIZE)
+                for loan in session.execute(_select_loans(loan_ids[start:start + LOAN_ID_LOOKUP_CHUNK_SIZE]))
+            ]
+        contributions = _contributions(session, loans)
+    elif loans is not None:
+        modification_counts = dict(session.execute(
+            select(Loan.id, Loan.modification_count).where(Loan.id.in_([loan.id for loan in loans]))).all())
+        stale_loan_ids = [loan.id for loan in loans if modification_counts.get(loan.id) != loan.modification_count]
+        if stale_loan_ids:
+            contributions = {**contributions, **_contributions(session, session.execute(_select_loans(stale_loan_ids)).all())}
+    loan_ids_by_user = {}
+    for user_id, loan_id in links:
+        loan_ids_by_user.setdefault(user_id, []).append(loan_id)
+    for user_id, loan_ids in loan_ids_by_user.items():
+        _add_to_portfolio(session, user_id, combine_contributions([contributions[loan_id] for loan_id in loan_ids]), len(loan_ids))
+
+async def add_links_async(session: AsyncSession, links, loans=None, contributions=None):
+    await session.run_sync(add_links, links, loans, contributions)
+
+def modification_difference(loan, previous_checkpoints, checkpoints, from_month):
+    # what a loan event changed in the loan's contribution, from from_month on (zeros before it)
+    previous_rows = schedule_rows(loan.id, loan.amount, loan.annual_interest_rate, loan.term_months, previous_checkpoints, from_month)
+    new_rows = schedule_rows(loan.id, loan.amount, loan.annual_interest_rate, loan.term_months, checkpoints, from_month)
+    difference = np.zeros((loan.term_months, len(SUMMARY_COLUMNS)), dtype=np.int64)
+    difference[from_month - 1:] = [
+        [new[column] - previous[column] for column in SUMMARY_COLUMNS] for previous, new in zip(previous_rows, new_rows)
+    ]
+    return difference
+
+def _modification_difference_of_terms(amount, annual_interest_rate, term_months, previous_checkpoints, checkpoints, from_month):
+    loan = Loan(amount=amount, annual_interest_rate=annual_interest_rate, term_months=term_months)
+    return modification_difference(loan, previous_checkpoints, checkpoints, from_month)
+
+def _add_difference(session: Session, loan_id, difference, from_month):
+    user_ids = session.execute(select(UserLoanLink.user_id).where(UserLoanLink.loan_id == loan_id)).scalars().all()
+    for user_id in user_ids:
+        _add_to_portfolio(session, user_id, difference, 0, from_month)
+
+def modify_loan(session: Session, loan, previous_checkpoints, checkpoints, from_month):
+    # After a loan event (see app.loan_modifications), adds the difference it made from from_month on to the
+    # rollups of every user the loan is linked to
+    _add_difference(session, loan.id, modification_difference(loan, previous_checkpoints, checkpoints, from_month), from_month)
+
+async def modify_loan_async(session: AsyncSession, loan, previous_checkpoints, checkpoints, from_month):
+    # the event's checkpoints are only known under its write lock, but the difference is still computed outside
+    # the event loop
+    difference = await run_in_threadpool(
+        compute_pool.run, 2 * (loan.term_months - from_month + 1), _modification_difference_of_terms,
+        loan.amount, loan.annual_interest_rate, loan.term_months, previous_checkpoints, checkpoints, from_month)
+    await session.run_sync(_add_difference, loan.id, difference, from_month)
+
+def _from_cents(cents):
+    return Decimal(cents).scaleb(-2)
+
+def portfolio_summary(loan_count, month, values):
+    return {
+        "Month": month,
+        "loans": loan_count,
+        "current principal balance": _from_cents(values[0]),
+        "principal already paid": _from_cents(values[1]),
+        "interest already paid": _from_cents(values[2]),
+    }
+
+def select_portfolio_month(user_id, month):
+    # the user's rollup at the month, or at its final month when every loan has ended by then
+    return (
+        select(Portfolio.loan_count, Portfolio.term_months, *(getattr(PortfolioMonth, column) for column in SUMMARY_COLUMNS))
+        .join(PortfolioMonth, and_(PortfolioMonth.user_id == Portfolio.user_id,
+                                   PortfolioMonth.month == func.min(month, Portfolio.term_months)))
+        .where(Portfolio.user_id == user_id))
+
+def expected_portfolios(session: Session, user_ids):
+    # {user id: (loan count, combined contribution)} recomputed from the users' loans; users without loans are left out
+    rows = session.execute(
+        select(UserLoanLink.user_id, Loan.id, Loan.amount, Loan.annual_interest_rate, Loan.term_months, Loan.modification_count)
+        .join(Loan, Loan.id == UserLoanLink.loan_id)
+        .where(UserLoanLink.user_id.in_(user_ids))).all()
+    # a loan shared between users of the batch is computed once
+    contributions = _contributions(session, list({row.id: row for row in rows}.values()))
+    loan_ids_by_user = {}
+    for row in rows:
+        loan_ids_by_user.setdefault(row.user_id, []).append(row.id)
+    return {
+        user_id: (len(loan_ids), combine_contributions([contributions[loan_id] for loan_id in loan_ids]))
+        for user_id, loan_ids in loan_ids_by_user.items()
+    }
+
+def _stored_portfolios(session: Session, user_ids):
+    headers = {row.user_id: row for row in session.execute(select(Portfolio).where(Portfolio.user_id.in_(user_ids))).scalars()}
+    months = {}
+    for user_id, *values in session.execute(
+            select(PortfolioMonth.user_id, *(getattr(PortfolioMonth, column) for column in SUMMARY_COLUMNS))
+            .where(PortfolioMonth.user_id.in_(user_ids))
+            .order_by(PortfolioMonth.user_id, PortfolioMonth.month)):
+        months.setdefault(user_id, []).append(values)
+    return {
+        user_id: (header.loan_count, header.term_months, np.array(months.get(user_id, []), dtype=np.int64))
+        for user_id, header in headers.items()
+    }
+
+def _user_batches(session: Session, batch_size):
+    after = 0
+    while True:
+        user_ids = session.execute(select(User.id).where(User.id > after).order_by(User.id).limit(batch_size)).scalars().all()
+        if not user_ids:
+            return
+        yield user_ids
+        after = user_ids[-1]
+
+def rebuild_portfolios(session: Session, batch_size=500, progress=None):
+    # Recomputes every user's rollup, batch_size users per transaction. Returns the user count.
+    rebuilt = 0
+    for user_ids in _user_batches(session, batch_size):
+        expected = expected_portfolios(session, user_ids)
+        session.execute(delete(PortfolioMonth).where(PortfolioMonth.user_id.in_(user_ids)))
+        session.execute(delete(Portfolio).where(Portfolio.user_id.in_(user_ids)))
+        if expected:
+            session.execute(insert(Portfolio), [
+                {"user_id": user_id, "loan_count": loan_count, "term_months": len(values)}
+                for user_id, (loan_count, values) in expected.items()
+            ])
+            session.execute(insert(PortfolioMonth), [
+                row for user_id, (_, values) in expected.items() for row in _month_rows(user_id, values, 1)
+            ])
+        session.commit()
+        rebuilt += len(user_ids)
+        if progress:
+            progress(rebuilt)
+    return rebuilt
+
+def check_portfolios(session: Session, batch_size=500, progress=None):
+    # Compares every user's stored rollup with one recomputed from their loans. Returns the ids of the users
+    # whose rollups differ.
+    mismatched_user_ids = []
+    checked = 0
+    for user_ids in _user_batches(session, batch_size):
+        expected = expected_portfolios(session, user_ids)
+        stored = _stored_portfolios(session, user_ids)
+        for user_id in user_ids:
+            if user_id not in expected and user_id not in stored:
+                continue
+            if user_id not in expected or user_id not in stored:
+                mismatched_user_ids.append(user_id)
+                continue
+            loan_count, values = expected[user_id]
+            stored_loan_count, stored_term_months, stored_values = stored[user_id]
+            if (loan_count, len(values)) != (stored_loan_count, stored_term_months) or not np.array_equal(values, stored_values):
+                mismatched_user_ids.append(user_id)
+        checked += len(user_ids)
+        if progress:
+            progress(checked)
+    return mismatched_user_ids
@@ -0,0 +1,23 @@
+from functools import lru_cache
+
+from app import config
+from app.schedule_cache import normalize_loan_terms, schedule_cache
+
+# Stateless quotes: hypothetical loans are amortized straight from their terms, never touching the database.
+# Both computations are memoized on the normalized terms, so a pricing UI re-quoting the same loans (or sweeping
+# a slider back and forth) is served from memory. Results are shared between callers and must not be mutated.
+
+def quote_schedules(quotes):
+    # schedules share the LRU schedule cache with the loan endpoints, which bounds them by entries and bytes
+    return schedule_cache.schedules([(quote.amount, quote.annual_interest_rate, quote.term_months) for quote in quotes])
+
+@lru_cache(maxsize=config.QUOTE_SUMMARY_CACHE_MAX_ENTRIES)
+def _memoized_summary(amount, annual_interest_rate, term_months, month):
+    return schedule_cache.summary(month, amount, annual_interest_rate, term_months)
+
+def quote_summary(quote):
+    return _memoized_summary(*normalize_loan_terms(quote.amount, quote.annual_interest_rate, quote.term_months), quote.month)
+
+def quote_cache_stats():
+    info = _memoized_summary.cache_info()
+    return {"entries": info.currsize, "hits": info.hits, "misses": info.misses}
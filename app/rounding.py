@@ -0,0 +1,20 @@
+from decimal import ROUND_HALF_EVEN, ROUND_HALF_UP
+
+from app import config
+
+# Named rounding policies: banker's rounding (ties to even) is Decimal's default and reduces cumulative
+# rounding bias; half-up (ties away from zero) is the rounding most people learn in school.
+ROUNDING_POLICIES = {
+    "bankers": ROUND_HALF_EVEN,
+    "half_up": ROUND_HALF_UP,
+}
+
+def rounding_for_policy(policy):
+    if policy not in ROUNDING_POLICIES:
+        raise ValueError(f"Unknown rounding policy {policy!r}; choose from {sorted(ROUNDING_POLICIES)}")
+    return ROUNDING_POLICIES[policy]
+
+def default_rounding():
+    # read when it is used rather than at import, so the engine follows ROUNDING_POLICY however it was set (a
+    # compute pool worker gets the parent's setting in its initializer, before it imports the engine)
+    return rounding_for_policy(config.ROUNDING_POLICY)
@@ -0,0 +1,233 @@
+import sys
+import threading
+from collections import OrderedDict
+
+from app import config
+from app.metrics import timed_calculation
+from app.compute_pool import compute_pool
+from app.financial_calculations import ModifiedAmortization, amortization, iter_amortization_schedule, iter_loan_summaries
+
+def normalize_loan_terms(amount, annual_interest_rate, term_months):
+    # 1000, 1000.00 and 1E+3 describe the same loan, so they share a cache entry
+    return amount.normalize(), annual_interest_rate.normalize(), int(term_months)
+
+def normalize_checkpoints(checkpoints):
+    return tuple(
+        (int(month), balance.normalize(), rate.normalize(), interest_paid.normalize())
+        for month, balance, rate, interest_paid in checkpoints)
+
+def schedule_key(amount, annual_interest_rate, term_months, checkpoints=()):
+    # a modified loan's checkpoints (see app.loan_modifications) are part of its key; unmodified loans have none
+    return (*normalize_loan_terms(amount, annual_interest_rate, term_months), normalize_checkpoints(checkpoints))
+
+class CachedSchedule:
+    __slots__ = ("calculation", "balances", "rows", "size")
+
+    @timed_calculation
+    def __init__(self, amount, annual_interest_rate, term_months):
+        self.calculation = amortization(amount, annual_interest_rate, term_months)
+        # unrounded balances are kept so summaries sliced from the cache round exactly like computed ones
+        self.balances = tuple(self.calculation.balances())
+        rounded_payment = self.calculation.rounded_payment
+        to_cents = self.calculation.to_cents
+        self.rows = [
+            {"Month": m, "Remaining balance": to_cents(balance), "Monthly payment": rounded_payment}
+            for m, balance in enumerate(self.balances, start=1)
+        ]
+        self.size = self._estimate_size()
+
+    def _estimate_size(self):
+        # every row has the same shape, so one row is measured and scaled rather than walking them all
+        if not self.rows:
+            return sys.getsizeof(self.rows) + sys.getsizeof(self.balances)
+        row = self.rows[0]
+        row_size = sys.getsizeof(row) + sys.getsizeof(row["Remaining balance"]) + sys.getsizeof(self.balances[0])
+        return (
+            sys.getsizeof(self.rows) + sys.getsizeof(self.balances) + sys.getsizeof(row["Monthly payment"])
+            + row_size * len(self.rows)
+        )
+
+    @timed_calculation
+    def summary(self, month):
+        return self.calculation.summary(month, self.balances[month - 1])
+
+class ModifiedSchedule:
+    # The cache entry of a modified loan. Its summaries come from the checkpoints, like computed ones. Given
+    # the rows of the loan before its latest modification, only the months from len(rows_before) + 1 on are
+    # computed.
+    __slots__ = ("calculation", "rows", "size")
+
+    @timed_calculation
+    def __init__(self, amount, annual_interest_rate, term_months, checkpoints, rows_before=()):
+        self.calculation = ModifiedAmortization(amount, annual_interest_rate, term_months, checkpoints)
+        self.rows = list(rows_before)
+        self.rows.extend(self.calculation.iter_schedule(len(self.rows) + 1))
+        row = self.rows[0]
+        row_size = sys.getsizeof(row) + sys.getsizeof(row["Remaining balance"])
+        self.size = sys.getsizeof(self.rows) + row_size * len(self.rows) + sys.getsizeof(checkpoints)
+
+    @timed_calculation
+    def summary(self, month):
+        return self.calculation.summary(month)
+
+# Module-level so that compute_pool can run them in worker processes
+def _build_schedule(key):
+    amount, annual_interest_rate, term_months, checkpoints = key
+    if checkpoints:
+        return ModifiedSchedule(amount, annual_interest_rate, term_months, checkpoints)
+    return CachedSchedule(amount, annual_interest_rate, term_months)
+
+def _build_schedules(keys):
+    return [_build_schedule(key) for key in keys]
+
+def _schedule_window(key, from_month, to_month):
+    amount, annual_interest_rate, term_months, checkpoints = key
+    return list(iter_amortization_schedule(
+        amount, annual_interest_rate, term_months, from_month=from_month, to_month=to_month, checkpoints=checkpoints))
+
+def _loan_summaries(key, months):
+    amount, annual_interest_rate, term_months, checkpoints = key
+    return list(iter_loan_summaries(amount, annual_interest_rate, term_months, months, checkpoints=checkpoints))
+
+def _summaries_of_loans(loan_months):
+    return [_loan_summaries(key, [month])[0] for key, month in loan_months]
+
+class ScheduleCache:
+    # In-process LRU cache of computed schedules keyed by normalized loan terms (and checkpoints, for modified
+    # loans). A modification gives the loan a new key rather than changing an entry, so an entry never goes
+    # stale; it is only evicted once max_entries or max_bytes is exceeded.
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def _put(self, key, entry):
+        if entry.size > self.max_bytes or self.max_entries <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = entry
+            self.current_bytes += entry.size
+            while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.size
+                self.evictions += 1
+
+    def schedule(self, amount, annual_interest_rate, term_months, checkpoints=()):
+        # the returned rows are shared between callers and must be treated as read-only
+        key = schedule_key(amount, annual_interest_rate, term_months, checkpoints)
+        entry = self._get(key)
+        if entry is None:
+            entry = compute_pool.run(key[2], _build_schedule, key)
+            self._put(key, entry)
+        return entry.rows
+
+    def modify(self, amount, annual_interest_rate, term_months, previous_checkpoints, checkpoints, from_month):
+        # After a loan is modified from from_month on: if its schedule before the modification is cached, the
+        # new one is cached too, reusing the months before from_month so that only the tail is computed
+        with self._lock:
+            previous = self._entries.get(schedule_key(amount, annual_interest_rate, term_months, previous_checkpoints))
+        if previous is None:
+            return
+        key = schedule_key(amount, annual_interest_rate, term_months, checkpoints)
+        self._put(key, ModifiedSchedule(*key, previous.rows[:from_month - 1]))
+
+    def schedules(self, loan_terms):
+        # Many schedules at once, e.g. a batch of quotes: the misses are computed together, which lets a large
+        # batch be spread over the compute pool in chunks.
+        keys = [schedule_key(*terms) for terms in loan_terms]
+        entries = {key: self._get(key) for key in keys}
+        missing = [key for key, entry in entries.items() if entry is None]
+        if missing:
+            chunks = compute_pool.map_chunks(sum(key[2] for key in missing), _build_schedules, missing)
+            for key, entry in zip(missing, (entry for chunk in chunks for entry in chunk)):
+                entries[key] = entry
+                self._put(key, entry)
+        return [entries[key].rows for key in keys]
+
+    def window(self, from_month, to_month, amount, annual_interest_rate, term_months, checkpoints=()):
+        # Months from_month..to_month: sliced from a cached schedule, otherwise generated on their own (starting
+        # from the closed-form balance) and not cached, so a page costs its size rather than the loan term.
+        key = schedule_key(amount, annual_interest_rate, term_months, checkpoints)
+        entry = self._get(key)
+        if entry is None:
+            return compute_pool.run(to_month - from_month + 1, _schedule_window, key, from_month, to_month)
+        return entry.rows[from_month - 1:to_month]
+
+    def iter_schedule(self, amount, annual_interest_rate, term_months, from_month=1, to_month=None, checkpoints=()):
+        # For streaming responses: a cached schedule is replayed, but a miss is generated row by row and not
+        # cached, so exporting a long schedule never materializes it in memory.
+        key = schedule_key(amount, annual_interest_rate, term_months, checkpoints)
+        entry = self._get(key)
+        if entry is None:
+            window_months = (to_month or key[2]) - from_month + 1
+            if compute_pool.offloads(window_months):
+                # too long to generate in the request thread: computed by the pool, then streamed
+                return iter(compute_pool.run(window_months, _schedule_window, key, from_month, to_month))
+            return iter_amortization_schedule(
+                *key[:3], from_month=from_month, to_month=to_month, checkpoints=key[3])
+        return iter(entry.rows[from_month - 1:to_month])
+
+    def summaries(self, months, amount, annual_interest_rate, term_months, checkpoints=()):
+        # Sliced from a cached schedule when there is one; otherwise the closed form is cheaper than building
+        # and caching the whole schedule just to answer a few months.
+        key = schedule_key(amount, annual_interest_rate, term_months, checkpoints)
+        entry = self._get(key)
+        if entry is None:
+            return compute_pool.run(len(months), _loan_summaries, key, months)
+        return [entry.summary(month) for month in months]
+
+    def loan_summaries(self, loan_months):
+        # One summary for each of many loans, given as ((amount, annual_interest_rate, term_months), month) pairs
+        # (with the checkpoints as a fourth term for modified loans): cached schedules are sliced, and the rest
+        # are evaluated together with the closed form, spread over the compute pool when there are enough of them.
+        keys = [(schedule_key(*terms), month) for terms, month in loan_months]
+        summaries = [None] * len(keys)
+        missing = []
+        for index, (key, month) in enumerate(keys):
+            entry = self._get(key)
+            if entry is None:
+                missing.append(index)
+            else:
+                summaries[index] = entry.summary(month)
+        if missing:
+            chunks = compute_pool.map_chunks(len(missing), _summaries_of_loans, [keys[index] for index in missing])
+            for index, summary in zip(missing, (summary for chunk in chunks for summary in chunk)):
+                summaries[index] = summary
+        return summaries
+
+    def summary(self, month, amount, annual_interest_rate, term_months, checkpoints=()):
+        return self.summaries([month], amount, annual_interest_rate, term_months, checkpoints)[0]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+schedule_cache = ScheduleCache(config.SCHEDULE_CACHE_MAX_ENTRIES, config.SCHEDULE_CACHE_MAX_BYTES)
@@ -0,0 +1,107 @@
+import asyncio
+from contextlib import nullcontext
+
+from sqlalchemy import func, insert, select
+
+from app.database import SHARD_ID_BITS
+from app.models import Loan, RemoteLoanLink, User
+
+# Helpers for the requests that sharded storage (DATABASE_SHARDS > 1, see app.database.ShardRouter) can't route
+# by an id in their path: writes keyed by a field of the body, batches that span shards, and the loans shared
+# with a user from other shards. Each takes the router, which is None with a single database file; a shard of
+# None then stands for that file, and the helpers do what the single-file code always did.
+
+def next_id(table, shard):
+    # the next id in the shard's range, computed by the INSERT itself while it holds the shard's write lock
+    return select(func.coalesce(func.max(table.id), shard << SHARD_ID_BITS) + 1).scalar_subquery()
+
+async def insert_returning_ids(session, table, rows, shard=None):
+    # one executemany of rows; returns their ids in order
+    if shard is None:
+        return (await session.execute(insert(table).returning(table.id, sort_by_parameter_order=True), rows)).scalars().all()
+    # every row's INSERT computes its own id, and from the first one on the transaction holds the shard's write
+    # lock, so the rows have the shard's last ids
+    await session.execute(insert(table).values(id=next_id(table, shard)), rows)
+    last_id = (await session.execute(select(func.max(table.id)))).scalar_one()
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+def on_shard(router, session, shard):
+    # the request's session when it is on the shard (always, with one database file), else a new one on the shard
+    if router is None or session.info.get("shard", 0) == shard:
+        return nullcontext(session)
+    return router.async_session(shard)
+
+def group_by_shard(router, items, shard_of):
+    if router is None:
+        return {None: list(items)} if items else {}
+    groups = {}
+    for item in items:
+        groups.setdefault(shard_of(item), []).append(item)
+    return groups
+
+async def email_predates_sharding(router, session, email, shard):
+    # Shard 0 also holds the users created before the database was sharded, whose emails hash to any shard, so
+    # an email that belongs on another shard is looked up there too. session is on shard 0.
+    if router is None or shard == 0:
+        return False
+    return (await session.execute(select(User.id).where(User.email == email))).first() is not None
+
+def on_shards(router, session, record_ids, read):
+    # Calls read(session, ids), which returns a dict, for the ids of each shard and merges the results. The
+    # request's session reads its own shard; the others are read through read-only sessions.
+    if router is None:
+        return read(session, record_ids)
+    results = {}
+    for shard, ids in group_by_shard(router, record_ids, router.shard_for_id).items():
+        if shard == session.info.get("shard", 0):
+            results.update(read(session, ids))
+        else:
+            with router.read_session(shard) as shard_session:
+                results.update(read(shard_session, ids))
+    return results
+
+async def on_shards_async(router, session, record_ids, read):
+    # as on_shards, with the shards read concurrently
+    if router is None:
+        return await read(session, record_ids)
+
+    async def read_shard(shard, ids):
+        if shard == session.info.get("shard", 0):
+            return await read(session, ids)
+        async with router.async_read_session(shard) as shard_session:
+            return await read(shard_session, ids)
+
+    results = {}
+    for result in await asyncio.gather(*(
+            read_shard(shard, ids) for shard, ids in group_by_shard(router, record_ids, router.shard_for_id).items())):
+        results.update(result)
+    return results
+
+async def remote_loans(router, session, user_id, columns, after=None, limit=None):
+    # Rows of columns (which must include Loan.id) for the loans shared with the user from other shards, in id
+    # order, keyset-paginated like select_loans_for_user. Only the shards of those loans are queried, and none
+    # when there are no such links.
+    if router is None:
+        return []
+    find_remote_loan_ids = select(RemoteLoanLink.loan_id).where(RemoteLoanLink.user_id == user_id)
+    if after is not None:
+        find_remote_loan_ids = find_remote_loan_ids.where(RemoteLoanLink.loan_id > after)
+    find_remote_loan_ids = find_remote_loan_ids.order_by(RemoteLoanLink.loan_id)
+    if limit is not None:
+        find_remote_loan_ids = find_remote_loan_ids.limit(limit)
+    loan_ids = (await session.execute(find_remote_loan_ids)).scalars().all()
+    if not loan_ids:
+        return []
+
+    async def read_loans(shard_session, ids):
+        return {loan.id: loan for loan in (await shard_session.execute(select(*columns).where(Loan.id.in_(ids)))).all()}
+
+    loans = await on_shards_async(router, session, loan_ids, read_loans)
+    return [loans[loan_id] for loan_id in loan_ids if loan_id in loans]
+
+def merge_loan_pages(loans, other_loans, limit=None):
+    # two id-ordered pages of loans as one; limit is the page's row limit
+    if not other_loans:
+        return loans
+    merged = sorted([*loans, *other_loans], key=lambda loan: loan.id)
+    return merged if limit is None else merged[:limit]
@@ -0,0 +1,56 @@
+from enum import Enum
+from itertools import chain
+
+# Rows are buffered into chunks so that a long schedule goes out in a handful of body writes rather than one
+# per month, while still never holding more than one chunk in memory.
+STREAM_CHUNK_ROWS = 64
+
+class ScheduleFormat(str, Enum):
+    json = "json"
+    ndjson = "ndjson"
+    csv = "csv"
+    # one array per column, {"month": [...], "balance": [...], "payment": [...]}: smaller and faster to encode
+    columnar = "columnar"
+
+MEDIA_TYPES = {
+    ScheduleFormat.json: "application/json",
+    ScheduleFormat.ndjson: "application/x-ndjson",
+    ScheduleFormat.csv: "text/csv",
+    ScheduleFormat.columnar: "application/json",
+}
+
+def negotiate_schedule_format(requested_format, accept_header):
+    # an explicit format= query parameter wins; otherwise the first streaming type named in Accept is used
+    if requested_format is not None:
+        return requested_format
+    for media_range in (accept_header or "").split(","):
+        media_type = media_range.split(";")[0].strip().lower()
+        if media_type in ("application/x-ndjson", "application/jsonl", "application/json-seq"):
+            return ScheduleFormat.ndjson
+        if media_type == "text/csv":
+            return ScheduleFormat.csv
+    return ScheduleFormat.json
+
+def _chunked(lines):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == STREAM_CHUNK_ROWS:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+# Schedule values are already quantized Decimals, whose str() is a valid JSON number, so the rows are
+# formatted directly instead of being routed through a JSON encoder.
+def iter_schedule_ndjson(rows):
+    return _chunked(
+        f'{{"Month": {row["Month"]}, "Remaining balance": {row["Remaining balance"]}, "Monthly payment": {row["Monthly payment"]}}}\n'
+        for row in rows
+    )
+
+def iter_schedule_csv(rows):
+    return _chunked(chain(
+        ["Month,Remaining balance,Monthly payment\n"],
+        (f'{row["Month"]},{row["Remaining balance"]},{row["Monthly payment"]}\n' for row in rows),
+    ))
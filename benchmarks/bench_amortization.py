@@ -0,0 +1,40 @@
+"""Before/after timings for building an amortization schedule.
+
+Run from the repository root: `python -m benchmarks.bench_amortization`
+"""
+import timeit
+from decimal import Decimal
+
+from app.financial_calculations import iter_amortization_schedule
+
+def closed_form_schedule(amount, annual_interest_rate, term_months):
+    # the previous implementation, which re-derived (1 + i) ** n and (1 + i) ** m on every row
+    i = annual_interest_rate / Decimal("100") / Decimal("12")
+    n = term_months
+    monthly_payment = amount * ((i * (Decimal("1") + i) ** n) / ((Decimal("1") + i) ** n - Decimal("1")))
+    return [
+        {
+            "Month": m,
+            "Remaining balance": (amount * (((Decimal("1") + i) ** n - (Decimal("1") + i) ** m) / ((Decimal("1") + i) ** n - Decimal("1")))).quantize(Decimal("1.00")),
+            "Monthly payment": monthly_payment.quantize(Decimal("1.00")),
+        }
+        for m in range(1, n + 1)
+    ]
+
+def recurrence_schedule(amount, annual_interest_rate, term_months):
+    return list(iter_amortization_schedule(amount, annual_interest_rate, term_months))
+
+def best_of(func, *args, repeat=5, number=20):
+    return min(timeit.repeat(lambda: func(*args), repeat=repeat, number=number)) / number
+
+def main():
+    amount = Decimal("350000")
+    annual_interest_rate = Decimal("6.875")
+    print(f"{'term':>6} {'closed form (ms)':>18} {'recurrence (ms)':>17} {'speedup':>8}")
+    for term_months in (12, 60, 180, 360, 480):
+        before = best_of(closed_form_schedule, amount, annual_interest_rate, term_months)
+        after = best_of(recurrence_schedule, amount, annual_interest_rate, term_months)
+        print(f"{term_months:>6} {before * 1000:>18.3f} {after * 1000:>17.3f} {before / after:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
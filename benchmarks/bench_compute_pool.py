@@ -0,0 +1,98 @@
+"""Latency of cheap endpoints while heavy calculations run: inline vs the process compute pool.
+
+Cheap clients repeatedly fetch a month summary (a closed form, well under a millisecond) while heavy clients
+quote batches of long schedules with fresh terms, so every one is a schedule-cache miss. Three runs are
+compared: the cheap clients alone, with the heavy load computed in the request threads (COMPUTE_POOL_WORKERS=0),
+and with it offloaded to the compute pool. Heavy requests refused with 503 by the pool's backpressure are
+counted, not retried.
+
+Run from the repository root:
+`python -m benchmarks.bench_compute_pool [--seconds 5] [--workers 2] [--heavy 4] [--cheap 4]`
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+
+import httpx
+from sqlmodel import Session
+
+from app.compute_pool import compute_pool
+from app.main import app
+from app.models import Loan
+from app.schedule_cache import schedule_cache
+from benchmarks.common import latency_stats, use_database
+
+HEAVY_BATCH_QUOTES = 8
+HEAVY_TERM_MONTHS = 1200
+
+async def run_load(seconds, heavy, cheap, loan_id):
+    samples = []
+    counts = {"heavy": 0, "refused": 0}
+    fresh_amounts = itertools.count(100000)
+    deadline = time.perf_counter() + seconds
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+
+        async def heavy_client():
+            while time.perf_counter() < deadline:
+                quotes = [{"amount": next(fresh_amounts), "annual_interest_rate": 6.5, "term_months": HEAVY_TERM_MONTHS}
+                          for _ in range(HEAVY_BATCH_QUOTES)]
+                response = await client.post("/quotes/schedule", json={"quotes": quotes})
+                counts["heavy" if response.status_code == 200 else "refused"] += 1
+
+        async def cheap_client(n):
+            for request_number in itertools.count(n):
+                if time.perf_counter() >= deadline:
+                    return
+                start = time.perf_counter_ns()
+                response = await client.get(f"/loan/{loan_id}/summary/{1 + request_number % 360}")
+                samples.append(time.perf_counter_ns() - start)
+                response.raise_for_status()
+
+        await asyncio.gather(*(heavy_client() for _ in range(heavy)), *(cheap_client(n) for n in range(cheap)))
+    return latency_stats(samples), counts
+
+def run_setup(name, seconds, heavy, cheap, loan_id):
+    schedule_cache.clear()
+    stats, counts = asyncio.run(run_load(seconds, heavy, cheap, loan_id))
+    print(f"{name:<16} cheap p50: {stats['p50_ms']:>8.2f} ms   p99: {stats['p99_ms']:>8.2f} ms   "
+          f"heavy/s: {counts['heavy'] / seconds:>6.1f}   refused: {counts['refused']}")
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--heavy", type=int, default=4, help="concurrent clients quoting long schedules")
+    parser.add_argument("--cheap", type=int, default=4, help="concurrent clients fetching month summaries")
+    args = parser.parse_args()
+
+    print(f"{args.heavy} heavy clients ({HEAVY_BATCH_QUOTES} x {HEAVY_TERM_MONTHS}-month quotes), "
+          f"{args.cheap} cheap clients, {args.seconds:g}s per run, {os.cpu_count()} CPUs")
+    with tempfile.TemporaryDirectory() as directory:
+        with use_database(Path(directory) / "load.db") as engine:
+            with Session(engine) as session:
+                loan = Loan(amount=Decimal(250000), annual_interest_rate=Decimal("6.5"), term_months=360)
+                session.add(loan)
+                session.commit()
+                loan_id = loan.id
+            idle = run_setup("no heavy load", args.seconds, 0, args.cheap, loan_id)
+            inline = run_setup("inline", args.seconds, args.heavy, args.cheap, loan_id)
+            compute_pool.workers = args.workers
+            try:
+                # start the worker processes before measuring
+                compute_pool.map_chunks(compute_pool.offload_threshold, len, [None] * args.workers)
+                pooled = run_setup(f"pool ({args.workers} proc)", args.seconds, args.heavy, args.cheap, loan_id)
+            finally:
+                compute_pool.shutdown()
+                compute_pool.workers = 0
+    for name, stats in (("inline", inline), ("pool", pooled)):
+        print(f"{name} cheap p99 vs no heavy load: {stats['p99_ms'] / idle['p99_ms']:.1f}x")
+
+if __name__ == "__main__":
+    main()
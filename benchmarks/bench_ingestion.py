@@ -0,0 +1,69 @@
+"""Rows per second for per-item creation vs the bulk ingestion endpoints, against a file-backed SQLite database.
+
+Run from the repository root: `python -m benchmarks.bench_ingestion [--rows 5000] [--chunk-size 1000]`
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from app.main import app
+from benchmarks.common import use_database
+
+def users(count, prefix):
+    return [{"email": f"{prefix}{n}@null.null", "first_name": "Bench", "last_name": f"User{n}"} for n in range(count)]
+
+def loans(count, user_id):
+    return [
+        {"amount": 1000 + n, "annual_interest_rate": 5 + n % 7, "term_months": 12 * (1 + n % 30), "user_id": user_id}
+        for n in range(count)
+    ]
+
+async def run(rows, chunk_size):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        results = {}
+
+        start = time.perf_counter()
+        for user in users(rows, "single"):
+            (await client.post("/users/", json=user)).raise_for_status()
+        results["POST /users/ (one per user)"] = rows / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        response = await client.post(f"/users/bulk?chunk_size={chunk_size}", json=users(rows, "bulk"))
+        assert response.json()["inserted"] == rows
+        results["POST /users/bulk (JSON array)"] = rows / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for loan in loans(rows, 1):
+            (await client.post("/loans/", json=loan)).raise_for_status()
+        results["POST /loans/ (one per loan)"] = rows / (time.perf_counter() - start)
+
+        body = "".join(json.dumps(loan) + "\n" for loan in loans(rows, 1))
+        start = time.perf_counter()
+        response = await client.post(
+            f"/loans/bulk?chunk_size={chunk_size}", content=body, headers={"Content-Type": "application/x-ndjson"})
+        assert response.json()["inserted"] == rows
+        results["POST /loans/bulk (NDJSON)"] = rows / (time.perf_counter() - start)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        with use_database(Path(directory) / "ingestion.db"):
+            results = asyncio.run(run(args.rows, args.chunk_size))
+
+    print(f"rows: {args.rows}, chunk size: {args.chunk_size}")
+    for name, rows_per_second in results.items():
+        print(f"{name:<32} {rows_per_second:>10,.0f} rows/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Encode time and payload size of a 360-month schedule and a page of loans: the previous response path vs app.json_encoding.
+
+The previous path is what FastAPI did for a returned list of dicts or Loan objects: jsonable_encoder (after
+response_model validation, for loans) followed by the JSONResponse render.
+
+Run from the repository root: `python -m benchmarks.bench_json_encoding [--budget 1.0]`
+"""
+import argparse
+from decimal import Decimal
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from app.json_encoding import encode_columnar_schedule, encode_loans, encode_schedule
+from app.models import Loan
+from app.schedule_cache import schedule_cache
+from benchmarks.common import measure
+
+LOAN_PAGE_SIZE = 100
+LOAN_RESPONSE_FIELDS = ("annual_interest_rate", "term_months", "amount", "id")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds spent on each encoder")
+    args = parser.parse_args()
+
+    schedule = schedule_cache.schedule(Decimal("250000"), Decimal("6.5"), 360)
+    loans = [Loan(id=n, amount=Decimal("10000.000000"), annual_interest_rate=Decimal("6.50000"), term_months=360)
+             for n in range(1, LOAN_PAGE_SIZE + 1)]
+    loan_rows = [tuple(getattr(loan, field) for field in LOAN_RESPONSE_FIELDS) for loan in loans]
+    loans_adapter = TypeAdapter(List[Loan])
+
+    encoders = {
+        "schedule, previous (jsonable_encoder)": lambda: JSONResponse(jsonable_encoder(schedule)).body,
+        "schedule, rows": lambda: encode_schedule(schedule).encode(),
+        "schedule, columnar": lambda: encode_columnar_schedule(schedule).encode(),
+        f"{LOAN_PAGE_SIZE} loans, previous (response_model)": lambda: JSONResponse(
+            jsonable_encoder(loans_adapter.validate_python(loans, from_attributes=True))).body,
+        f"{LOAN_PAGE_SIZE} loans, encode_loans": lambda: encode_loans(loan_rows, LOAN_RESPONSE_FIELDS).encode(),
+    }
+    for name, encode in encoders.items():
+        stats = measure(encode, budget_seconds=args.budget)
+        print(f"{name:<40} p50: {stats['p50_ms']:>8.3f} ms   bytes: {len(encode()):>7}")
+
+if __name__ == "__main__":
+    main()
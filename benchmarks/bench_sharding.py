@@ -0,0 +1,92 @@
+"""Write throughput of sharded storage as the shard count grows.
+
+For each shard count, users are created through the API (so they are spread over the shards by their emails)
+and writer tasks then create loans for them as fast as they can, all at once, through an in-process ASGI client.
+One shard is the single database file set up as the app does it (benchmarks.common.use_database); more shards
+are an app.database.ShardRouter over that many files in a temporary directory, which the app's session
+dependencies route through. Every setup uses SQLiteProfile.from_config(), optionally with another synchronous
+mode: shards help most when commits wait on the disk (synchronous=full), since each shard's writer syncs
+independently, and least when the process itself is the bottleneck.
+
+Run from the repository root:
+`python -m benchmarks.bench_sharding [--shards 1,2,4,8] [--seconds 5] [--writers 16] [--users 64] [--synchronous full]`
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import httpx
+
+from app.database import SQLiteProfile, ShardRouter, get_shard_router, shard_database_paths
+from app.main import app
+from benchmarks.common import use_database
+
+@contextmanager
+def use_shards(directory, shard_count, profile):
+    if shard_count == 1:
+        with use_database(Path(directory) / "load.db", profile):
+            yield
+        return
+    router = ShardRouter(shard_database_paths(Path(directory) / "load.db", shard_count), profile)
+    router.create_all()
+    app.dependency_overrides[get_shard_router] = lambda: router
+    try:
+        yield
+    finally:
+        app.dependency_overrides.clear()
+        router.dispose()
+
+async def run_load(seconds, writers, users):
+    counts = {"writes": 0, "errors": 0}
+    # app exceptions such as "database is locked" become 500 responses and are counted rather than raised
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        user_ids = [
+            (await client.post("/users/", json={"email": f"load{n}@null.null", "first_name": "Load", "last_name": "User"})).json()["id"]
+            for n in range(users)
+        ]
+        deadline = time.perf_counter() + seconds
+
+        async def writer(n):
+            for request_number in range(n, 1 << 62, writers):
+                if time.perf_counter() >= deadline:
+                    return
+                response = await client.post("/loans/", json={
+                    "amount": 5000, "annual_interest_rate": 7, "term_months": 120, "user_id": user_ids[request_number % users]})
+                counts["writes" if response.status_code == 200 else "errors"] += 1
+
+        await asyncio.gather(*(writer(n) for n in range(writers)))
+    return counts
+
+def run_setup(shard_count, profile, seconds, writers, users):
+    with tempfile.TemporaryDirectory() as directory:
+        with use_shards(directory, shard_count, profile):
+            counts = asyncio.run(run_load(seconds, writers, users))
+    print(f"{shard_count:>3} shard{'s' if shard_count > 1 else ' '}   writes/s: {counts['writes'] / seconds:>8.1f}   "
+          f"errors: {counts['errors']}")
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", default="1,2,4,8", help="comma-separated shard counts")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--users", type=int, default=64)
+    parser.add_argument("--synchronous", help="SQLite synchronous mode instead of SQLITE_SYNCHRONOUS")
+    args = parser.parse_args()
+    profile = SQLiteProfile.from_config()
+    if args.synchronous:
+        profile = SQLiteProfile(**{**vars(profile), "synchronous": args.synchronous})
+    shard_counts = [int(shard_count) for shard_count in args.shards.split(",")]
+
+    print(f"{args.writers} writers, {args.users} users, synchronous={profile.synchronous}, {args.seconds:g}s per setup")
+    results = [run_setup(shard_count, profile, args.seconds, args.writers, args.users) for shard_count in shard_counts]
+    for shard_count, counts in zip(shard_counts[1:], results[1:]):
+        if results[0]["writes"]:
+            print(f"{shard_count} shards vs {shard_counts[0]}: {counts['writes'] / results[0]['writes']:.2f}x")
+
+if __name__ == "__main__":
+    main()
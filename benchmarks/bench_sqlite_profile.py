@@ -0,0 +1,111 @@
+"""Concurrent read/write load test: the previous SQLite setup vs the tuned engine profile.
+
+Writer tasks create loans and share them while reader tasks fetch summaries and users' loans, all at once,
+through an in-process ASGI client. The previous setup is the one app.database used to build: default journal
+mode and pragmas, aiosqlite on NullPool, and reads served from the read-write engines. The tuned setup is
+SQLiteProfile.from_config(), i.e. the environment (WAL and synchronous=NORMAL by default) with pooled
+connections and separate read-only pools.
+
+Run from the repository root: `python -m benchmarks.bench_sqlite_profile [--seconds 5] [--writers 8] [--readers 16]`
+"""
+import argparse
+import asyncio
+import itertools
+import tempfile
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from pathlib import Path
+
+import httpx
+from sqlmodel import Session, SQLModel, create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.database import get_async_read_session, get_async_session, get_read_session, get_session
+from app.main import app
+from app.models import Loan, User, UserLoanLink
+from benchmarks.common import _async_session_dependency, _session_dependency, use_database
+
+SEED_USERS = 20
+SEED_LOANS = 200
+
+@contextmanager
+def use_previous_database(database_path):
+    engine = create_engine(f"sqlite:///{database_path}", connect_args={"check_same_thread": False})
+    SQLModel.metadata.create_all(engine)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+    app.dependency_overrides[get_session] = app.dependency_overrides[get_read_session] = _session_dependency(engine)
+    app.dependency_overrides[get_async_session] = app.dependency_overrides[get_async_read_session] = (
+        _async_session_dependency(async_engine))
+    try:
+        yield engine
+    finally:
+        app.dependency_overrides.clear()
+        asyncio.run(async_engine.dispose())
+        engine.dispose()
+
+def seed(engine):
+    with Session(engine) as session:
+        session.add_all(User(email=f"seed{n}@null.null", first_name="Seed", last_name="User") for n in range(SEED_USERS))
+        session.add_all(
+            Loan(amount=Decimal(10000 + n), annual_interest_rate=Decimal("6.5"), term_months=360) for n in range(SEED_LOANS))
+        session.commit()
+        session.add_all(UserLoanLink(user_id=1 + n % SEED_USERS, loan_id=1 + n) for n in range(SEED_LOANS))
+        session.commit()
+
+async def run_load(seconds, writers, readers):
+    counts = {"writes": 0, "reads": 0, "errors": 0}
+    created_loan_ids = itertools.count(SEED_LOANS + 1)
+    deadline = time.perf_counter() + seconds
+    # app exceptions such as "database is locked" become 500 responses and are counted rather than raised
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+
+        async def writer(n):
+            while time.perf_counter() < deadline:
+                response = await client.post(
+                    "/loans/", json={"amount": 5000, "annual_interest_rate": 7, "term_months": 120, "user_id": 1 + n % SEED_USERS})
+                if response.status_code == 200:
+                    counts["writes"] += 1
+                    loan_id = response.json()["id"]
+                    response = await client.post(f"/loans/{loan_id}/share", params={"target_user_id": 1 + (n + 1) % SEED_USERS})
+                counts["writes" if response.status_code == 200 else "errors"] += 1
+
+        async def reader(n):
+            for request_number in itertools.count():
+                if time.perf_counter() >= deadline:
+                    return
+                if request_number % 2:
+                    response = await client.get(f"/users/{1 + n % SEED_USERS}/loans", params={"limit": 20})
+                else:
+                    response = await client.get(f"/loan/{1 + request_number % SEED_LOANS}/summary/{1 + request_number % 360}")
+                counts["reads" if response.status_code == 200 else "errors"] += 1
+
+        await asyncio.gather(*(writer(n) for n in range(writers)), *(reader(n) for n in range(readers)))
+    return counts
+
+def run_setup(name, use, seconds, writers, readers):
+    with tempfile.TemporaryDirectory() as directory:
+        with use(Path(directory) / "load.db") as engine:
+            seed(engine)
+            counts = asyncio.run(run_load(seconds, writers, readers))
+    print(f"{name:<10} writes/s: {counts['writes'] / seconds:>8.1f}   reads/s: {counts['reads'] / seconds:>8.1f}   "
+          f"errors: {counts['errors']}")
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=16)
+    args = parser.parse_args()
+
+    print(f"{args.writers} writers, {args.readers} readers, {args.seconds:g}s per setup")
+    previous = run_setup("previous", use_previous_database, args.seconds, args.writers, args.readers)
+    tuned = run_setup("tuned", use_database, args.seconds, args.writers, args.readers)
+    for kind in ("writes", "reads"):
+        if previous[kind]:
+            print(f"{kind} throughput: {tuned[kind] / previous[kind]:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import asyncio
+import math
+import time
+from contextlib import contextmanager
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from sqlmodel import SQLModel
+
+from app.database import (
+    SQLiteProfile,
+    create_async_sqlite_engine,
+    create_sqlite_engine,
+    get_async_read_session,
+    get_async_session,
+    get_read_session,
+    get_session,
+)
+from app.main import app
+
+def _session_dependency(engine):
+    session_maker = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def get_session_override():
+        session = session_maker()
+        try:
+            yield session
+        finally:
+            session.close()
+    return get_session_override
+
+def _async_session_dependency(async_engine):
+    async_session_maker = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+    async def get_async_session_override():
+        async with async_session_maker() as session:
+            yield session
+    return get_async_session_override
+
+@contextmanager
+def use_database(database_path, profile=None):
+    # Points every session dependency of the app at a fresh SQLite file, using the same engine factory (and, by
+    # default, the same environment-driven profile) as the app. Yields the sync read-write engine for seeding.
+    profile = profile or SQLiteProfile.from_config()
+    engine = create_sqlite_engine(database_path, profile)
+    SQLModel.metadata.create_all(engine)
+    read_engine = create_sqlite_engine(database_path, profile, read_only=True)
+    async_engine = create_async_sqlite_engine(database_path, profile)
+    async_read_engine = create_async_sqlite_engine(database_path, profile, read_only=True)
+    app.dependency_overrides[get_session] = _session_dependency(engine)
+    app.dependency_overrides[get_read_session] = _session_dependency(read_engine)
+    app.dependency_overrides[get_async_session] = _async_session_dependency(async_engine)
+    app.dependency_overrides[get_async_read_session] = _async_session_dependency(async_read_engine)
+    try:
+        yield engine
+    finally:
+        app.dependency_overrides.clear()
+
+        async def dispose_async_engines():
+            await async_engine.dispose()
+            await async_read_engine.dispose()
+        asyncio.run(dispose_async_engines())
+        engine.dispose()
+        read_engine.dispose()
+
+def percentile(sorted_samples, fraction):
+    # nearest-rank percentile
+    index = max(0, math.ceil(fraction * len(sorted_samples)) - 1)
+    return sorted_samples[index]
+
+def latency_stats(samples_ns):
+    samples = sorted(samples_ns)
+    total_seconds = sum(samples) / 1e9
+    return {
+        "samples": len(samples),
+        "p50_ms": percentile(samples, 0.50) / 1e6,
+        "p95_ms": percentile(samples, 0.95) / 1e6,
+        "p99_ms": percentile(samples, 0.99) / 1e6,
+        "ops_per_sec": len(samples) / total_seconds if total_seconds else float("inf"),
+    }
+
+def measure(func, min_samples=20, max_samples=5000, budget_seconds=0.5):
+    # times individual calls until both the sample floor and the time budget are met
+    samples = []
+    deadline = time.perf_counter() + budget_seconds
+    while len(samples) < max_samples and (len(samples) < min_samples or time.perf_counter() < deadline):
+        start = time.perf_counter_ns()
+        func()
+        samples.append(time.perf_counter_ns() - start)
+    return latency_stats(samples)
+
+async def measure_async(func, min_samples=20, max_samples=2000, budget_seconds=0.5):
+    samples = []
+    deadline = time.perf_counter() + budget_seconds
+    while len(samples) < max_samples and (len(samples) < min_samples or time.perf_counter() < deadline):
+        start = time.perf_counter_ns()
+        await func()
+        samples.append(time.perf_counter_ns() - start)
+    return latency_stats(samples)
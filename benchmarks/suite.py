@@ -0,0 +1,263 @@
+"""Benchmark suite for the calculation engine and every API route.
+
+Engine benchmarks time amortization_schedule and loan_summary_for_month over terms of 12 to 480 months and
+rates from 0% to 99.99%. Endpoint benchmarks drive each route in app.main through an in-process ASGI client
+against a freshly seeded SQLite file. Results are written as JSON with p50/p95/p99 latencies and ops/sec.
+
+    python -m benchmarks.suite --output benchmarks/results.json
+    python -m benchmarks.suite --baseline benchmarks/results.json --threshold 0.15
+
+With --baseline, every benchmark whose p50 latency grew by more than the threshold is reported as a regression
+and the process exits with status 1, so the suite can gate a release.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import sys
+import tempfile
+from datetime import datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+
+import httpx
+from fastapi.routing import APIRoute
+from sqlmodel import Session
+
+from app import config
+from app.financial_calculations import amortization_schedule, loan_summary_for_month
+from app.http_caching import loan_etag
+from app.main import app
+from app.loan_modifications import rebuild_checkpoints
+from app.models import Loan, LoanCheckpoint, LoanEvent, LoanEventKind, User, UserLoanLink
+from app.portfolios import rebuild_portfolios
+from app.schedule_cache import schedule_cache
+from benchmarks.common import measure, measure_async, use_database
+
+TERMS = (12, 60, 120, 240, 360, 480)
+RATES = (Decimal("0"), Decimal("0.001"), Decimal("6.875"), Decimal("36"), Decimal("99.99"))
+AMOUNT = Decimal("350000")
+
+SEED_USERS = 50
+SEED_LOANS = 500
+PORTFOLIO_USER_LOANS = 200
+# a 360-month loan with a rate reset and a prepayment
+MODIFIED_LOAN_ID = 10
+MODIFIED_LOAN_EVENTS = (
+    {"kind": LoanEventKind.rate_reset, "month": 61, "annual_interest_rate": Decimal("4.5")},
+    {"kind": LoanEventKind.prepayment, "month": 120, "amount": Decimal("2000")},
+)
+
+def run_engine_benchmarks(budget_seconds):
+    results = {}
+    for term_months, rate in itertools.product(TERMS, RATES):
+        loan = Loan(amount=AMOUNT, annual_interest_rate=rate, term_months=term_months)
+        results[f"engine/amortization_schedule/term={term_months}/rate={rate}"] = measure(
+            lambda: amortization_schedule(loan), budget_seconds=budget_seconds)
+        results[f"engine/loan_summary_for_month/term={term_months}/rate={rate}"] = measure(
+            lambda: loan_summary_for_month(term_months - 1 or 1, loan), budget_seconds=budget_seconds)
+    return results
+
+def seed_loan(n):
+    return Loan(id=n, amount=Decimal(10000 + 97 * n), annual_interest_rate=Decimal(n % 25) + Decimal("0.125"),
+                term_months=TERMS[n % len(TERMS)])
+
+def seed_database(engine):
+    # users 1 and 2 exist for sharing; user 1 can see the first PORTFOLIO_USER_LOANS loans
+    with Session(engine) as session:
+        session.add_all(
+            User(email=f"seed{n}@null.null", first_name="Seed", last_name=f"User{n}") for n in range(1, SEED_USERS + 1))
+        session.add_all(seed_loan(n) for n in range(1, SEED_LOANS + 1))
+        session.commit()
+        session.add_all(
+            UserLoanLink(user_id=1 if n <= PORTFOLIO_USER_LOANS else 2 + n % (SEED_USERS - 1), loan_id=n)
+            for n in range(1, SEED_LOANS + 1))
+        session.commit()
+        seed_modifications(session)
+        if config.PORTFOLIO_ROLLUPS:
+            rebuild_portfolios(session)
+
+def seed_modifications(session):
+    loan = session.get(Loan, MODIFIED_LOAN_ID)
+    events = [LoanEvent(loan_id=loan.id, **event) for event in MODIFIED_LOAN_EVENTS]
+    checkpoints = rebuild_checkpoints(loan.amount, loan.annual_interest_rate, loan.term_months, (), events, 0)
+    session.add_all(events)
+    session.add_all(
+        LoanCheckpoint(loan_id=loan.id, month=month, balance=balance, annual_interest_rate=rate, interest_paid=interest_paid)
+        for month, balance, rate, interest_paid in checkpoints)
+    loan.modification_count = len(events)
+    session.commit()
+
+def endpoint_scenarios():
+    # (name, method, route path, request factory); factories get a running counter so writes stay unique
+    long_loan_id = next(n for n in range(1, SEED_LOANS + 1) if TERMS[n % len(TERMS)] == 360)
+    share_targets = ((loan_id, user_id) for user_id in range(3, SEED_USERS + 1) for loan_id in range(1, PORTFOLIO_USER_LOANS + 1))
+    loan_ids = list(range(1, SEED_LOANS + 1))
+    # loans that get a rate reset per request: each later in its term than the last one it got
+    event_loan_ids = [n for n in loan_ids if TERMS[n % len(TERMS)] == 360 and n not in (long_loan_id, MODIFIED_LOAN_ID)]
+    schedule_etag = loan_etag(seed_loan(long_loan_id), "schedule", "json", 1, 360)
+    # the portfolio reads one rollup row with PORTFOLIO_ROLLUPS and summarizes every loan of the user without
+    portfolio_source = "rollup" if config.PORTFOLIO_ROLLUPS else "200 loans summarized"
+
+    def cold_schedule(n):
+        schedule_cache.clear()
+        return {"method": "GET", "url": f"/loan/{long_loan_id}/schedule"}
+
+    def cold_modified_schedule(n):
+        schedule_cache.clear()
+        return {"method": "GET", "url": f"/loan/{MODIFIED_LOAN_ID}/schedule"}
+
+    def rate_reset(n):
+        loan_id = event_loan_ids[n % len(event_loan_ids)]
+        month = 1 + 12 * (n // len(event_loan_ids)) % 348
+        return {"method": "POST", "url": f"/loans/{loan_id}/events",
+                "json": {"kind": "rate_reset", "month": month, "annual_interest_rate": 3 + n % 5}}
+
+    def share(n):
+        loan_id, user_id = next(share_targets)
+        return {"method": "POST", "url": f"/loans/{loan_id}/share", "params": {"target_user_id": user_id}}
+
+    return [
+        ("POST /users/", "POST", "/users/", lambda n: {
+            "method": "POST", "url": "/users/",
+            "json": {"email": f"bench{n}@null.null", "first_name": "Bench", "last_name": "User"}}),
+        ("POST /users/bulk (100 users)", "POST", "/users/bulk", lambda n: {
+            "method": "POST", "url": "/users/bulk",
+            "json": [{"email": f"bulk{n}-{k}@null.null", "first_name": "Bulk", "last_name": "User"} for k in range(100)]}),
+        ("POST /loans/", "POST", "/loans/", lambda n: {
+            "method": "POST", "url": "/loans/",
+            "json": {"amount": 1000 + n, "annual_interest_rate": 5, "term_months": 360, "user_id": 2}}),
+        ("POST /loans/bulk (100 loans)", "POST", "/loans/bulk", lambda n: {
+            "method": "POST", "url": "/loans/bulk",
+            "json": [{"amount": 1000 + k, "annual_interest_rate": 5, "term_months": 360, "user_id": 2} for k in range(100)]}),
+        ("GET /loan/{id}/schedule (360 months, cached)", "GET", "/loan/{loan_id}/schedule", lambda n: {
+            "method": "GET", "url": f"/loan/{long_loan_id}/schedule"}),
+        ("GET /loan/{id}/schedule (360 months, cold cache)", "GET", "/loan/{loan_id}/schedule", cold_schedule),
+        ("GET /loan/{id}/schedule (If-None-Match, 304)", "GET", "/loan/{loan_id}/schedule", lambda n: {
+            "method": "GET", "url": f"/loan/{long_loan_id}/schedule", "headers": {"If-None-Match": schedule_etag}}),
+        ("GET /loan/{id}/schedule?from_month&to_month (12 months)", "GET", "/loan/{loan_id}/schedule", lambda n: {
+            "method": "GET", "url": f"/loan/{long_loan_id}/schedule", "params": {"from_month": 1 + 12 * (n % 30), "to_month": 12 + 12 * (n % 30)}}),
+        ("GET /loan/{id}/schedule?format=ndjson (360 months)", "GET", "/loan/{loan_id}/schedule", lambda n: {
+            "method": "GET", "url": f"/loan/{long_loan_id}/schedule", "params": {"format": "ndjson"}}),
+        ("GET /loan/{id}/schedule?format=csv (360 months)", "GET", "/loan/{loan_id}/schedule", lambda n: {
+            "method": "GET", "url": f"/loan/{long_loan_id}/schedule", "params": {"format": "csv"}}),
+        ("GET /loan/{id}/schedule?format=columnar (360 months)", "GET", "/loan/{loan_id}/schedule", lambda n: {
+            "method": "GET", "url": f"/loan/{long_loan_id}/schedule", "params": {"format": "columnar"}}),
+        ("GET /loan/{id}/schedule (360 months, modified loan, cold cache)", "GET", "/loan/{loan_id}/schedule",
+         cold_modified_schedule),
+        ("GET /loan/{id}/summary/{month}", "GET", "/loan/{loan_id}/summary/{month}", lambda n: {
+            "method": "GET", "url": f"/loan/{long_loan_id}/summary/{1 + n % 360}"}),
+        ("GET /loan/{id}/summary/{month} (modified loan)", "GET", "/loan/{loan_id}/summary/{month}", lambda n: {
+            "method": "GET", "url": f"/loan/{MODIFIED_LOAN_ID}/summary/{1 + n % 360}"}),
+        ("GET /loan/{id}/summaries (12 months)", "GET", "/loan/{loan_id}/summaries", lambda n: {
+            "method": "GET", "url": f"/loan/{long_loan_id}/summaries", "params": {"months": list(range(12, 360, 29))}}),
+        ("POST /loans/batch/summary (500 loans)", "POST", "/loans/batch/summary", lambda n: {
+            "method": "POST", "url": "/loans/batch/summary", "json": {"loan_ids": loan_ids, "month": 12}}),
+        ("GET /users/{id}/loans (200 loans)", "GET", "/users/{user_id}/loans", lambda n: {
+            "method": "GET", "url": "/users/1/loans"}),
+        ("GET /users/{id}/loans?limit=50&fields=id", "GET", "/users/{user_id}/loans", lambda n: {
+            "method": "GET", "url": "/users/1/loans", "params": {"limit": 50, "after": 50 * (n % 3), "fields": "id"}}),
+        ("GET /users/{id}/loans/summary?limit=40 (loans with month summaries)", "GET", "/users/{user_id}/loans/summary", lambda n: {
+            "method": "GET", "url": "/users/1/loans/summary", "params": {"month": 1 + n % 360, "limit": 40, "after": 40 * (n % 5)}}),
+        (f"GET /users/{{id}}/portfolio ({portfolio_source})", "GET", "/users/{user_id}/portfolio", lambda n: {
+            "method": "GET", "url": "/users/1/portfolio", "params": {"month": 1 + n % 360}}),
+        ("POST /loans/{id}/share", "POST", "/loans/{loan_id}/share", share),
+        ("POST /loans/{id}/events (rate reset)", "POST", "/loans/{loan_id}/events", rate_reset),
+        ("GET /loans/{id}/events", "GET", "/loans/{loan_id}/events", lambda n: {
+            "method": "GET", "url": f"/loans/{MODIFIED_LOAN_ID}/events"}),
+        ("POST /quotes/schedule (10 quotes, 360 months)", "POST", "/quotes/schedule", lambda n: {
+            "method": "POST", "url": "/quotes/schedule",
+            "json": {"quotes": [{"amount": 200000 + 1000 * k, "annual_interest_rate": 6.5, "term_months": 360} for k in range(10)]}}),
+        ("POST /quotes/summary (100 quotes, slider sweep)", "POST", "/quotes/summary", lambda n: {
+            "method": "POST", "url": "/quotes/summary",
+            "json": {"quotes": [{"amount": 200000 + 1000 * k, "annual_interest_rate": 6.5, "term_months": 360, "month": 60} for k in range(100)]}}),
+        ("GET /metrics", "GET", "/metrics", lambda n: {"method": "GET", "url": "/metrics"}),
+    ]
+
+async def run_endpoint_scenarios(budget_seconds):
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, _, _, build_request in endpoint_scenarios():
+            counter = itertools.count()
+
+            async def call():
+                response = await client.request(**build_request(next(counter)))
+                if response.is_error:
+                    response.raise_for_status()
+
+            results[f"endpoint/{name}"] = await measure_async(call, budget_seconds=budget_seconds, max_samples=1000)
+    return results
+
+def run_endpoint_benchmarks(budget_seconds):
+    uncovered_routes = sorted(
+        f"{method} {route.path}"
+        for route in app.routes if isinstance(route, APIRoute)
+        for method in route.methods
+        if (method, route.path) not in {(method, path) for _, method, path, _ in endpoint_scenarios()}
+    )
+    for route in uncovered_routes:
+        print(f"warning: no benchmark scenario for {route}", file=sys.stderr)
+    with tempfile.TemporaryDirectory() as directory:
+        with use_database(Path(directory) / "bench.db") as engine:
+            seed_database(engine)
+            schedule_cache.clear()
+            try:
+                return asyncio.run(run_endpoint_scenarios(budget_seconds))
+            finally:
+                schedule_cache.clear()
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print(f"{'benchmark':<78} {'baseline p50':>13} {'p50':>10} {'change':>8}")
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["p50_ms"], stats["p50_ms"]
+        change = (after - before) / before if before else 0.0
+        flag = "  REGRESSION" if change > threshold else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<78} {before:>11.3f}ms {after:>8.3f}ms {change:>+7.1%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", type=Path, help="write results as JSON to this file")
+    parser.add_argument("--baseline", type=Path, help="compare against results previously written with --output")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed p50 slowdown before flagging (default 0.10)")
+    parser.add_argument("--only", choices=("engine", "endpoints"), help="run just one half of the suite")
+    parser.add_argument("--budget", type=float, default=0.3, help="seconds spent sampling each benchmark")
+    args = parser.parse_args()
+
+    results = {}
+    if args.only != "endpoints":
+        results.update(run_engine_benchmarks(args.budget))
+    if args.only != "engine":
+        results.update(run_endpoint_benchmarks(args.budget))
+
+    report = {
+        "metadata": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}", file=sys.stderr)
+            sys.exit(1)
+    else:
+        print(f"{'benchmark':<78} {'p50':>9} {'p95':>9} {'p99':>9} {'ops/sec':>10}")
+        for name, stats in results.items():
+            print(f"{name:<78} {stats['p50_ms']:>7.3f}ms {stats['p95_ms']:>7.3f}ms {stats['p99_ms']:>7.3f}ms {stats['ops_per_sec']:>10,.0f}")
+
+if __name__ == "__main__":
+    main()
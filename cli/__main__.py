@@ -0,0 +1,141 @@
+"""Maintenance commands for the loan database. Run from the repository root: `python -m cli <command> --help`
+
+    backfill-schedules   materialize loan_schedule_row for loans that have no rows yet
+    import               stream users, loans or shares from CSV/JSONL into the database
+    export               stream users, loans (optionally with month summaries) or shares out as CSV/JSONL
+    rebuild-portfolios   recompute every user's portfolio rollup from their loans
+    check-portfolios     compare every user's portfolio rollup with one recomputed from their loans
+"""
+import argparse
+import itertools
+import sys
+import time
+from contextlib import ExitStack, nullcontext
+
+from sqlmodel import Session
+
+from app.database import create_db_and_tables, engine, read_engines, shard_router, write_engines
+from app.loan_book import (KINDS, LoanBookError, export_fields, export_kinds, file_format, import_records, iter_export, iter_records,
+                           write_records)
+from app.materialized_schedules import backfill_schedules
+from app.portfolios import check_portfolios, rebuild_portfolios
+
+def progress_printer(label):
+    start = time.perf_counter()
+
+    def report(done):
+        elapsed = time.perf_counter() - start
+        print(f"\r{label}: {done:,} ({done / elapsed if elapsed else 0:,.0f}/s)", end="", file=sys.stderr, flush=True)
+    return report
+
+# The maintenance commands go through every database file: the only one, or each shard with DATABASE_SHARDS > 1
+def run_backfill_schedules(args):
+    create_db_and_tables()
+    materialized = 0
+    for shard, shard_engine in enumerate(write_engines()):
+        with Session(shard_engine) as session:
+            materialized += backfill_schedules(session, args.batch_size, args.rebuild, progress_printer(f"file {shard}: loans materialized"))
+    print(f"\nmaterialized {materialized:,} loan schedules", file=sys.stderr)
+
+def run_rebuild_portfolios(args):
+    create_db_and_tables()
+    rebuilt = 0
+    for shard, shard_engine in enumerate(write_engines()):
+        with Session(shard_engine) as session:
+            rebuilt += rebuild_portfolios(session, args.batch_size, progress_printer(f"file {shard}: users rebuilt"))
+    print(f"\nrebuilt the portfolios of {rebuilt:,} users", file=sys.stderr)
+
+def run_check_portfolios(args):
+    mismatched_user_ids = []
+    for shard, shard_engine in enumerate(read_engines()):
+        with Session(shard_engine) as session:
+            mismatched_user_ids += check_portfolios(session, args.batch_size, progress_printer(f"file {shard}: users checked"))
+    print(file=sys.stderr)
+    if mismatched_user_ids:
+        print("\n".join(str(user_id) for user_id in mismatched_user_ids))
+        sys.exit(f"error: the portfolios of {len(mismatched_user_ids):,} users differ from their loans; "
+                 "run `python -m cli rebuild-portfolios` to recompute them")
+    print("every portfolio matches its loans", file=sys.stderr)
+
+def open_stream(path, mode):
+    # "-" is stdin or stdout; files are opened with newline="" as the csv module expects
+    if path == "-":
+        return nullcontext(sys.stdin if mode == "r" else sys.stdout)
+    return open(path, mode, newline="", encoding="utf-8")
+
+def run_import(args):
+    create_db_and_tables()
+    kind = KINDS[args.kind]
+    checkpoint_path = None if args.no_checkpoint or args.path == "-" else args.checkpoint or f"{args.path}.checkpoint"
+    try:
+        format = file_format(args.path, args.format)
+        with open_stream(args.path, "r") as stream, Session(engine) as session:
+            read, inserted = import_records(session, kind, iter_records(stream, format), args.chunk_size,
+                                            checkpoint_path, progress_printer(f"{kind.name} imported"), shard_router)
+    except LoanBookError as e:
+        print(file=sys.stderr)
+        if checkpoint_path:
+            print(f"committed records are recorded in {checkpoint_path}; rerun the same command to resume", file=sys.stderr)
+        sys.exit(f"error: {e}")
+    print(f"\nread {read:,} {kind.name} records, inserted {inserted:,} ({read - inserted:,} already present)", file=sys.stderr)
+
+def run_export(args):
+    kind = KINDS[args.kind]
+    if args.summary_month is not None and kind.name != "loans":
+        sys.exit("error: --summary-month only applies to loans")
+    if args.summary_month is not None and args.summary_month < 1:
+        sys.exit("error: --summary-month must be at least 1")
+    try:
+        format = file_format(args.path, args.format)
+    except LoanBookError as e:
+        sys.exit(f"error: {e}")
+    with open_stream(args.path, "w") as stream, ExitStack() as connections:
+        # shard by shard, which keeps users and loans in id order
+        records = itertools.chain.from_iterable(
+            iter_export(connections.enter_context(shard_engine.connect()), table_kind, args.summary_month, args.chunk_size)
+            for shard_engine in read_engines() for table_kind in export_kinds(kind))
+        written = write_records(stream, format, export_fields(kind, args.summary_month), records,
+                                progress_printer(f"{kind.name} exported"), args.chunk_size)
+    print(f"\nexported {written:,} {kind.name} records", file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m cli", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backfill = commands.add_parser("backfill-schedules", help="materialize schedules of existing loans")
+    backfill.add_argument("--batch-size", type=int, default=500, help="loans per transaction (default 500)")
+    backfill.add_argument("--rebuild", action="store_true", help="delete and rewrite every materialized schedule")
+    backfill.set_defaults(run=run_backfill_schedules)
+
+    import_command = commands.add_parser("import", help="import users, loans or shares from CSV or JSONL",
+                                         description="Import users, then loans, then shares; ids are kept as they are in the file.")
+    import_command.add_argument("kind", choices=list(KINDS))
+    import_command.add_argument("path", help="input file, or - for stdin (requires --format)")
+    import_command.add_argument("--format", choices=["csv", "jsonl"], help="default: from the file extension")
+    import_command.add_argument("--chunk-size", type=int, default=10000, help="records per transaction (default 10000)")
+    import_command.add_argument("--checkpoint", help="checkpoint file for resuming (default: <path>.checkpoint)")
+    import_command.add_argument("--no-checkpoint", action="store_true", help="do not write or resume from a checkpoint")
+    import_command.set_defaults(run=run_import)
+
+    export_command = commands.add_parser("export", help="export users, loans or shares as CSV or JSONL")
+    export_command.add_argument("kind", choices=list(KINDS))
+    export_command.add_argument("path", nargs="?", default="-", help="output file, or - for stdout (the default; requires --format)")
+    export_command.add_argument("--format", choices=["csv", "jsonl"], help="default: from the file extension")
+    export_command.add_argument("--summary-month", type=int, help="add each loan's summary after this month")
+    export_command.add_argument("--chunk-size", type=int, default=10000, help="rows fetched per batch (default 10000)")
+    export_command.set_defaults(run=run_export)
+
+    rebuild = commands.add_parser("rebuild-portfolios", help="recompute the portfolio rollups of every user")
+    rebuild.add_argument("--batch-size", type=int, default=500, help="users per transaction (default 500)")
+    rebuild.set_defaults(run=run_rebuild_portfolios)
+
+    check = commands.add_parser("check-portfolios", help="list the users whose portfolio rollup differs from their loans",
+                                description="Prints the id of every user whose rollup differs and exits non-zero if there are any.")
+    check.add_argument("--batch-size", type=int, default=500, help="users per batch (default 500)")
+    check.set_defaults(run=run_check_portfolios)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
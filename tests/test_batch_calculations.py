@@ -0,0 +1,48 @@
+import numpy as np
+from decimal import Decimal
+
+from app.batch_calculations import batch_amortization_schedules, batch_loan_summaries
+from app.financial_calculations import iter_amortization_schedule, iter_loan_summaries
+
+def random_portfolio(size, seed=7):
+    rng = np.random.default_rng(seed)
+    amounts = [Decimal(int(cents)).scaleb(-2) for cents in rng.integers(100_00, 2_000_000_00, size)]
+    rates = [Decimal(int(bps)).scaleb(-2) for bps in rng.integers(0, 3600, size)]
+    terms = [int(term) for term in rng.choice([6, 12, 36, 60, 120, 180, 240, 360, 480], size)]
+    return amounts, rates, terms
+
+def to_cents(value):
+    return int(value.scaleb(2))
+
+def test_batch_summaries_match_decimal_engine():
+    amounts, rates, terms = random_portfolio(300)
+    months = [max(1, term * k // 7) for k, term in enumerate(terms, start=1)]
+    months = [min(month, term) for month, term in zip(months, terms)]
+
+    batch = batch_loan_summaries(amounts, rates, terms, months)
+
+    for index, (amount, rate, term, month) in enumerate(zip(amounts, rates, terms, months)):
+        expected = next(iter_loan_summaries(amount, rate, term, [month]))
+        for key, value in expected.items():
+            assert abs(int(batch[key][index]) - to_cents(value)) <= 1
+
+def test_batch_summaries_clamp_months_past_term():
+    batch = batch_loan_summaries([1000, 1000], [12, 0], [6, 6], 10)
+
+    assert batch["current principal balance"].tolist() == [0, 0]
+    assert batch["principal already paid"].tolist() == [1000_00, 1000_00]
+    assert batch["interest already paid"].tolist()[1] == 0
+
+def test_batch_schedules_match_decimal_engine():
+    amounts, rates, terms = random_portfolio(40, seed=11)
+
+    payments, balances = batch_amortization_schedules(amounts, rates, terms)
+
+    assert balances.shape == (40, max(terms))
+    for index, (amount, rate, term) in enumerate(zip(amounts, rates, terms)):
+        schedule = list(iter_amortization_schedule(amount, rate, term))
+        assert abs(int(payments[index]) - to_cents(schedule[0]["Monthly payment"])) <= 1
+        expected_balances = np.array([to_cents(row["Remaining balance"]) for row in schedule])
+        assert np.abs(balances[index, :term] - expected_balances).max() <= 1
+        assert balances[index, term - 1] == 0
+        assert not balances[index, term:].any()
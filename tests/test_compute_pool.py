@@ -0,0 +1,85 @@
+import threading
+import time
+from decimal import Decimal
+
+import pytest
+
+from app import config
+from app.compute_pool import ComputePool, ComputePoolFull, ComputeTimeout
+from app.schedule_cache import CachedSchedule, _build_schedules, schedule_key
+
+@pytest.fixture(name="pool")
+def pool_fixture():
+    pool = ComputePool(workers=1, max_pending_tasks=4, task_timeout=30, chunk_size=2, offload_threshold=100)
+    yield pool
+    pool.shutdown()
+
+def test_disabled_pool_computes_inline():
+    pool = ComputePool(workers=0, max_pending_tasks=0, task_timeout=30, chunk_size=2, offload_threshold=1)
+
+    assert not pool.offloads(10 ** 6)
+    assert pool.run(10 ** 6, sum, [1, 2, 3]) == 6
+    assert pool.map_chunks(10 ** 6, len, [1, 2, 3]) == [3]
+    assert pool.stats()["offloaded_tasks"] == 0
+
+def test_small_work_stays_inline(pool):
+    assert pool.run(99, sum, [1, 2]) == 3
+    assert pool.stats()["offloaded_tasks"] == 0
+
+def test_large_work_runs_in_a_worker_process(pool):
+    entry = pool.run(360, CachedSchedule, Decimal("250000"), Decimal("6.5"), 360)
+    inline = CachedSchedule(Decimal("250000"), Decimal("6.5"), 360)
+
+    assert entry.rows == inline.rows
+    assert entry.summary(120) == inline.summary(120)
+    assert pool.stats()["offloaded_tasks"] == 1
+    assert pool.stats()["pending_tasks"] == 0
+
+def test_map_chunks_splits_the_batch_into_tasks_in_order(pool):
+    loan_terms = [(Decimal(1000 * n), Decimal("5"), 120) for n in range(1, 6)]
+
+    chunks = pool.map_chunks(600, _build_schedules, [schedule_key(*terms) for terms in loan_terms])
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert [entry.rows for chunk in chunks for entry in chunk] == [CachedSchedule(*terms).rows for terms in loan_terms]
+    assert pool.stats()["offloaded_tasks"] == 3
+
+def test_workers_use_the_parent_calculation_engine(monkeypatch, pool):
+    monkeypatch.setattr(config, "ROUNDING_POLICY", "half_up")
+
+    entry = pool.run(480, CachedSchedule, Decimal("12345.67"), Decimal("7.125"), 480)
+    # a zero-rate loan paying exactly 10.005 a month, which is a tie that only half-up rounds to 10.01
+    tie = pool.run(480, CachedSchedule, Decimal("4802.40"), Decimal("0"), 480)
+
+    assert entry.rows == CachedSchedule(Decimal("12345.67"), Decimal("7.125"), 480).rows
+    assert tie.rows == CachedSchedule(Decimal("4802.40"), Decimal("0"), 480).rows
+    assert tie.rows[0] == {"Month": 1, "Remaining balance": Decimal("4792.40"), "Monthly payment": Decimal("10.01")}
+
+def test_full_queue_refuses_new_work(pool):
+    pool.max_pending_tasks = 1
+    busy = threading.Thread(target=pool.run, args=(100, time.sleep, 1))
+    busy.start()
+    while pool.stats()["pending_tasks"] == 0:
+        time.sleep(0.01)
+
+    with pytest.raises(ComputePoolFull):
+        pool.run(100, time.sleep, 0)
+    busy.join()
+
+    assert pool.stats()["rejected_requests"] == 1
+    assert pool.stats()["pending_tasks"] == 0
+    assert pool.run(100, sum, [1, 2]) == 3
+
+def test_batches_are_admitted_or_refused_whole(pool):
+    with pytest.raises(ComputePoolFull):
+        pool.map_chunks(100, len, list(range(10)))
+
+    assert pool.stats()["offloaded_tasks"] == 0
+
+def test_slow_work_times_out(pool):
+    pool.task_timeout = 0.1
+
+    with pytest.raises(ComputeTimeout):
+        pool.run(100, time.sleep, 1)
+
+    assert pool.stats()["timeouts"] == 1
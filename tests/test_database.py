@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.database import SQLiteProfile, create_async_sqlite_engine, create_sqlite_engine
+
+PROFILE = SQLiteProfile(journal_mode="wal", synchronous="normal", mmap_size=1048576, cache_size=-4096, busy_timeout_ms=2500)
+
+def pragma(connection, name):
+    return connection.execute(text(f"PRAGMA {name}")).scalar_one()
+
+def test_engine_applies_the_profile_pragmas(tmp_path):
+    engine = create_sqlite_engine(tmp_path / "profile.db", PROFILE)
+    with engine.connect() as connection:
+        assert pragma(connection, "journal_mode") == "wal"
+        assert pragma(connection, "synchronous") == 1
+        assert pragma(connection, "mmap_size") == 1048576
+        assert pragma(connection, "cache_size") == -4096
+        assert pragma(connection, "busy_timeout") == 2500
+        assert pragma(connection, "query_only") == 0
+        assert pragma(connection, "foreign_keys") == 1
+    assert engine.pool.size() == PROFILE.pool_size
+    engine.dispose()
+
+def test_async_engine_applies_the_profile_pragmas(tmp_path):
+    async def read_pragmas():
+        async_engine = create_async_sqlite_engine(tmp_path / "profile.db", PROFILE)
+        async with async_engine.connect() as connection:
+            values = [(await connection.execute(text(f"PRAGMA {name}"))).scalar_one()
+                      for name in ("journal_mode", "synchronous", "busy_timeout")]
+        await async_engine.dispose()
+        return values
+
+    assert asyncio.run(read_pragmas()) == ["wal", 1, 2500]
+
+def test_read_only_engine_rejects_writes(tmp_path):
+    engine = create_sqlite_engine(tmp_path / "profile.db", PROFILE)
+    read_engine = create_sqlite_engine(tmp_path / "profile.db", PROFILE, read_only=True)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE item (id INTEGER PRIMARY KEY)"))
+        connection.execute(text("INSERT INTO item (id) VALUES (1)"))
+
+    with read_engine.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM item")).scalar_one() == 1
+        assert pragma(connection, "query_only") == 1
+        with pytest.raises(OperationalError, match="readonly"):
+            connection.execute(text("INSERT INTO item (id) VALUES (2)"))
+    assert read_engine.pool.size() == PROFILE.read_pool_size
+    engine.dispose()
+    read_engine.dispose()
+
+def test_readers_are_not_blocked_by_an_open_write_transaction_in_wal_mode(tmp_path):
+    engine = create_sqlite_engine(tmp_path / "profile.db", PROFILE)
+    read_engine = create_sqlite_engine(tmp_path / "profile.db", PROFILE, read_only=True)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE item (id INTEGER PRIMARY KEY)"))
+        connection.execute(text("INSERT INTO item (id) VALUES (1)"))
+
+    with engine.begin() as writer:
+        writer.execute(text("INSERT INTO item (id) VALUES (2)"))
+        # the reader sees the last committed state instead of waiting for the writer's lock
+        with read_engine.connect() as reader:
+            assert reader.execute(text("SELECT count(*) FROM item")).scalar_one() == 1
+    with read_engine.connect() as reader:
+        assert reader.execute(text("SELECT count(*) FROM item")).scalar_one() == 2
+    engine.dispose()
+    read_engine.dispose()
+
+def test_unknown_journal_and_synchronous_modes_are_rejected():
+    with pytest.raises(ValueError, match="journal mode"):
+        SQLiteProfile(journal_mode="fast")
+    with pytest.raises(ValueError, match="synchronous mode"):
+        SQLiteProfile(synchronous="sometimes")
@@ -0,0 +1,122 @@
+import pytest
+from decimal import Decimal, ROUND_HALF_UP
+
+from app.financial_calculations import Amortization, amortization_schedule, iter_amortization_schedule, iter_loan_summaries, loan_summaries_for_months
+from app.models import Loan
+
+def closed_form_schedule(amount, annual_interest_rate, term_months):
+    # the original per-row closed-form implementation, kept as the reference for the differential tests
+    i = annual_interest_rate / Decimal("100") / Decimal("12")
+    n = term_months
+    monthly_payment = amount * ((i * (Decimal("1") + i) ** n) / ((Decimal("1") + i) ** n - Decimal("1")))
+    return [
+        {
+            "Month": m,
+            "Remaining balance": (amount * (((Decimal("1") + i) ** n - (Decimal("1") + i) ** m) / ((Decimal("1") + i) ** n - Decimal("1")))).quantize(Decimal("1.00")),
+            "Monthly payment": monthly_payment.quantize(Decimal("1.00")),
+        }
+        for m in range(1, n + 1)
+    ]
+
+def iterative_summary(month, amount, annual_interest_rate, term_months):
+    # the original month-by-month walk, kept as the reference for the closed-form summaries
+    i = annual_interest_rate / Decimal("100") / Decimal("12")
+    n = term_months
+    current_principal_balance = amount
+    monthly_payment = current_principal_balance * ((i * (Decimal("1") + i) ** n) / ((Decimal("1") + i) ** n - Decimal("1")))
+    principal_already_paid = Decimal("0")
+    interest_already_paid = Decimal("0")
+    for m in range(1, month + 1):
+        interest_paid_this_month = current_principal_balance * i
+        principal_paid_this_month = monthly_payment - interest_paid_this_month
+        principal_already_paid += principal_paid_this_month
+        interest_already_paid += interest_paid_this_month
+        current_principal_balance -= principal_paid_this_month
+    return {
+        "current principal balance": current_principal_balance.quantize(Decimal("1.00")),
+        "principal already paid": principal_already_paid.quantize(Decimal("1.00")),
+        "interest already paid": interest_already_paid.quantize(Decimal("1.00"))
+    }
+
+AMOUNTS = [Decimal("1000"), Decimal("100000"), Decimal("123456.789012"), Decimal("5000000")]
+RATES = [Decimal("0.001"), Decimal("0.5"), Decimal("3.25"), Decimal("6.5"), Decimal("12"), Decimal("24"), Decimal("36.5"), Decimal("99.99")]
+TERMS = [1, 2, 6, 12, 60, 180, 360, 480]
+
+@pytest.mark.parametrize("annual_interest_rate", RATES)
+@pytest.mark.parametrize("term_months", TERMS)
+def test_schedule_matches_closed_form(annual_interest_rate, term_months):
+    for amount in AMOUNTS:
+        schedule = list(iter_amortization_schedule(amount, annual_interest_rate, term_months))
+        assert schedule == closed_form_schedule(amount, annual_interest_rate, term_months)
+
+@pytest.mark.parametrize("term_months", TERMS)
+def test_schedule_final_balance_is_exactly_zero(term_months):
+    for amount in AMOUNTS:
+        final_row = list(iter_amortization_schedule(amount, Decimal("7.125"), term_months))[-1]
+        assert final_row["Month"] == term_months
+        assert final_row["Remaining balance"].as_tuple() == Decimal("0.00").as_tuple()
+
+def test_schedule_zero_interest_rate():
+    schedule = list(iter_amortization_schedule(Decimal("1200"), Decimal("0"), 12))
+
+    assert [row["Remaining balance"] for row in schedule] == [Decimal(1100 - 100 * m) for m in range(12)]
+    assert all(row["Monthly payment"] == Decimal("100.00") for row in schedule)
+
+@pytest.mark.parametrize("annual_interest_rate", [Decimal("0"), Decimal("3.25"), Decimal("99.99")])
+def test_schedule_window_matches_the_full_schedule(annual_interest_rate):
+    amount, term_months = Decimal("123456.789012"), 360
+    schedule = list(iter_amortization_schedule(amount, annual_interest_rate, term_months))
+    for from_month, to_month in [(1, 12), (13, 24), (200, 211), (355, 360), (360, 360), (349, 500)]:
+        window = list(iter_amortization_schedule(amount, annual_interest_rate, term_months, from_month, to_month))
+        assert window == schedule[from_month - 1:to_month]
+    assert list(iter_amortization_schedule(amount, annual_interest_rate, term_months, 361, 372)) == []
+
+def test_amortization_schedule_for_loan():
+    loan = Loan(amount=Decimal("100000"), annual_interest_rate=Decimal("12"), term_months=6)
+
+    assert amortization_schedule(loan) == closed_form_schedule(Decimal("100000"), Decimal("12"), 6)
+
+@pytest.mark.parametrize("annual_interest_rate", RATES)
+@pytest.mark.parametrize("term_months", TERMS)
+def test_summaries_match_iterative_walk(annual_interest_rate, term_months):
+    months = sorted({1, term_months // 3 or 1, term_months // 2 or 1, max(term_months - 1, 1), term_months})
+    for amount in AMOUNTS:
+        summaries = list(iter_loan_summaries(amount, annual_interest_rate, term_months, months))
+        expected_summaries = [iterative_summary(month, amount, annual_interest_rate, term_months) for month in months]
+        # the two formulas accumulate rounding noise differently, which can tip an exact half-cent tie
+        # (e.g. 1000 at 99.99% accrues 83.325 of interest in month 1) to the neighbouring cent
+        for summary, expected_summary in zip(summaries, expected_summaries):
+            for key, value in summary.items():
+                assert abs(value - expected_summary[key]) <= Decimal("0.01")
+
+def test_summaries_zero_interest_rate():
+    summaries = list(iter_loan_summaries(Decimal("1200"), Decimal("0"), 12, [3, 12]))
+
+    assert summaries == [
+        {"current principal balance": Decimal("900.00"), "principal already paid": Decimal("300.00"), "interest already paid": Decimal("0.00")},
+        {"current principal balance": Decimal("0.00"), "principal already paid": Decimal("1200.00"), "interest already paid": Decimal("0.00")},
+    ]
+
+def test_zero_interest_rate_final_month_has_no_negative_zero():
+    summary = next(iter_loan_summaries(Decimal("5000000"), Decimal("0"), 480, [480]))
+    final_row = list(iter_amortization_schedule(Decimal("5000000"), Decimal("0"), 480))[-1]
+
+    assert summary == {
+        "current principal balance": Decimal("0.00"), "principal already paid": Decimal("5000000.00"), "interest already paid": Decimal("0.00")}
+    assert [value.is_signed() for value in summary.values()] == [False, False, False]
+    assert not final_row["Remaining balance"].is_signed()
+
+def test_loan_summaries_for_months_preserves_request_order():
+    loan = Loan(amount=Decimal("100000"), annual_interest_rate=Decimal("12"), term_months=6)
+
+    summaries = loan_summaries_for_months([5, 1, 5], loan)
+
+    assert [summary["Month"] for summary in summaries] == [5, 1, 5]
+    assert summaries[0] == {"Month": 5, **iterative_summary(5, Decimal("100000"), Decimal("12"), 6)}
+
+def test_rounding_policy_applies_when_rounding_to_cents():
+    bankers = Amortization(Decimal("1000"), Decimal("5"), 12)
+    half_up = Amortization(Decimal("1000"), Decimal("5"), 12, rounding=ROUND_HALF_UP)
+
+    assert bankers.to_cents(Decimal("83.325")) == Decimal("83.32")
+    assert half_up.to_cents(Decimal("83.325")) == Decimal("83.33")
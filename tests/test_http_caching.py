@@ -0,0 +1,25 @@
+from decimal import Decimal
+
+from app.http_caching import loan_etag, matches_if_none_match
+from app.models import Loan
+
+def test_etag_depends_on_loan_terms_and_representation_only():
+    loan = Loan(id=1, amount=Decimal("1000.000000"), annual_interest_rate=Decimal("5.00000"), term_months=12)
+    same_terms = Loan(id=2, amount=Decimal("1E+3"), annual_interest_rate=Decimal("5"), term_months=12)
+    other_terms = Loan(id=1, amount=Decimal("1000.01"), annual_interest_rate=Decimal("5"), term_months=12)
+
+    assert loan_etag(loan, "summary", 3) == loan_etag(same_terms, "summary", 3)
+    assert loan_etag(loan, "summary", 3) != loan_etag(other_terms, "summary", 3)
+    assert loan_etag(loan, "summary", 3) != loan_etag(loan, "summary", 4)
+    assert loan_etag(loan, "summary", 3).startswith('"') and loan_etag(loan, "summary", 3).endswith('"')
+
+def test_if_none_match_comparison():
+    etag = '"abc"'
+
+    assert matches_if_none_match('"abc"', etag)
+    assert matches_if_none_match('W/"abc"', etag)
+    assert matches_if_none_match('"x", "abc"', etag)
+    assert matches_if_none_match("*", etag)
+    assert not matches_if_none_match('"abcd"', etag)
+    assert not matches_if_none_match(None, etag)
+    assert not matches_if_none_match("", etag)
@@ -0,0 +1,49 @@
+import json
+from decimal import Decimal
+
+from app.json_encoding import encode_columnar_schedule, encode_loans, encode_object, encode_objects, encode_schedule
+from app.schedule_cache import schedule_cache
+
+def test_encode_schedule_matches_json_dumps_of_float_rows():
+    schedule = schedule_cache.schedule(Decimal("250000"), Decimal("6.5"), 360)
+    expected = [{key: float(value) if isinstance(value, Decimal) else value for key, value in row.items()} for row in schedule]
+
+    assert json.loads(encode_schedule(schedule)) == expected
+
+def test_encode_schedule_keeps_decimals_exact():
+    rows = [{"Month": 1, "Remaining balance": Decimal("0.10"), "Monthly payment": Decimal("1234567890123.45")}]
+
+    assert encode_schedule(rows) == '[{"Month":1,"Remaining balance":0.10,"Monthly payment":1234567890123.45}]'
+    assert json.loads(encode_schedule(rows), parse_float=Decimal)[0]["Monthly payment"] == Decimal("1234567890123.45")
+
+def test_encode_columnar_schedule():
+    schedule = schedule_cache.schedule(Decimal("1000"), Decimal("12"), 3)
+
+    columns = json.loads(encode_columnar_schedule(schedule), parse_float=Decimal)
+
+    assert columns == {
+        "month": [1, 2, 3],
+        "balance": [row["Remaining balance"] for row in schedule],
+        "payment": [row["Monthly payment"] for row in schedule],
+    }
+
+def test_encode_columnar_schedule_is_smaller_than_rows():
+    schedule = schedule_cache.schedule(Decimal("250000"), Decimal("6.5"), 360)
+
+    assert len(encode_columnar_schedule(schedule)) < len(encode_schedule(schedule)) / 2
+
+def test_encode_columnar_schedule_of_empty_rows():
+    assert json.loads(encode_columnar_schedule([])) == {"month": [], "balance": [], "payment": []}
+
+def test_encode_objects_escapes_keys_and_strings():
+    objects = [{"loan_id": 1, "quote \"name\"": "a\nb", "paid": Decimal("1.50"), "flag": True, "missing": None}]
+
+    assert json.loads(encode_objects(objects)) == [{"loan_id": 1, "quote \"name\"": "a\nb", "paid": 1.5, "flag": True, "missing": None}]
+    assert encode_object({}) == "{}"
+    assert encode_objects([]) == "[]"
+
+def test_encode_loans_quotes_decimals_and_drops_trailing_columns():
+    loans = [(Decimal("1000.500000"), 3, 7)]
+
+    assert encode_loans(loans, ("amount", "term_months", "id")) == '[{"amount":"1000.500000","term_months":3,"id":7}]'
+    assert encode_loans(loans, ("amount", "term_months")) == '[{"amount":"1000.500000","term_months":3}]'
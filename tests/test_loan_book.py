@@ -0,0 +1,178 @@
+import io
+import json
+import tracemalloc
+from decimal import Decimal
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app import config
+from app.batch_calculations import batch_loan_summaries, cents_to_decimal
+from app.financial_calculations import iter_loan_summaries
+from app.loan_book import (
+    KINDS,
+    LoanBookError,
+    export_fields,
+    import_records,
+    iter_export,
+    iter_records,
+    read_checkpoint,
+    write_records,
+)
+from app.portfolios import check_portfolios
+from app.models import Loan, LoanCheckpoint, LoanScheduleRow, User, UserLoanLink
+
+@pytest.fixture(name="engine")
+def engine_fixture(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'book.db'}")
+    SQLModel.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture(name="session")
+def session_fixture(engine):
+    with Session(engine) as session:
+        yield session
+
+USERS_CSV = "id,email,first_name,last_name\n7,seven@null.null,Seven,User\n9,nine@null.null,Nine,User\n"
+LOANS_JSONL = "".join(
+    json.dumps({"id": loan_id, "amount": f"{1000 * loan_id}.500000", "annual_interest_rate": "6.25", "term_months": 12 * loan_id}) + "\n"
+    for loan_id in range(1, 6))
+SHARES_CSV = "user_id,loan_id\n7,1\n7,2\n9,2\n9,5\n"
+
+def import_book(session, **options):
+    return [
+        import_records(session, KINDS["users"], iter_records(io.StringIO(USERS_CSV), "csv"), **options),
+        import_records(session, KINDS["loans"], iter_records(io.StringIO(LOANS_JSONL), "jsonl"), **options),
+        import_records(session, KINDS["shares"], iter_records(io.StringIO(SHARES_CSV), "csv"), **options),
+    ]
+
+def export_book(engine, kind, format, summary_month=None):
+    stream = io.StringIO()
+    with engine.connect() as connection:
+        write_records(stream, format, export_fields(KINDS[kind], summary_month),
+                      iter_export(connection, KINDS[kind], summary_month, chunk_size=2))
+    return stream.getvalue()
+
+def test_import_keeps_ids_and_links(session: Session):
+    counts = import_book(session, chunk_size=2)
+
+    assert counts == [(2, 2), (5, 5), (4, 4)]
+    user = session.get(User, 9)
+    assert user.email == "nine@null.null"
+    assert sorted(loan.id for loan in user.loans) == [2, 5]
+    assert session.get(Loan, 3).amount == Decimal("3000.500000")
+
+def test_reimport_skips_rows_already_present(session: Session, monkeypatch):
+    monkeypatch.setattr(config, "PORTFOLIO_ROLLUPS", True)
+    import_book(session)
+
+    assert import_book(session, chunk_size=3) == [(2, 0), (5, 0), (4, 0)]
+    assert len(session.exec(select(UserLoanLink)).all()) == 4
+    # shares skipped as already present were not added to the portfolio rollups a second time
+    assert check_portfolios(session) == []
+
+def test_export_round_trips_through_both_formats(engine, session: Session, tmp_path):
+    import_book(session)
+    exported = {kind: export_book(engine, kind, format) for kind, format in (("users", "csv"), ("loans", "jsonl"), ("shares", "csv"))}
+    copy = create_engine(f"sqlite:///{tmp_path / 'copy.db'}")
+    SQLModel.metadata.create_all(copy)
+
+    with Session(copy) as copy_session:
+        for kind, format in (("users", "csv"), ("loans", "jsonl"), ("shares", "csv")):
+            import_records(copy_session, KINDS[kind], iter_records(io.StringIO(exported[kind]), format))
+
+    assert {kind: export_book(copy, kind, format) for kind, format in (("users", "csv"), ("loans", "jsonl"), ("shares", "csv"))} == exported
+    assert exported["loans"].splitlines()[0] == '{"id": 1, "amount": "1000.500000", "annual_interest_rate": "6.25000", "term_months": 12}'
+    copy.dispose()
+
+def test_export_with_month_summaries(engine, session: Session):
+    import_book(session)
+
+    rows = export_book(engine, "loans", "csv", summary_month=24).splitlines()
+
+    assert rows[0] == "id,amount,annual_interest_rate,term_months,month,current principal balance,principal already paid,interest already paid"
+    summaries = batch_loan_summaries([Decimal("2000.5")], [Decimal("6.25")], [24], 24)
+    assert rows[2] == "2,2000.500000,6.25000,24,24," + ",".join(str(cents_to_decimal(values[0])) for values in summaries.values())
+    # loan 1 has a 12-month term, so after month 24 it is paid off
+    assert rows[1].endswith(",0.00,1000.50," + str(cents_to_decimal(batch_loan_summaries([Decimal("1000.5")], [Decimal("6.25")], [12], 12)["interest already paid"][0])))
+
+def test_export_summarizes_modified_loans_from_their_checkpoints(engine, session: Session):
+    import_book(session)
+    checkpoints = ((6, Decimal("1000.00"), Decimal("3"), Decimal("60.00")),)
+    session.add(LoanCheckpoint(loan_id=2, month=6, balance=Decimal("1000.00"), annual_interest_rate=Decimal("3"), interest_paid=Decimal("60.00")))
+    session.commit()
+
+    rows = export_book(engine, "loans", "csv", summary_month=12).splitlines()
+
+    summary = next(iter_loan_summaries(Decimal("2000.5"), Decimal("6.25"), 24, [12], checkpoints=checkpoints))
+    assert rows[2] == "2,2000.500000,6.25000,24,12," + ",".join(str(value) for value in summary.values())
+
+def test_invalid_record_stops_the_import_and_the_checkpoint_resumes_it(session: Session, tmp_path):
+    checkpoint_path = tmp_path / "loans.checkpoint"
+    lines = LOANS_JSONL.splitlines(keepends=True)
+    broken = "".join(lines[:3]) + '{"id": 4, "amount": "lots", "annual_interest_rate": "6.25", "term_months": 48}\n' + lines[4]
+
+    with pytest.raises(LoanBookError, match="loans record 4: amount"):
+        import_records(session, KINDS["loans"], iter_records(io.StringIO(broken), "jsonl"), chunk_size=2,
+                       checkpoint_path=checkpoint_path)
+
+    assert read_checkpoint(checkpoint_path, KINDS["loans"]) == 2
+    assert [loan.id for loan in session.exec(select(Loan).order_by(Loan.id))] == [1, 2]
+    read, inserted = import_records(session, KINDS["loans"], iter_records(io.StringIO(LOANS_JSONL), "jsonl"), chunk_size=2,
+                                    checkpoint_path=checkpoint_path)
+    assert (read, inserted) == (3, 3)
+    assert not checkpoint_path.exists()
+    assert len(session.exec(select(Loan)).all()) == 5
+
+def test_loans_with_terms_that_cannot_be_amortized_are_refused(session: Session):
+    book = '{"id": 1, "amount": "1000", "annual_interest_rate": "5", "term_months": 0}\n'
+
+    with pytest.raises(LoanBookError, match="loans record 1: term_months"):
+        import_records(session, KINDS["loans"], iter_records(io.StringIO(book), "jsonl"))
+
+def test_checkpoint_of_another_kind_is_refused(session: Session, tmp_path):
+    checkpoint_path = tmp_path / "users.checkpoint"
+    checkpoint_path.write_text(json.dumps({"kind": "users", "records": 1}))
+
+    with pytest.raises(LoanBookError, match="checkpoint of a users import"):
+        import_records(session, KINDS["loans"], iter_records(io.StringIO(LOANS_JSONL), "jsonl"), checkpoint_path=checkpoint_path)
+
+def test_shares_of_unknown_loans_are_refused(session: Session):
+    import_records(session, KINDS["users"], iter_records(io.StringIO(USERS_CSV), "csv"))
+
+    with pytest.raises(LoanBookError, match=r"loans \[1, 2, 5\]"):
+        import_records(session, KINDS["shares"], iter_records(io.StringIO(SHARES_CSV), "csv"))
+
+def test_invalid_json_line_is_reported(session: Session):
+    with pytest.raises(LoanBookError, match="line 2: invalid JSON"):
+        import_records(session, KINDS["loans"], iter_records(io.StringIO(LOANS_JSONL.splitlines()[0] + "\n{oops\n"), "jsonl"))
+
+def test_imported_loans_are_materialized(session: Session, monkeypatch):
+    monkeypatch.setattr(config, "MATERIALIZE_SCHEDULES", True)
+
+    import_records(session, KINDS["loans"], iter_records(io.StringIO(LOANS_JSONL), "jsonl"), chunk_size=2)
+
+    assert len(session.exec(select(LoanScheduleRow)).all()) == sum(12 * loan_id for loan_id in range(1, 6))
+
+class NullStream:
+    def write(self, text):
+        return len(text)
+
+def test_export_memory_does_not_grow_with_the_book(engine, session: Session):
+    def exported_peak(loans):
+        session.execute(Loan.__table__.delete())
+        session.execute(Loan.__table__.insert(), [
+            {"id": n, "amount": Decimal("1000"), "annual_interest_rate": Decimal("5"), "term_months": 360} for n in range(1, loans + 1)])
+        session.commit()
+        tracemalloc.start()
+        with engine.connect() as connection:
+            write_records(NullStream(), "jsonl", export_fields(KINDS["loans"], 12),
+                          iter_export(connection, KINDS["loans"], 12, chunk_size=500))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    small, large = exported_peak(2000), exported_peak(20000)
+
+    assert large < small * 1.5
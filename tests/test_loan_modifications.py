@@ -0,0 +1,109 @@
+import pytest
+from decimal import Decimal
+
+from app.financial_calculations import ModifiedAmortization, iter_amortization_schedule, iter_loan_summaries
+from app.loan_modifications import checkpoint_month, rebuild_checkpoints, validate_event
+from app.models import LoanEventCreate
+from app.schedule_cache import ScheduleCache
+
+LOAN_TERMS = (Decimal("250000.000000"), Decimal("6.50000"), 360)
+
+def prepayment(month, amount):
+    return LoanEventCreate(kind="prepayment", month=month, amount=Decimal(amount))
+
+def rate_reset(month, annual_interest_rate):
+    return LoanEventCreate(kind="rate_reset", month=month, annual_interest_rate=Decimal(annual_interest_rate))
+
+def add_events(events, checkpoints=()):
+    # as app.loan_modifications.add_loan_event does: each event only recomputes from the month it takes effect
+    for index, event in enumerate(events):
+        checkpoints = rebuild_checkpoints(*LOAN_TERMS, checkpoints, events[:index + 1], checkpoint_month(event))
+    return checkpoints
+
+def test_loan_without_checkpoints_is_the_unmodified_loan():
+    calculation = ModifiedAmortization(*LOAN_TERMS, ())
+
+    assert list(calculation.iter_schedule()) == list(iter_amortization_schedule(*LOAN_TERMS))
+    months = [1, 100, 359, 360]
+    assert [calculation.summary(month) for month in months] == list(iter_loan_summaries(*LOAN_TERMS, months))
+
+def test_months_before_the_first_checkpoint_are_unchanged():
+    checkpoints = add_events([prepayment(60, 20000), rate_reset(120, "4.25")])
+
+    schedule = list(iter_amortization_schedule(*LOAN_TERMS, checkpoints=checkpoints))
+
+    assert schedule[:59] == list(iter_amortization_schedule(*LOAN_TERMS, to_month=59))
+    months = list(range(1, 60))
+    assert list(iter_loan_summaries(*LOAN_TERMS, months, checkpoints=checkpoints)) == list(iter_loan_summaries(*LOAN_TERMS, months))
+
+def test_prepayment_lowers_the_balance_and_the_payments_after_it():
+    checkpoints = add_events([prepayment(60, 20000)])
+    unmodified = ModifiedAmortization(*LOAN_TERMS, ())
+    modified = ModifiedAmortization(*LOAN_TERMS, checkpoints)
+
+    before, after = unmodified.summary(60), modified.summary(60)
+    assert after["current principal balance"] == before["current principal balance"] - 20000
+    assert after["principal already paid"] == before["principal already paid"] + 20000
+    assert after["interest already paid"] == before["interest already paid"]
+    schedule = list(modified.iter_schedule())
+    assert schedule[60]["Monthly payment"] < schedule[59]["Monthly payment"]
+    assert schedule[-1]["Remaining balance"] == Decimal("0.00")
+    assert modified.summary(360)["principal already paid"] == Decimal("250000.00")
+    assert modified.summary(360)["interest already paid"] < unmodified.summary(360)["interest already paid"]
+
+def test_rate_reset_changes_the_payment_from_its_month():
+    checkpoints = add_events([rate_reset(25, "8")])
+
+    schedule = list(iter_amortization_schedule(*LOAN_TERMS, checkpoints=checkpoints))
+
+    assert len({row["Monthly payment"] for row in schedule[:24]}) == 1
+    assert len({row["Monthly payment"] for row in schedule[24:]}) == 1
+    assert schedule[24]["Monthly payment"] > schedule[23]["Monthly payment"]
+    assert checkpoints[0][0] == 24 and checkpoints[0][2] == Decimal("8")
+
+def test_closed_form_summaries_match_the_schedule_walk():
+    checkpoints = add_events([prepayment(12, 5000), rate_reset(13, "7.125"), prepayment(200, "1234.56")])
+    calculation = ModifiedAmortization(*LOAN_TERMS, checkpoints)
+
+    walked = {month: summary for month, _, summary in calculation.iter_months()}
+    for month in (1, 11, 12, 13, 14, 199, 200, 201, 359, 360):
+        assert calculation.summary(month) == walked[month]
+
+def test_incremental_checkpoints_match_a_full_rebuild():
+    # events arrive out of month order, so later checkpoints are recomputed from earlier ones
+    events = [prepayment(200, 10000), rate_reset(100, "5"), prepayment(50, 1000), rate_reset(51, "9.5"), prepayment(200, 500)]
+
+    incremental = add_events(events)
+
+    assert incremental == rebuild_checkpoints(*LOAN_TERMS, (), events, 0)
+    assert [checkpoint[0] for checkpoint in incremental] == [50, 99, 200]
+
+def test_prepayment_larger_than_the_balance_is_rejected():
+    checkpoints = add_events([prepayment(300, 50000)])
+    balance = ModifiedAmortization(*LOAN_TERMS, checkpoints).summary(301)["current principal balance"]
+
+    with pytest.raises(ValueError, match="exceeds the remaining balance"):
+        add_events([prepayment(300, 50000), prepayment(200, 200000)])
+    paid_off = add_events([prepayment(300, 50000), prepayment(301, balance)])
+    schedule = list(iter_amortization_schedule(*LOAN_TERMS, checkpoints=paid_off))
+    assert {row["Remaining balance"] for row in schedule[300:]} == {Decimal("0.00")}
+
+def test_events_must_fall_within_the_term():
+    validate_event(rate_reset(360, "5"), 360)
+    with pytest.raises(ValueError):
+        validate_event(rate_reset(361, "5"), 360)
+    with pytest.raises(ValueError):
+        validate_event(prepayment(360, 100), 360)
+
+def test_cached_schedule_is_extended_from_its_unchanged_months():
+    cache = ScheduleCache(max_entries=10, max_bytes=10 * 1024 * 1024)
+    unmodified = cache.schedule(*LOAN_TERMS)
+    checkpoints = add_events([prepayment(120, 30000)])
+
+    cache.modify(*LOAN_TERMS, (), checkpoints, 120)
+    modified = cache.schedule(*LOAN_TERMS, checkpoints)
+
+    assert modified == list(iter_amortization_schedule(*LOAN_TERMS, checkpoints=checkpoints))
+    assert all(row is unmodified[index] for index, row in enumerate(modified[:119]))
+    assert cache.stats()["misses"] == 1
+    assert cache.summary(150, *LOAN_TERMS, checkpoints) == next(iter_loan_summaries(*LOAN_TERMS, [150], checkpoints=checkpoints))
@@ -1,29 +1,71 @@
+import json
+import threading
+import time
 import pytest
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.testclient import TestClient
 from sqlmodel import Session, SQLModel, create_engine, select
-from sqlmodel.pool import StaticPool
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy import event, text
+from sqlalchemy.pool import NullPool
 from decimal import Decimal
 
-from app.main import app, get_session
-from app.models import User, Loan, UserLoanLink
+from app import config
+from app import main as app_main
+from app.main import app, get_session, get_read_session, get_async_session, get_async_read_session, select_loans_for_user
+from app.metrics import metrics_registry
+from app.portfolios import check_portfolios
+from app.quotes import quote_cache_stats
+from app.models import User, Loan, LoanScheduleRow, UserLoanLink
+from app.schedule_cache import schedule_cache
+from app.compute_pool import compute_pool
+
+@pytest.fixture(name="database_path")
+def database_path_fixture(tmp_path):
+    # a file rather than an in-memory database, so the sync and async engines see the same data
+    return tmp_path / "test.db"
+
+def enable_foreign_keys(engine):
+    # as app.database's engines do; the write endpoints rely on the constraints
+    @event.listens_for(engine, "connect")
+    def set_foreign_keys(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys = ON")
+        cursor.close()
 
 @pytest.fixture(name="session")
-def session_fixture():
+def session_fixture(database_path):
     engine = create_engine(
-      "sqlite://",
-      connect_args={"check_same_thread": False}, 
-      poolclass=StaticPool
+      f"sqlite:///{database_path}",
+      connect_args={"check_same_thread": False}
     )
+    enable_foreign_keys(engine)
     SQLModel.metadata.create_all(engine)
     with Session(engine) as session:
         yield session
+    engine.dispose()
+
+@pytest.fixture(name="rollups")
+def rollups_fixture(monkeypatch):
+    monkeypatch.setattr(config, "PORTFOLIO_ROLLUPS", True)
 
 @pytest.fixture(name="client")
-def client_fixture(session: Session):
+def client_fixture(database_path, session: Session):
     def get_session_override():
         return session
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}", poolclass=NullPool)
+    enable_foreign_keys(async_engine.sync_engine)
+    async_session_maker = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def get_async_session_override():
+        async with async_session_maker() as async_session:
+            yield async_session
     
     app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_read_session] = get_session_override
+    app.dependency_overrides[get_async_session] = get_async_session_override
+    app.dependency_overrides[get_async_read_session] = get_async_session_override
 
     client = TestClient(app)
     yield client
@@ -59,6 +101,63 @@ def test_create_user_duplicate_email(client: TestClient):
     assert second_request_response.status_code == 400
     assert second_request_response.json().get('detail') == "Email already exists"
 
+# bulk ingestion tests
+def test_create_users_bulk(client: TestClient):
+    existing_user = {"email": "existing@null.null", "first_name": "Existing", "last_name": "User"}
+    client.post("/users/", json=existing_user)
+
+    response = client.post("/users/bulk?chunk_size=2", json=[
+        {"email": "bulk_userA@null.null", "first_name": "userA", "last_name": "LastnameA"},
+        existing_user,
+        {"email": "not-an-email", "first_name": "userB", "last_name": "LastnameB"},
+        {"email": "bulk_userC@null.null", "first_name": "userC", "last_name": "LastnameC"},
+        {"email": "bulk_userA@null.null", "first_name": "userA", "last_name": "Duplicate"},
+    ])
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["inserted"] == 2
+    assert data["failed"] == 3
+    assert [result["index"] for result in data["results"]] == [0, 1, 2, 3, 4]
+    assert data["results"][0]["id"] == 2
+    assert data["results"][1] == {"index": 1, "error": "Email already exists"}
+    assert data["results"][2]["error"].startswith("email: ")
+    assert data["results"][3]["id"] == 3
+    assert data["results"][4] == {"index": 4, "error": "Email already exists"}
+
+def test_create_loans_bulk_from_ndjson(session: Session, client: TestClient, rollups):
+    userB = User(email="test_userB@null.null", first_name="userB", last_name="lastnameB")
+    session.add(userB)
+    session.commit()
+    body = "\n".join([
+        json.dumps({"amount": 1000, "annual_interest_rate": 5, "term_months": 12, "user_id": userB.id}),
+        "{not json",
+        json.dumps({"amount": 2000, "annual_interest_rate": 6, "term_months": 24, "user_id": 999}),
+        json.dumps({"amount": 3000, "annual_interest_rate": 7, "term_months": 36, "user_id": userB.id}),
+        json.dumps({"amount": 4000, "annual_interest_rate": 8, "user_id": userB.id}),
+    ]) + "\n"
+
+    response = client.post("/loans/bulk?chunk_size=2", content=body, headers={"Content-Type": "application/x-ndjson"})
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["inserted"] == 2
+    assert data["failed"] == 3
+    assert data["results"][0] == {"index": 0, "id": 1}
+    assert data["results"][1]["error"].startswith("Invalid JSON")
+    assert data["results"][2] == {"index": 2, "error": "User not found"}
+    assert data["results"][3] == {"index": 3, "id": 2}
+    assert data["results"][4] == {"index": 4, "error": "term_months: Field required"}
+    links = session.exec(select(UserLoanLink).where(UserLoanLink.user_id == userB.id)).all()
+    assert sorted(link.loan_id for link in links) == [1, 2]
+    assert check_portfolios(session) == []
+
+def test_create_loans_bulk_rejects_non_array_body(client: TestClient):
+    response = client.post("/loans/bulk", json={"amount": 1000})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Request body must be a JSON array or NDJSON"
+
 # create_loan tests
 def test_create_loan(session: Session, client: TestClient): 
     userB = User(name="test_userB@null.null", first_name="userB", last_name="lastnameB")
@@ -105,6 +204,38 @@ def test_create_loan_user_does_not_exist(client: TestClient):
     assert response.status_code == 404
     assert response.json()["detail"] == "User not found"
 
+@pytest.mark.parametrize("terms", [
+    {"amount": 1000, "annual_interest_rate": 5, "term_months": 0},
+    {"amount": 1000, "annual_interest_rate": 5, "term_months": -3},
+    {"amount": 0, "annual_interest_rate": 5, "term_months": 12},
+    {"amount": 1000, "annual_interest_rate": -1, "term_months": 12},
+])
+def test_create_loan_rejects_terms_it_cannot_amortize(session: Session, client: TestClient, terms):
+    user = User(email="terms@null.null", first_name="Terms", last_name="User")
+    session.add(user)
+    session.commit()
+
+    response = client.post("/loans/", json={**terms, "user_id": user.id})
+
+    assert response.status_code == 422
+    assert session.exec(select(Loan)).all() == []
+
+def test_create_loans_bulk_reports_invalid_terms_per_item(session: Session, client: TestClient, rollups):
+    user = User(email="terms@null.null", first_name="Terms", last_name="User")
+    session.add(user)
+    session.commit()
+
+    data = client.post("/loans/bulk", json=[
+        {"amount": 1000, "annual_interest_rate": 5, "term_months": 12, "user_id": user.id},
+        {"amount": 1000, "annual_interest_rate": 5, "term_months": 0, "user_id": user.id},
+        {"amount": -5, "annual_interest_rate": 5, "term_months": 12, "user_id": user.id},
+    ]).json()
+
+    assert data["inserted"] == 1 and data["failed"] == 2
+    assert data["results"][1]["error"].startswith("term_months: ")
+    assert data["results"][2]["error"].startswith("amount: ")
+    assert check_portfolios(session) == []
+
 # loan_schedule tests
 def test_fetch_loan_schedule(session: Session, client: TestClient):
     test_loan = Loan(
@@ -152,6 +283,68 @@ def test_fetch_loan_schedule(session: Session, client: TestClient):
     assert response.status_code == 200
     assert data == expected_loan_schedule
 
+def test_fetch_loan_schedule_as_ndjson(session: Session, client: TestClient):
+    test_loan = Loan(
+        amount=Decimal(100000.000000), 
+        annual_interest_rate=Decimal(12.00000), 
+        term_months=6, user_id=1)
+    session.add(test_loan)
+    session.commit()
+
+    response = client.get(f"/loan/{test_loan.id}/schedule?format=ndjson")
+    lines = response.text.splitlines()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert "content-length" not in response.headers
+    assert len(lines) == 6
+    assert json.loads(lines[0]) == {"Month": 1, "Remaining balance": 83745.16, "Monthly payment": 17254.84}
+    assert json.loads(lines[5]) == {"Month": 6, "Remaining balance": 0, "Monthly payment": 17254.84}
+
+def test_fetch_loan_schedule_as_csv_via_accept_header(session: Session, client: TestClient):
+    test_loan = Loan(
+        amount=Decimal(100000.000000), 
+        annual_interest_rate=Decimal(12.00000), 
+        term_months=6, user_id=1)
+    session.add(test_loan)
+    session.commit()
+
+    response = client.get(f"/loan/{test_loan.id}/schedule", headers={"Accept": "text/csv"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.headers["content-disposition"] == f'attachment; filename="loan-{test_loan.id}-schedule.csv"'
+    assert response.text.splitlines() == [
+        "Month,Remaining balance,Monthly payment",
+        "1,83745.16,17254.84",
+        "2,67327.78,17254.84",
+        "3,50746.22,17254.84",
+        "4,33998.84,17254.84",
+        "5,17084.00,17254.84",
+        "6,0.00,17254.84",
+    ]
+
+def test_fetch_loan_schedule_as_columns(session: Session, client: TestClient):
+    test_loan = Loan(
+        amount=Decimal(100000.000000), 
+        annual_interest_rate=Decimal(12.00000), 
+        term_months=6, user_id=1)
+    session.add(test_loan)
+    session.commit()
+
+    response = client.get(f"/loan/{test_loan.id}/schedule?format=columnar")
+    window = client.get(f"/loan/{test_loan.id}/schedule?format=columnar&from_month=5")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == {
+        "month": [1, 2, 3, 4, 5, 6],
+        "balance": [83745.16, 67327.78, 50746.22, 33998.84, 17084, 0],
+        "payment": [17254.84] * 6,
+    }
+    assert response.headers["etag"] != client.get(f"/loan/{test_loan.id}/schedule").headers["etag"]
+    assert window.json() == {"month": [5, 6], "balance": [17084, 0], "payment": [17254.84] * 2}
+
 def test_fetch_loan_schedule_nonexistent_loan(client: TestClient):
     nonexistent_loan_id = 99
 
@@ -160,6 +353,36 @@ def test_fetch_loan_schedule_nonexistent_loan(client: TestClient):
     assert response.status_code == 404
     assert response.json()["detail"] == "Loan not found"
 
+def test_fetch_loan_schedule_window_links_to_the_next_window(session: Session, client: TestClient):
+    test_loan = Loan(amount=Decimal("100000"), annual_interest_rate=Decimal("6.5"), term_months=30)
+    session.add(test_loan)
+    session.commit()
+    full_schedule = client.get(f"/loan/{test_loan.id}/schedule").json()
+
+    response = client.get(f"/loan/{test_loan.id}/schedule?from_month=13&to_month=24")
+    last_response = client.get(f"/loan/{test_loan.id}/schedule?from_month=25&to_month=36&format=csv")
+
+    assert response.status_code == 200
+    assert response.json() == full_schedule[12:24]
+    assert response.headers["link"] == f'<http://testserver/loan/{test_loan.id}/schedule?from_month=25&to_month=36>; rel="next"'
+    assert last_response.status_code == 200
+    assert len(last_response.text.strip().splitlines()) == 1 + 6
+    assert "link" not in last_response.headers
+    assert "link" not in client.get(f"/loan/{test_loan.id}/schedule").headers
+
+def test_fetch_loan_schedule_window_validation(session: Session, client: TestClient):
+    test_loan = Loan(amount=Decimal("1000"), annual_interest_rate=Decimal("5"), term_months=12)
+    session.add(test_loan)
+    session.commit()
+
+    reversed_window = client.get(f"/loan/{test_loan.id}/schedule?from_month=6&to_month=5")
+    past_the_term = client.get(f"/loan/{test_loan.id}/schedule?from_month=13")
+
+    assert reversed_window.status_code == 400
+    assert reversed_window.json()["detail"] == "to_month must be greater than or equal to from_month"
+    assert past_the_term.status_code == 400
+    assert past_the_term.json()["detail"] == "from_month must be less than or equal to the loan term of 12 months"
+
 # loan_summary tests
 def test_fetch_loan_summary(session: Session, client: TestClient):
     test_loan = Loan(
@@ -203,6 +426,102 @@ def test_fetch_loan_summary_nonexistent_loan(client: TestClient):
     assert response.status_code == 404
     assert response.json()["detail"] == "Loan not found"
 
+# loan_summaries tests
+def test_fetch_loan_summaries(session: Session, client: TestClient):
+    test_loan = Loan(
+        amount=Decimal(100000.000000), 
+        annual_interest_rate=Decimal(12.00000), 
+        term_months=6, user_id=1)
+    session.add(test_loan)
+    session.commit()
+
+    response = client.get(f"/loan/{test_loan.id}/summaries?months=5&months=1")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data == [
+        {
+            "Month": 5,
+            "current principal balance": 17084,
+            "principal already paid": 82916,
+            "interest already paid": 3358.18
+        },
+        {
+            "Month": 1,
+            "current principal balance": 83745.16,
+            "principal already paid": 16254.84,
+            "interest already paid": 1000
+        }
+    ]
+
+def test_fetch_loan_summaries_month_out_of_range(session: Session, client: TestClient):
+    test_loan = Loan(
+        amount=Decimal(100000.000000), 
+        annual_interest_rate=Decimal(12.00000), 
+        term_months=6, user_id=1)
+    session.add(test_loan)
+    session.commit()
+
+    response = client.get(f"/loan/{test_loan.id}/summaries?months=1&months=7")
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == f"Months must be between 1 and the loan term of {test_loan.term_months} months"
+
+def test_fetch_loan_summaries_nonexistent_loan(client: TestClient):
+    nonexistent_loan_id = 99
+
+    response = client.get(f"/loan/{nonexistent_loan_id}/summaries?months=1")
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Loan not found"
+
+# batch loan summary tests
+def test_fetch_batch_loan_summary(session: Session, client: TestClient):
+    first_loan = Loan(amount=Decimal(100000), annual_interest_rate=Decimal(12), term_months=6)
+    second_loan = Loan(amount=Decimal(1200), annual_interest_rate=Decimal(0), term_months=12)
+    session.add(first_loan)
+    session.add(second_loan)
+    session.commit()
+
+    response = client.post("/loans/batch/summary", json={"loan_ids": [second_loan.id, first_loan.id], "month": 5})
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data == [
+        {
+            "loan_id": second_loan.id,
+            "current principal balance": 700,
+            "principal already paid": 500,
+            "interest already paid": 0
+        },
+        {
+            "loan_id": first_loan.id,
+            "current principal balance": 17084,
+            "principal already paid": 82916,
+            "interest already paid": 3358.18
+        }
+    ]
+
+def test_fetch_batch_loan_summary_nonexistent_loans(session: Session, client: TestClient):
+    test_loan = Loan(amount=Decimal(1000), annual_interest_rate=Decimal(5), term_months=12)
+    session.add(test_loan)
+    session.commit()
+
+    response = client.post("/loans/batch/summary", json={"loan_ids": [test_loan.id, 998, 999], "month": 1})
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Loans not found: [998, 999]"
+
+def test_fetch_batch_loan_summary_month_past_loan_term(session: Session, client: TestClient):
+    test_loan = Loan(amount=Decimal(1000), annual_interest_rate=Decimal(5), term_months=12)
+    session.add(test_loan)
+    session.commit()
+
+    response = client.post("/loans/batch/summary", json={"loan_ids": [test_loan.id], "month": 13})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Month must be less than or equal to the loan term of every loan in the batch"
+
 # fetch_loans_for_user tests
 def test_fetch_loans_for_user(session: Session, client: TestClient):
     # create user
@@ -248,6 +567,52 @@ def test_fetch_loans_for_user(session: Session, client: TestClient):
             "amount": "50000.000000"
         }
     ]
+    # the loans are encoded directly, in the field order and Decimal format response_model validation produced
+    assert response.text.startswith('[{"annual_interest_rate":"12.00000","term_months":6,"amount":"100000.000000","id":1},')
+
+def test_fetch_loans_for_user_paginated(session: Session, client: TestClient):
+    userB = User(email="test_userB@null.null", first_name="userB", last_name="lastnameB")
+    session.add(userB)
+    session.commit()
+    for amount in (1000, 2000, 3000):
+        client.post("/loans/", json={"amount": amount, "annual_interest_rate": 5, "term_months": 12, "user_id": userB.id})
+
+    first_page = client.get(f"/users/{userB.id}/loans?limit=2")
+    second_page = client.get(f"/users/{userB.id}/loans?limit=2&after={first_page.headers['x-next-cursor']}")
+
+    assert first_page.status_code == 200
+    assert [loan["id"] for loan in first_page.json()] == [1, 2]
+    assert first_page.headers["x-next-cursor"] == "2"
+    assert first_page.headers["link"] == f'<http://testserver/users/{userB.id}/loans?limit=2&after=2>; rel="next"'
+    assert second_page.status_code == 200
+    assert second_page.json() == [{"term_months": 12, "id": 3, "annual_interest_rate": "5.00000", "amount": "3000.000000"}]
+    assert "x-next-cursor" not in second_page.headers
+    assert client.get(f"/users/{userB.id}/loans?after=3").json() == []
+
+def test_fetch_loans_for_user_with_field_projection(session: Session, client: TestClient):
+    userB = User(email="test_userB@null.null", first_name="userB", last_name="lastnameB")
+    session.add(userB)
+    session.commit()
+    for amount in (1000, 2000):
+        client.post("/loans/", json={"amount": amount, "annual_interest_rate": 5, "term_months": 12, "user_id": userB.id})
+
+    ids_only = client.get(f"/users/{userB.id}/loans?fields=id")
+    amounts_only = client.get(f"/users/{userB.id}/loans?fields=amount&limit=1")
+    unknown_field = client.get(f"/users/{userB.id}/loans?fields=id,password")
+
+    assert ids_only.json() == [{"id": 1}, {"id": 2}]
+    assert amounts_only.json() == [{"amount": "1000.000000"}]
+    assert amounts_only.headers["x-next-cursor"] == "1"
+    assert unknown_field.status_code == 400
+
+def test_loans_for_user_page_is_an_index_range_scan(session: Session):
+    statement = select_loans_for_user(1, [Loan], after=10).limit(50)
+    compiled = statement.compile(session.get_bind(), compile_kwargs={"literal_binds": True})
+
+    plan = [row[-1] for row in session.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))]
+
+    assert any("userloanlink USING COVERING INDEX" in step and "loan_id>?" in step for step in plan)
+    assert not any("TEMP B-TREE" in step for step in plan)
 
 def test_fetch_loans_for_nonexistent_user(client: TestClient):
     non_existent_user_id = 999
@@ -271,6 +636,52 @@ def test_fetch_loans_for_user_with_no_loans(session: Session, client: TestClient
     assert response.status_code == 404
     assert response.json()["detail"] == f"No loans found for user with ID {userB.id}"
 
+def test_fetch_loan_summaries_for_user(session: Session, client: TestClient):
+    user = User(email="portal@null.null", first_name="Portal", last_name="User")
+    session.add(user)
+    session.commit()
+    for amount, rate, term_months in ((100000, 12, 6), (50000, 24, 36), (2500, 0, 48)):
+        client.post("/loans/", json={"amount": amount, "annual_interest_rate": rate, "term_months": term_months, "user_id": user.id})
+    metrics_registry.clear()
+
+    response = client.get(f"/users/{user.id}/loans/summary?month=12")
+
+    assert response.status_code == 200
+    loans = response.json()
+    assert [loan["id"] for loan in loans] == [1, 2, 3]
+    assert {key: loans[1][key] for key in ("amount", "annual_interest_rate", "term_months")} == {
+        "amount": "50000.000000", "annual_interest_rate": "24.00000", "term_months": 36}
+    # the 6-month loan reports its final month; the others match their per-loan summary
+    assert loans[0]["summary"] == {"Month": 6, **client.get("/loan/1/summary/6").json()}
+    assert loans[1]["summary"] == {"Month": 12, **client.get("/loan/2/summary/12").json()}
+    assert loans[2]["summary"] == {"Month": 12, **client.get("/loan/3/summary/12").json()}
+    samples = parse_metrics(client.get("/metrics").text)
+    assert samples['http_request_sql_statements_total{method="GET",route="/users/{user_id}/loans/summary"}'] == 1
+
+def test_fetch_loan_summaries_for_user_paginated(session: Session, client: TestClient):
+    user = User(email="portal@null.null", first_name="Portal", last_name="User")
+    session.add(user)
+    session.commit()
+    for amount in (1000, 2000, 3000):
+        client.post("/loans/", json={"amount": amount, "annual_interest_rate": 5, "term_months": 12, "user_id": user.id})
+
+    first_page = client.get(f"/users/{user.id}/loans/summary?month=3&limit=2")
+    second_page = client.get(f"/users/{user.id}/loans/summary?month=3&limit=2&after={first_page.headers['x-next-cursor']}")
+
+    assert [loan["id"] for loan in first_page.json()] == [1, 2]
+    assert [loan["id"] for loan in second_page.json()] == [3]
+    assert "x-next-cursor" not in second_page.headers
+
+def test_fetch_loan_summaries_for_user_errors(session: Session, client: TestClient):
+    user = User(email="portal@null.null", first_name="Portal", last_name="User")
+    session.add(user)
+    session.commit()
+
+    assert client.get("/users/999/loans/summary?month=1").json()["detail"] == "User not found"
+    assert client.get(f"/users/{user.id}/loans/summary?month=1").json()["detail"] == f"No loans found for user with ID {user.id}"
+    assert client.get(f"/users/{user.id}/loans/summary").status_code == 422
+    assert client.get(f"/users/{user.id}/loans/summary?month=0").status_code == 422
+
 # share_loan tests
 def test_share_loan(session: Session, client: TestClient):
     # create user
@@ -348,3 +759,441 @@ def test_share_loan_with_user_already_associated_with_loan(session: Session, cli
 
     assert response.status_code == 400
     assert response.json()["detail"] == "User is already associated with this loan"
+
+def test_write_endpoints_use_one_transaction_of_constrained_statements(session: Session, client: TestClient):
+    owner = User(email="owner@null.null", first_name="Owner", last_name="User")
+    other = User(email="other@null.null", first_name="Other", last_name="User")
+    session.add_all([owner, other])
+    session.commit()
+    loan_data = {"amount": 1000, "annual_interest_rate": 5, "term_months": 12, "user_id": owner.id}
+    metrics_registry.clear()
+
+    assert client.post("/users/", json={"email": "new@null.null", "first_name": "New", "last_name": "User"}).status_code == 200
+    assert client.post("/users/", json={"email": "new@null.null", "first_name": "New", "last_name": "User"}).status_code == 400
+    loan_id = client.post("/loans/", json=loan_data).json()["id"]
+    assert client.post(f"/loans/{loan_id}/share?target_user_id={other.id}").status_code == 200
+
+    samples = parse_metrics(client.get("/metrics").text)
+    # the constraints do the checking, so no existence lookups precede the inserts: one statement per user request
+    assert samples['http_request_sql_statements_total{method="POST",route="/users/"}'] == 2
+    assert samples['http_request_sql_statements_total{method="POST",route="/loans/"}'] == 2
+    assert samples['http_request_sql_statements_total{method="POST",route="/loans/{loan_id}/share"}'] == 1
+
+def test_loan_writes_update_portfolio_rollups_with_set_based_statements(session: Session, client: TestClient, rollups):
+    owner = User(email="owner@null.null", first_name="Owner", last_name="User")
+    other = User(email="other@null.null", first_name="Other", last_name="User")
+    session.add_all([owner, other])
+    session.commit()
+    loan_data = {"amount": 1000, "annual_interest_rate": 5, "term_months": 360, "user_id": owner.id}
+    metrics_registry.clear()
+
+    loan_id = client.post("/loans/", json=loan_data).json()["id"]
+    assert client.post(f"/loans/{loan_id}/share?target_user_id={other.id}").status_code == 200
+
+    samples = parse_metrics(client.get("/metrics").text)
+    # the contribution is computed before the write, whose rollup update is one statement for the months
+    # (however many) and one for the header; sharing first reads the loan's terms, and then checks under the
+    # write lock that the loan hasn't been modified since
+    assert samples['http_request_sql_statements_total{method="POST",route="/loans/"}'] == 2 + 2
+    assert samples['http_request_sql_statements_total{method="POST",route="/loans/{loan_id}/share"}'] == 1 + 1 + 1 + 2
+    assert check_portfolios(session) == []
+
+def test_create_loan_for_nonexistent_user_leaves_no_loan(session: Session, client: TestClient):
+    response = client.post("/loans/", json={"amount": 1000, "annual_interest_rate": 5, "term_months": 12, "user_id": 999})
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "User not found"
+    assert session.exec(select(Loan)).all() == []
+
+# loan modification tests
+def create_user_with_loan(session, client, email, amount=250000, annual_interest_rate=6.5, term_months=360):
+    user = User(email=email, first_name="Modified", last_name="User")
+    session.add(user)
+    session.commit()
+    loan_data = {"amount": amount, "annual_interest_rate": annual_interest_rate, "term_months": term_months, "user_id": user.id}
+    return user, client.post("/loans/", json=loan_data).json()["id"]
+
+def test_loan_events_recompute_only_the_schedule_after_them(session: Session, client: TestClient):
+    user, loan_id = create_user_with_loan(session, client, "prepayer@null.null")
+    before = client.get(f"/loan/{loan_id}/schedule")
+    summary_before = client.get(f"/loan/{loan_id}/summary/59")
+
+    response = client.post(f"/loans/{loan_id}/events", json={"kind": "prepayment", "month": 60, "amount": 20000})
+
+    assert response.status_code == 200
+    assert response.json() == {"kind": "prepayment", "month": 60, "amount": "20000", "annual_interest_rate": None,
+                               "id": response.json()["id"], "loan_id": loan_id}
+    # the test session is shared between requests, so the loan it holds is refreshed as a new request's would be
+    session.expire_all()
+    after = client.get(f"/loan/{loan_id}/schedule")
+    assert after.headers["etag"] != before.headers["etag"]
+    rows_before, rows_after = before.json(), after.json()
+    assert rows_after[:59] == rows_before[:59]
+    assert float(rows_after[59]["Remaining balance"]) == pytest.approx(float(rows_before[59]["Remaining balance"]) - 20000)
+    assert rows_after[60]["Monthly payment"] < rows_before[60]["Monthly payment"]
+    assert rows_after[-1]["Remaining balance"] == 0
+    summary_after = client.get(f"/loan/{loan_id}/summary/59")
+    assert summary_after.content == summary_before.content
+    assert summary_after.headers["etag"] != summary_before.headers["etag"]
+    assert client.get(f"/loan/{loan_id}/summaries?months=60&months=360").json()[1]["principal already paid"] == 250000
+    assert client.get(f"/loan/{loan_id}/schedule?from_month=58&to_month=62").json() == rows_after[57:62]
+    csv_lines = client.get(f"/loan/{loan_id}/schedule?format=csv").text.splitlines()
+    assert csv_lines[60].split(",")[1] == str(rows_after[59]["Remaining balance"])
+
+    client.post(f"/loans/{loan_id}/events", json={"kind": "rate_reset", "month": 121, "annual_interest_rate": 4.25})
+    events = client.get(f"/loans/{loan_id}/events").json()
+    assert [(event["kind"], event["month"]) for event in events] == [("prepayment", 60), ("rate_reset", 121)]
+    session.expire_all()
+    assert client.get(f"/loan/{loan_id}/schedule").json()[:120] == rows_after[:120]
+
+def test_modified_loans_are_summarized_in_batches_and_portfolios(session: Session, client: TestClient):
+    user, loan_id = create_user_with_loan(session, client, "portfolio@null.null")
+    client.post(f"/loans/{loan_id}/events", json={"kind": "rate_reset", "month": 13, "annual_interest_rate": 3})
+    session.expire_all()
+    expected = client.get(f"/loan/{loan_id}/summary/24").json()
+
+    batch = client.post("/loans/batch/summary", json={"loan_ids": [loan_id], "month": 24}).json()
+    portfolio = client.get(f"/users/{user.id}/loans/summary?month=24").json()
+
+    assert batch == [{"loan_id": loan_id, **expected}]
+    assert portfolio[0]["summary"] == {"Month": 24, **expected}
+
+def test_loan_event_validation(session: Session, client: TestClient):
+    user, loan_id = create_user_with_loan(session, client, "validation@null.null", amount=1000, term_months=12)
+
+    assert client.post("/loans/999/events", json={"kind": "prepayment", "month": 1, "amount": 1}).status_code == 404
+    assert client.post(f"/loans/{loan_id}/events", json={"kind": "prepayment", "month": 1}).status_code == 422
+    assert client.post(f"/loans/{loan_id}/events", json={"kind": "rate_reset", "month": 13, "annual_interest_rate": 5}).status_code == 400
+    final_month = client.post(f"/loans/{loan_id}/events", json={"kind": "prepayment", "month": 12, "amount": 1})
+    assert final_month.status_code == 400
+    too_large = client.post(f"/loans/{loan_id}/events", json={"kind": "prepayment", "month": 6, "amount": 600})
+    assert too_large.status_code == 400
+    assert "exceeds the remaining balance" in too_large.json()["detail"]
+    # a rejected event leaves the loan as it was
+    assert client.get(f"/loans/{loan_id}/events").json() == []
+    assert session.get(Loan, loan_id).modification_count == 0
+    assert client.get("/loans/999/events").status_code == 404
+
+def test_loan_events_rewrite_the_tail_of_materialized_schedules(session: Session, client: TestClient, monkeypatch):
+    monkeypatch.setattr(config, "MATERIALIZE_SCHEDULES", True)
+    user, loan_id = create_user_with_loan(session, client, "materialized-events@null.null")
+    rows_before = session.exec(select(LoanScheduleRow).where(LoanScheduleRow.loan_id == loan_id, LoanScheduleRow.month < 100)).all()
+    rows_before = [row.model_dump() for row in rows_before]
+
+    client.post(f"/loans/{loan_id}/events", json={"kind": "prepayment", "month": 100, "amount": 30000})
+
+    session.expire_all()
+    rows = session.exec(select(LoanScheduleRow).where(LoanScheduleRow.loan_id == loan_id).order_by(LoanScheduleRow.month)).all()
+    assert len(rows) == 360
+    assert [row.model_dump() for row in rows[:99]] == rows_before
+    materialized = client.get(f"/loan/{loan_id}/schedule")
+    monkeypatch.setattr(config, "MATERIALIZE_SCHEDULES", False)
+    assert materialized.content == client.get(f"/loan/{loan_id}/schedule").content
+
+# portfolio tests
+def summed_loan_summaries(client, loan_terms, month):
+    # loans whose term ends before the month count at their final month
+    summaries = [client.get(f"/loan/{loan_id}/summary/{min(month, term_months)}").json() for loan_id, term_months in loan_terms]
+    return {field: sum(Decimal(str(summary[field])) for summary in summaries)
+            for field in ("current principal balance", "principal already paid", "interest already paid")}
+
+@pytest.mark.parametrize("portfolio_rollups", [True, False])
+def test_portfolio_sums_the_summaries_of_the_users_loans(session: Session, client: TestClient, monkeypatch, portfolio_rollups):
+    monkeypatch.setattr(config, "PORTFOLIO_ROLLUPS", portfolio_rollups)
+    user, long_loan_id = create_user_with_loan(session, client, "portfolio@null.null")
+    other, short_loan_id = create_user_with_loan(session, client, "sharer@null.null", 12000, 5, 24)
+    assert client.post(f"/loans/{short_loan_id}/share?target_user_id={user.id}").status_code == 200
+    assert client.post(f"/loans/{long_loan_id}/events", json={"kind": "rate_reset", "month": 13, "annual_interest_rate": 4}).status_code == 200
+    session.expire_all()
+
+    for month in (1, 24, 25, 360, 400):
+        portfolio = client.get(f"/users/{user.id}/portfolio?month={month}").json()
+        expected = summed_loan_summaries(client, [(long_loan_id, 360), (short_loan_id, 24)], month)
+        assert {field: Decimal(str(portfolio[field])) for field in expected} == expected
+        assert portfolio["Month"] == month and portfolio["loans"] == 2
+    assert client.get(f"/users/{other.id}/portfolio?month=30").json()["current principal balance"] == 0
+    if portfolio_rollups:
+        assert check_portfolios(session) == []
+
+def test_portfolio_is_one_query_and_matches_the_computed_fallback(session: Session, client: TestClient, monkeypatch, rollups):
+    user, loan_id = create_user_with_loan(session, client, "rollup@null.null")
+    create_user_with_loan(session, client, "unrelated@null.null")
+    assert client.post("/loans/", json={"amount": 5000, "annual_interest_rate": 3, "term_months": 36, "user_id": user.id}).status_code == 200
+    metrics_registry.clear()
+
+    rolled_up = client.get(f"/users/{user.id}/portfolio?month=30").json()
+
+    samples = parse_metrics(client.get("/metrics").text)
+    assert samples['http_request_sql_statements_total{method="GET",route="/users/{user_id}/portfolio"}'] == 1
+    monkeypatch.setattr(config, "PORTFOLIO_ROLLUPS", False)
+    assert client.get(f"/users/{user.id}/portfolio?month=30").json() == rolled_up
+
+def test_portfolio_without_a_rollup_summarizes_the_loans(session: Session, client: TestClient, monkeypatch):
+    # loans created before PORTFOLIO_ROLLUPS was turned on have no rollup until rebuild-portfolios runs
+    user, loan_id = create_user_with_loan(session, client, "unrolled@null.null")
+    monkeypatch.setattr(config, "PORTFOLIO_ROLLUPS", True)
+
+    portfolio = client.get(f"/users/{user.id}/portfolio?month=30").json()
+
+    expected = summed_loan_summaries(client, [(loan_id, 360)], 30)
+    assert {field: Decimal(str(portfolio[field])) for field in expected} == expected
+    assert portfolio["loans"] == 1
+
+def test_portfolio_of_a_user_without_loans_is_empty(session: Session, client: TestClient):
+    user = User(email="empty@null.null", first_name="Empty", last_name="User")
+    session.add(user)
+    session.commit()
+
+    assert client.get(f"/users/{user.id}/portfolio?month=1").json() == {
+        "Month": 1, "loans": 0, "current principal balance": 0, "principal already paid": 0, "interest already paid": 0}
+    assert client.get("/users/999/portfolio?month=1").status_code == 404
+    assert client.get(f"/users/{user.id}/portfolio?month=0").status_code == 422
+
+# metrics tests
+def parse_metrics(text):
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+def test_metrics_record_latency_sql_and_calculation_time_per_route(session: Session, client: TestClient):
+    metrics_registry.clear()
+    schedule_cache.clear()
+    loan = Loan(amount=Decimal("100000"), annual_interest_rate=Decimal("5"), term_months=360)
+    session.add(loan)
+    session.commit()
+
+    client.get(f"/loan/{loan.id}/schedule")
+    client.get(f"/loan/{loan.id}/schedule?format=csv")
+    client.get("/loan/999/schedule")
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = parse_metrics(response.text)
+    route = 'method="GET",route="/loan/{loan_id}/schedule"'
+    assert samples[f"http_request_duration_seconds_count{{{route}}}"] == 3
+    assert samples[f'http_request_duration_seconds_bucket{{{route},le="+Inf"}}'] == 3
+    assert samples[f'http_requests_total{{{route},status="200"}}'] == 2
+    assert samples[f'http_requests_total{{{route},status="404"}}'] == 1
+    # the test session already holds the loan, so only the lookup of the missing loan reaches the database
+    assert samples[f"http_request_sql_statements_total{{{route}}}"] >= 1
+    assert samples[f"http_request_sql_seconds_total{{{route}}}"] > 0
+    assert samples[f"http_request_calculation_seconds_total{{{route}}}"] > 0
+
+def test_concurrent_identical_schedule_requests_are_coalesced(session: Session, client: TestClient, monkeypatch):
+    loan = Loan(amount=Decimal("100000"), annual_interest_rate=Decimal("5"), term_months=360)
+    session.add(loan)
+    session.commit()
+    # loaded now, so the concurrent requests find it in the shared test session without querying through it
+    session.refresh(loan)
+    schedule_flight = app_main.schedule_flight
+    before = schedule_flight.stats()
+    release = threading.Event()
+    computed_schedules = []
+    compute_schedule = schedule_cache.schedule
+
+    def blocking_schedule(*terms):
+        # hold the first computation open until the other requests have joined it
+        computed_schedules.append(terms)
+        release.wait(5)
+        return compute_schedule(*terms)
+
+    monkeypatch.setattr(schedule_cache, "schedule", blocking_schedule)
+    # anyio imports its backend lazily on the first request, which is not safe to do from several threads at once
+    client.get("/metrics")
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(client.get, f"/loan/{loan.id}/schedule") for _ in range(4)]
+        while schedule_flight.stats()["coalesced"] - before["coalesced"] < 3 and not any(future.done() for future in futures):
+            time.sleep(0.001)
+        release.set()
+        responses = [future.result() for future in futures]
+
+    assert len(computed_schedules) == 1
+    assert all(response.status_code == 200 and response.text == responses[0].text for response in responses)
+    assert schedule_flight.stats()["in_flight"] == 0
+    samples = parse_metrics(client.get("/metrics").text)
+    assert samples['single_flight_coalesced_total{flight="schedule"}'] - before["coalesced"] == 3
+
+def test_metrics_label_unmatched_paths_together(client: TestClient):
+    metrics_registry.clear()
+
+    client.get("/no/such/path")
+    client.get("/another/missing/path")
+
+    samples = parse_metrics(client.get("/metrics").text)
+    assert samples['http_requests_total{method="GET",route="unmatched",status="404"}'] == 2
+
+def test_slow_queries_are_logged_above_the_threshold(session: Session, client: TestClient, monkeypatch, caplog):
+    metrics_registry.clear()
+    monkeypatch.setattr(config, "SLOW_QUERY_THRESHOLD_MS", 0)
+
+    with caplog.at_level("WARNING", logger="app.slow_queries"):
+        client.get("/loan/999/summary/1")
+
+    assert any("Slow query" in record.getMessage() and "FROM loan" in record.getMessage() for record in caplog.records)
+    assert parse_metrics(client.get("/metrics").text)["sql_slow_queries_total"] >= 1
+
+# materialized schedule tests
+def test_materialized_schedules_are_written_on_creation_and_served_identically(session: Session, client: TestClient, monkeypatch):
+    user = User(email="materialized@null.null", first_name="Materialized", last_name="User")
+    session.add(user)
+    session.commit()
+    monkeypatch.setattr(config, "MATERIALIZE_SCHEDULES", True)
+    loan_id = client.post("/loans/", json={"amount": 250000, "annual_interest_rate": 6.5, "term_months": 360, "user_id": user.id}).json()["id"]
+    bulk_ids = [result["id"] for result in client.post("/loans/bulk", json=[
+        {"amount": 1000, "annual_interest_rate": 3, "term_months": 12, "user_id": user.id}]).json()["results"]]
+
+    rows = session.exec(select(LoanScheduleRow).where(LoanScheduleRow.loan_id.in_([loan_id, *bulk_ids]))).all()
+    assert len(rows) == 360 + 12
+    requests = [
+        f"/loan/{loan_id}/schedule", f"/loan/{loan_id}/schedule?format=csv", f"/loan/{bulk_ids[0]}/schedule",
+        f"/loan/{loan_id}/summary/1", f"/loan/{loan_id}/summary/360", f"/loan/{loan_id}/summaries?months=12&months=120",
+        f"/loan/{loan_id}/summary/361", f"/loan/{loan_id}/summaries?months=0", "/loan/999/schedule", "/loan/999/summary/1",
+        f"/loan/{loan_id}/schedule?from_month=349&to_month=360", f"/loan/{loan_id}/schedule?from_month=337&to_month=348",
+        f"/loan/{loan_id}/schedule?from_month=355&format=ndjson", f"/loan/{loan_id}/schedule?from_month=361&to_month=372",
+    ]
+    materialized = [client.get(url) for url in requests]
+    monkeypatch.setattr(config, "MATERIALIZE_SCHEDULES", False)
+    computed = [client.get(url) for url in requests]
+
+    for url, materialized_response, computed_response in zip(requests, materialized, computed):
+        assert materialized_response.status_code == computed_response.status_code, url
+        assert materialized_response.content == computed_response.content, url
+        assert materialized_response.headers.get("link") == computed_response.headers.get("link"), url
+
+# conditional request tests
+def test_schedule_and_summaries_carry_etags_and_cache_control(session: Session, client: TestClient, monkeypatch):
+    monkeypatch.setattr(config, "CACHE_CONTROL_SUMMARY", "public, max-age=600")
+    test_loan = Loan(amount=Decimal("100000"), annual_interest_rate=Decimal("6.5"), term_months=24)
+    session.add(test_loan)
+    session.commit()
+
+    responses = {
+        url: client.get(url) for url in [
+            f"/loan/{test_loan.id}/schedule", f"/loan/{test_loan.id}/schedule?format=csv",
+            f"/loan/{test_loan.id}/schedule?from_month=1&to_month=12", f"/loan/{test_loan.id}/summary/6",
+            f"/loan/{test_loan.id}/summary/7", f"/loan/{test_loan.id}/summaries?months=6&months=7",
+        ]
+    }
+
+    etags = [response.headers["etag"] for response in responses.values()]
+    assert len(set(etags)) == len(etags)
+    assert client.get(f"/loan/{test_loan.id}/schedule").headers["etag"] == etags[0]
+    assert responses[f"/loan/{test_loan.id}/schedule"].headers["cache-control"] == "public, no-cache"
+    assert responses[f"/loan/{test_loan.id}/schedule"].headers["vary"] == "Accept"
+    assert responses[f"/loan/{test_loan.id}/summary/6"].headers["cache-control"] == "public, max-age=600"
+
+def test_matching_if_none_match_returns_304_without_computing(session: Session, client: TestClient, monkeypatch):
+    test_loan = Loan(amount=Decimal("100000"), annual_interest_rate=Decimal("6.5"), term_months=24)
+    session.add(test_loan)
+    session.commit()
+    urls = [f"/loan/{test_loan.id}/schedule?from_month=1&to_month=12", f"/loan/{test_loan.id}/summary/6",
+            f"/loan/{test_loan.id}/summaries?months=6"]
+    etags = [client.get(url).headers["etag"] for url in urls]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("a 304 must not compute the schedule")
+    for method in ("schedule", "window", "iter_schedule", "summary", "summaries"):
+        monkeypatch.setattr(schedule_cache, method, fail)
+
+    for url, etag in zip(urls, etags):
+        for if_none_match in (etag, f"W/{etag}", f'"something-else", {etag}', "*"):
+            response = client.get(url, headers={"If-None-Match": if_none_match})
+            assert response.status_code == 304
+            assert response.content == b""
+            assert response.headers["etag"] == etag
+    schedule_response = client.get(urls[0], headers={"If-None-Match": etags[0]})
+    assert schedule_response.headers["link"].endswith('from_month=13&to_month=24>; rel="next"')
+
+def test_etag_changes_with_the_calculation_engine(session: Session, client: TestClient, monkeypatch):
+    test_loan = Loan(amount=Decimal("100000"), annual_interest_rate=Decimal("6.5"), term_months=24)
+    session.add(test_loan)
+    session.commit()
+    etag = client.get(f"/loan/{test_loan.id}/summary/6").headers["etag"]
+
+    monkeypatch.setattr(config, "ROUNDING_POLICY", "half_up")
+    response = client.get(f"/loan/{test_loan.id}/summary/6", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+# quote tests
+def test_quotes_match_the_loan_endpoints(session: Session, client: TestClient):
+    terms = [(Decimal("250000"), Decimal("6.5"), 360), (Decimal("1000"), Decimal("0"), 12), (Decimal("5000"), Decimal("99.99"), 6)]
+    loans = [Loan(amount=amount, annual_interest_rate=rate, term_months=term_months) for amount, rate, term_months in terms]
+    session.add_all(loans)
+    session.commit()
+    quotes = [{"amount": str(amount), "annual_interest_rate": str(rate), "term_months": term_months} for amount, rate, term_months in terms]
+
+    schedules = client.post("/quotes/schedule", json={"quotes": quotes})
+    summaries = client.post("/quotes/summary", json={"quotes": [{**quote, "month": 6} for quote in quotes]})
+
+    assert schedules.status_code == 200
+    assert schedules.json() == [client.get(f"/loan/{loan.id}/schedule").json() for loan in loans]
+    assert summaries.status_code == 200
+    assert summaries.json() == [client.get(f"/loan/{loan.id}/summary/6").json() for loan in loans]
+
+def test_quote_endpoints_do_not_depend_on_the_database():
+    quote_routes = [route for route in app.routes if getattr(route, "path", "").startswith("/quotes/")]
+
+    assert len(quote_routes) == 2
+    assert all(not route.dependant.dependencies for route in quote_routes)
+
+def test_quote_summaries_are_memoized_on_normalized_terms(client: TestClient):
+    before = quote_cache_stats()
+
+    client.post("/quotes/summary", json={"quotes": [
+        {"amount": "31337", "annual_interest_rate": "4.25", "term_months": 48, "month": 7},
+        {"amount": "31337.00", "annual_interest_rate": "4.250", "term_months": 48, "month": 7},
+    ]})
+
+    after = quote_cache_stats()
+    assert after["misses"] - before["misses"] == 1
+    assert after["hits"] - before["hits"] == 1
+
+def test_quote_validation(client: TestClient):
+    month_past_term = client.post("/quotes/summary", json={"quotes": [{"amount": 1000, "annual_interest_rate": 5, "term_months": 12, "month": 13}]})
+    empty_batch = client.post("/quotes/schedule", json={"quotes": []})
+    negative_amount = client.post("/quotes/schedule", json={"quotes": [{"amount": -1, "annual_interest_rate": 5, "term_months": 12}]})
+
+    assert month_past_term.status_code == 422
+    assert "month must be less than or equal to the loan term of 12 months" in month_past_term.text
+    assert empty_batch.status_code == 422
+    assert negative_amount.status_code == 422
+
+def test_large_quote_batches_are_computed_by_the_compute_pool(monkeypatch, client: TestClient):
+    schedule_cache.clear()
+    quotes = [{"amount": 1000 + n, "annual_interest_rate": 5, "term_months": 360} for n in range(6)]
+    inline = client.post("/quotes/schedule", json={"quotes": quotes}).json()
+    schedule_cache.clear()
+    monkeypatch.setattr(compute_pool, "workers", 1)
+    monkeypatch.setattr(compute_pool, "offload_threshold", 360)
+    monkeypatch.setattr(compute_pool, "chunk_size", 4)
+    before = compute_pool.stats()["offloaded_tasks"]
+    try:
+        offloaded = client.post("/quotes/schedule", json={"quotes": quotes})
+    finally:
+        compute_pool.shutdown()
+
+    assert offloaded.status_code == 200
+    assert offloaded.json() == inline
+    assert compute_pool.stats()["offloaded_tasks"] - before == 2
+
+def test_full_compute_pool_answers_503_with_retry_after(monkeypatch, session: Session, client: TestClient):
+    loan = Loan(amount=Decimal(250000), annual_interest_rate=Decimal(6.5), term_months=360)
+    session.add(loan)
+    session.commit()
+    schedule_cache.clear()
+    monkeypatch.setattr(compute_pool, "workers", 1)
+    monkeypatch.setattr(compute_pool, "offload_threshold", 360)
+    monkeypatch.setattr(compute_pool, "max_pending_tasks", 0)
+
+    refused = client.get(f"/loan/{loan.id}/schedule")
+    cheap = client.get(f"/loan/{loan.id}/summary/12")
+
+    assert refused.status_code == 503
+    assert refused.headers["retry-after"] == str(config.COMPUTE_RETRY_AFTER_SECONDS)
+    assert cheap.status_code == 200
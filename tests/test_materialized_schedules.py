@@ -0,0 +1,86 @@
+from decimal import Decimal
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app.financial_calculations import amortization, amortization_schedule, iter_amortization_schedule, iter_loan_summaries
+from app.materialized_schedules import (
+    backfill_schedules,
+    fetch_materialized_schedule,
+    fetch_materialized_summaries,
+    materialize_loans,
+    total_outstanding_balance,
+)
+from app.models import Loan, LoanCheckpoint, LoanScheduleRow
+
+@pytest.fixture(name="session")
+def session_fixture(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'materialized.db'}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+def add_loans(session, *terms):
+    loans = [Loan(amount=amount, annual_interest_rate=rate, term_months=term_months) for amount, rate, term_months in terms]
+    session.add_all(loans)
+    session.commit()
+    return loans
+
+@pytest.mark.parametrize("rate", [Decimal("0"), Decimal("5.375"), Decimal("99.99")])
+def test_materialized_rows_match_the_computed_schedule_and_summaries(session: Session, rate):
+    loan, = add_loans(session, (Decimal("250000"), rate, 360))
+    materialize_loans(session, [loan])
+    session.commit()
+
+    assert fetch_materialized_schedule(session, loan.id) == amortization_schedule(loan)
+    calculation = amortization(loan.amount, loan.annual_interest_rate, loan.term_months)
+    balances = list(calculation.balances())
+    months = [1, 59, 180, 360]
+    assert fetch_materialized_summaries(session, loan.id, months) == [
+        calculation.summary(month, balances[month - 1]) for month in months]
+
+def test_missing_rows_are_reported_as_none(session: Session):
+    loan, = add_loans(session, (Decimal("1000"), Decimal("5"), 12))
+
+    assert fetch_materialized_schedule(session, loan.id) is None
+    materialize_loans(session, [loan])
+    session.commit()
+    assert fetch_materialized_summaries(session, loan.id, [12, 13]) is None
+
+def test_backfill_materializes_only_loans_without_rows_and_can_rebuild(session: Session):
+    loans = add_loans(session, *[(Decimal(1000 * n), Decimal("6"), 12 * n) for n in range(1, 6)])
+    materialize_loans(session, loans[:2])
+    session.commit()
+    batches = []
+
+    assert backfill_schedules(session, batch_size=2, progress=batches.append) == 3
+    assert batches == [2, 3]
+    assert len(session.exec(select(LoanScheduleRow)).all()) == sum(loan.term_months for loan in loans)
+    assert backfill_schedules(session) == 0
+    assert backfill_schedules(session, rebuild=True) == 5
+
+def test_total_outstanding_balance_is_summed_in_sql(session: Session):
+    loans = add_loans(session, (Decimal("10000"), Decimal("5"), 12), (Decimal("20000"), Decimal("7"), 24))
+    materialize_loans(session, loans)
+    session.commit()
+
+    expected = sum(fetch_materialized_summaries(session, loan.id, [6])[0]["current principal balance"] for loan in loans)
+    assert total_outstanding_balance(session, 6) == expected
+    # the 12-month loan is paid off by month 18
+    assert total_outstanding_balance(session, 18) == fetch_materialized_summaries(session, loans[1].id, [18])[0]["current principal balance"]
+    assert total_outstanding_balance(session, 25) == Decimal("0.00")
+
+def test_backfill_materializes_modified_loans_from_their_checkpoints(session: Session):
+    loan, = add_loans(session, (Decimal("10000"), Decimal("5"), 24))
+    checkpoints = ((12, Decimal("4000.00"), Decimal("7"), Decimal("300.00")),)
+    session.add(LoanCheckpoint(loan_id=loan.id, month=12, balance=Decimal("4000.00"), annual_interest_rate=Decimal("7"),
+                               interest_paid=Decimal("300.00")))
+    loan.modification_count = 1
+    session.commit()
+
+    assert backfill_schedules(session) == 1
+    assert fetch_materialized_schedule(session, loan.id) == list(iter_amortization_schedule(
+        loan.amount, loan.annual_interest_rate, loan.term_months, checkpoints=checkpoints))
+    assert fetch_materialized_summaries(session, loan.id, [12, 13]) == list(iter_loan_summaries(
+        loan.amount, loan.annual_interest_rate, loan.term_months, [12, 13], checkpoints=checkpoints))
@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app.metrics import LATENCY_BUCKETS, MetricsRegistry, RequestStats, _current_request, timed_calculation
+
+def test_nested_calculations_are_counted_once():
+    stats = RequestStats()
+    token = _current_request.set(stats)
+    try:
+        @timed_calculation
+        def inner():
+            return 1
+
+        @timed_calculation
+        def outer():
+            return inner() + 1
+
+        assert outer() == 2
+    finally:
+        _current_request.reset(token)
+
+    assert stats.calculation_seconds > 0
+    assert stats._calculation_depth == 0
+
+def test_generators_are_timed_per_step_and_outside_a_request():
+    @timed_calculation
+    def months(n):
+        yield from range(1, n + 1)
+
+    assert list(months(3)) == [1, 2, 3]
+
+    stats = RequestStats()
+    token = _current_request.set(stats)
+    try:
+        assert list(months(3)) == [1, 2, 3]
+    finally:
+        _current_request.reset(token)
+    assert stats.calculation_seconds > 0
+    assert stats._calculation_depth == 0
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    stats = RequestStats()
+    stats.sql_statements = 2
+    registry.observe("GET", "/loan/{loan_id}/schedule", 200, 0.003, stats)
+    registry.observe("GET", "/loan/{loan_id}/schedule", 200, 20.0, stats)
+
+    lines = registry.render().splitlines()
+    labels = 'method="GET",route="/loan/{loan_id}/schedule"'
+    assert f'http_request_duration_seconds_bucket{{{labels},le="0.001"}} 0' in lines
+    assert f'http_request_duration_seconds_bucket{{{labels},le="0.005"}} 1' in lines
+    assert f'http_request_duration_seconds_bucket{{{labels},le="{LATENCY_BUCKETS[-1]}"}} 1' in lines
+    assert f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2' in lines
+    assert f"http_request_duration_seconds_count{{{labels}}} 2" in lines
+    assert f"http_request_sql_statements_total{{{labels}}} 4" in lines
+
+def test_slow_queries_recorded_from_many_threads_are_all_counted():
+    registry = MetricsRegistry()
+
+    def record(count):
+        for _ in range(count):
+            registry.record_slow_query()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(record, [20000] * 8))
+
+    assert registry.slow_queries == 160000
+    assert "sql_slow_queries_total 160000" in registry.render()
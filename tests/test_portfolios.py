@@ -0,0 +1,126 @@
+from decimal import Decimal
+
+import numpy as np
+import pytest
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app.loan_modifications import checkpoint_month, rebuild_checkpoints
+from app.models import Loan, LoanCheckpoint, LoanEventCreate, PortfolioMonth, User, UserLoanLink
+from app.portfolios import add_links, check_portfolios, expected_portfolios, loan_contribution, modify_loan, rebuild_portfolios
+
+@pytest.fixture(name="session")
+def session_fixture(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'portfolios.db'}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+def add_users(session, count):
+    users = [User(email=f"user{n}@null.null", first_name="Portfolio", last_name="User") for n in range(count)]
+    session.add_all(users)
+    session.commit()
+    return [user.id for user in users]
+
+def add_loans(session, *terms):
+    loans = [Loan(amount=Decimal(amount), annual_interest_rate=Decimal(rate), term_months=term_months) for amount, rate, term_months in terms]
+    session.add_all(loans)
+    session.commit()
+    return loans
+
+def link(session, links, loans=None):
+    session.add_all([UserLoanLink(user_id=user_id, loan_id=loan_id) for user_id, loan_id in links])
+    session.flush()
+    add_links(session, links, loans)
+    session.commit()
+
+def stored_month(session, user_id, month):
+    row = session.get(PortfolioMonth, (user_id, month))
+    return [row.balance_cents, row.cumulative_principal_cents, row.cumulative_interest_cents]
+
+def test_incremental_rollups_match_a_rebuild_whatever_the_order_of_terms(session: Session):
+    first, second = add_users(session, 2)
+    short, long, medium = add_loans(session, ("12000", "5", 12), ("250000", "6.5", 360), ("40000", "0", 60))
+
+    link(session, [(first, short.id)], [short])
+    link(session, [(first, long.id), (second, medium.id)])
+    link(session, [(first, medium.id), (second, short.id)])
+
+    assert check_portfolios(session) == []
+    contributions = {loan.id: loan_contribution(loan) for loan in (short, long, medium)}
+    # after their terms the short loans count as paid off
+    assert stored_month(session, first, 200) == (
+        contributions[short.id][-1] + contributions[long.id][199] + contributions[medium.id][-1]).tolist()
+    assert stored_month(session, second, 30) == (contributions[short.id][-1] + contributions[medium.id][29]).tolist()
+    assert stored_month(session, second, 60)[0] == 0
+
+def test_loan_modification_updates_every_linked_users_rollup(session: Session):
+    first, second = add_users(session, 2)
+    loan, other = add_loans(session, ("250000", "6.5", 360), ("10000", "4", 24))
+    link(session, [(first, loan.id), (first, other.id), (second, loan.id)])
+    event = LoanEventCreate(kind="prepayment", month=60, amount=Decimal("20000"))
+    checkpoints = rebuild_checkpoints(loan.amount, loan.annual_interest_rate, loan.term_months, (), [event], checkpoint_month(event))
+    session.add_all([
+        LoanCheckpoint(loan_id=loan.id, month=month, balance=balance, annual_interest_rate=rate, interest_paid=interest_paid)
+        for month, balance, rate, interest_paid in checkpoints
+    ])
+    loan.modification_count = 1
+    session.commit()
+
+    modify_loan(session, loan, (), checkpoints, 60)
+    session.commit()
+
+    assert check_portfolios(session) == []
+    assert stored_month(session, second, 60) == loan_contribution(loan, checkpoints)[59].tolist()
+    assert stored_month(session, second, 59) == loan_contribution(loan)[58].tolist()
+
+def test_check_finds_drifted_rollups_and_rebuild_repairs_them(session: Session):
+    user_ids = add_users(session, 5)
+    loans = add_loans(session, *[(1000 * n, "6", 12 * n) for n in range(1, 6)])
+    session.add_all([UserLoanLink(user_id=user_id, loan_id=loan.id) for user_id, loan in zip(user_ids, loans)])
+    session.commit()
+    batches = []
+
+    assert check_portfolios(session) == user_ids
+    assert rebuild_portfolios(session, batch_size=2, progress=batches.append) == 5
+    assert batches == [2, 4, 5]
+    assert check_portfolios(session) == []
+    drifted = session.get(PortfolioMonth, (user_ids[3], 7))
+    drifted.balance_cents += 1
+    session.commit()
+    assert check_portfolios(session, batch_size=2) == [user_ids[3]]
+
+def test_expected_portfolios_sum_each_users_loans(session: Session):
+    user_id, loanless_user_id = add_users(session, 2)
+    loans = add_loans(session, ("1000", "5", 12), ("2000", "7", 24))
+    session.add_all([UserLoanLink(user_id=user_id, loan_id=loan.id) for loan in loans])
+    session.commit()
+
+    expected = expected_portfolios(session, [user_id, loanless_user_id])
+
+    assert list(expected) == [user_id]
+    loan_count, values = expected[user_id]
+    assert loan_count == 2 and len(values) == 24
+    assert values[-1].tolist() == [0, 300000, int(np.sum([loan_contribution(loan)[-1][2] for loan in loans]))]
+    assert session.exec(select(PortfolioMonth)).all() == []
+
+def test_contributions_of_loans_modified_since_they_were_computed_are_recomputed(session: Session):
+    user_id, = add_users(session, 1)
+    loan, = add_loans(session, ("100000", "6", 120))
+    computed_from = session.exec(select(Loan.id, Loan.amount, Loan.annual_interest_rate, Loan.term_months, Loan.modification_count)).all()
+    contributions = {loan.id: loan_contribution(loan)}
+    event = LoanEventCreate(kind="prepayment", month=12, amount=Decimal("5000"))
+    checkpoints = rebuild_checkpoints(loan.amount, loan.annual_interest_rate, loan.term_months, (), [event], checkpoint_month(event))
+    session.add_all([
+        LoanCheckpoint(loan_id=loan.id, month=month, balance=balance, annual_interest_rate=rate, interest_paid=interest_paid)
+        for month, balance, rate, interest_paid in checkpoints
+    ])
+    loan.modification_count = 1
+    session.commit()
+
+    session.add(UserLoanLink(user_id=user_id, loan_id=loan.id))
+    session.flush()
+    add_links(session, [(user_id, loan.id)], computed_from, contributions)
+    session.commit()
+
+    assert check_portfolios(session) == []
@@ -0,0 +1,9 @@
+import pytest
+from decimal import ROUND_HALF_UP
+
+from app.rounding import rounding_for_policy
+
+def test_unknown_rounding_policy():
+    assert rounding_for_policy("half_up") == ROUND_HALF_UP
+    with pytest.raises(ValueError):
+        rounding_for_policy("ceiling")
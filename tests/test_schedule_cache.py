@@ -0,0 +1,109 @@
+from decimal import Decimal
+
+from app.financial_calculations import iter_amortization_schedule, iter_loan_summaries
+from app.schedule_cache import ScheduleCache
+
+LOAN_TERMS = (Decimal("100000"), Decimal("12"), 6)
+
+def test_schedule_is_computed_once_and_then_served_from_cache():
+    cache = ScheduleCache(max_entries=10, max_bytes=10 * 1024 * 1024)
+
+    first = cache.schedule(*LOAN_TERMS)
+    second = cache.schedule(*LOAN_TERMS)
+
+    assert first == list(iter_amortization_schedule(*LOAN_TERMS))
+    assert second is first
+    assert cache.stats() == {"entries": 1, "bytes": cache.current_bytes, "hits": 1, "misses": 1, "evictions": 0}
+
+def test_equivalent_loan_terms_share_an_entry():
+    cache = ScheduleCache(max_entries=10, max_bytes=10 * 1024 * 1024)
+
+    cache.schedule(Decimal("100000.000000"), Decimal("12.00000"), 6)
+    cache.schedule(Decimal("1E+5"), Decimal("12"), 6)
+
+    assert cache.stats()["entries"] == 1
+    assert cache.hits == 1
+
+def test_least_recently_used_entry_is_evicted_at_max_entries():
+    cache = ScheduleCache(max_entries=2, max_bytes=10 * 1024 * 1024)
+
+    cache.schedule(Decimal("1000"), Decimal("5"), 12)
+    cache.schedule(Decimal("2000"), Decimal("5"), 12)
+    cache.schedule(Decimal("1000"), Decimal("5"), 12)
+    cache.schedule(Decimal("3000"), Decimal("5"), 12)
+    cache.schedule(Decimal("1000"), Decimal("5"), 12)
+    cache.schedule(Decimal("2000"), Decimal("5"), 12)
+
+    assert cache.hits == 2
+    assert cache.misses == 4
+    assert cache.evictions == 2
+    assert cache.stats()["entries"] == 2
+
+def test_entries_are_evicted_to_stay_under_max_bytes():
+    probe = ScheduleCache(max_entries=10, max_bytes=10 * 1024 * 1024)
+    probe.schedule(Decimal("1000"), Decimal("5"), 360)
+    entry_size = probe.current_bytes
+    cache = ScheduleCache(max_entries=10, max_bytes=entry_size * 2 + entry_size // 2)
+
+    for amount in ("1000", "2000", "3000", "4000"):
+        cache.schedule(Decimal(amount), Decimal("5"), 360)
+
+    assert cache.stats()["entries"] == 2
+    assert cache.evictions == 2
+    assert cache.current_bytes <= cache.max_bytes
+
+def test_schedule_larger_than_max_bytes_is_not_cached():
+    cache = ScheduleCache(max_entries=10, max_bytes=1024)
+
+    schedule = cache.schedule(Decimal("1000"), Decimal("5"), 360)
+
+    assert len(schedule) == 360
+    assert cache.stats()["entries"] == 0
+
+def test_summaries_are_sliced_from_a_cached_schedule():
+    cache = ScheduleCache(max_entries=10, max_bytes=10 * 1024 * 1024)
+    months = [1, 3, 5, 6]
+    expected_summaries = list(iter_loan_summaries(*LOAN_TERMS, months))
+
+    assert cache.summaries(months, *LOAN_TERMS) == expected_summaries
+    assert cache.misses == 1
+    assert cache.stats()["entries"] == 0
+
+    cache.schedule(*LOAN_TERMS)
+    assert cache.summaries(months, *LOAN_TERMS) == expected_summaries
+    assert cache.summary(5, *LOAN_TERMS) == expected_summaries[2]
+    assert cache.hits == 2
+
+def test_iter_schedule_streams_a_miss_without_caching_it():
+    cache = ScheduleCache(max_entries=10, max_bytes=10 * 1024 * 1024)
+
+    rows = cache.iter_schedule(*LOAN_TERMS)
+
+    assert not isinstance(rows, list)
+    assert list(rows) == list(iter_amortization_schedule(*LOAN_TERMS))
+    assert cache.stats()["entries"] == 0
+
+    cached_rows = cache.schedule(*LOAN_TERMS)
+    assert list(cache.iter_schedule(*LOAN_TERMS)) == cached_rows
+
+def test_windows_are_sliced_from_a_cached_schedule_or_computed_on_their_own():
+    cache = ScheduleCache(max_entries=10, max_bytes=10 * 1024 * 1024)
+    terms = (Decimal("100000"), Decimal("6.5"), 360)
+    full_schedule = list(iter_amortization_schedule(*terms))
+
+    assert cache.window(13, 24, *terms) == full_schedule[12:24]
+    assert cache.stats()["entries"] == 0
+    cache.schedule(*terms)
+    assert cache.window(13, 24, *terms) == full_schedule[12:24]
+    assert list(cache.iter_schedule(*terms, 349, 360)) == full_schedule[348:]
+
+def test_loan_summaries_mix_cached_schedules_and_closed_forms():
+    cache = ScheduleCache(max_entries=10, max_bytes=10 * 1024 * 1024)
+    cached_terms = (Decimal("250000"), Decimal("6.5"), 360)
+    cache.schedule(*cached_terms)
+    loan_months = [(cached_terms, 120), (LOAN_TERMS, 6), ((Decimal("2500"), Decimal("0"), 48), 12), (cached_terms, 1)]
+
+    summaries = cache.loan_summaries(loan_months)
+
+    assert summaries == [next(iter_loan_summaries(*terms, [month])) for terms, month in loan_months]
+    assert cache.stats()["entries"] == 1
@@ -0,0 +1,192 @@
+import io
+import itertools
+from decimal import Decimal
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from app import config
+from app.database import SHARD_ID_BITS, SQLiteProfile, ShardRouter, get_shard_router, shard_database_paths
+from app.loan_book import KINDS, LoanBookError, export_fields, export_kinds, import_records, iter_export, iter_records, write_records
+from app.main import app
+from app.metrics import metrics_registry
+from app.models import Loan, RemoteLoanLink, User
+from app.portfolios import check_portfolios
+from tests.test_main import parse_metrics
+
+SHARD_COUNT = 3
+
+@pytest.fixture(name="router")
+def router_fixture(tmp_path):
+    router = ShardRouter(shard_database_paths(tmp_path / "sharded.db", SHARD_COUNT), SQLiteProfile())
+    router.create_all()
+    yield router
+    router.dispose()
+
+@pytest.fixture(name="client")
+def client_fixture(router):
+    # only the router is overridden: the session dependencies route through it as the app's do
+    app.dependency_overrides[get_shard_router] = lambda: router
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+def create_users(client, count, prefix="user"):
+    return [
+        client.post("/users/", json={"email": f"{prefix}{n}@null.null", "first_name": "Sharded", "last_name": "User"}).json()["id"]
+        for n in range(count)
+    ]
+
+def create_loan(client, user_id, amount=10000, annual_interest_rate=6, term_months=120):
+    loan_data = {"amount": amount, "annual_interest_rate": annual_interest_rate, "term_months": term_months, "user_id": user_id}
+    return client.post("/loans/", json=loan_data).json()["id"]
+
+def users_by_shard(router, user_ids):
+    by_shard = {}
+    for user_id in user_ids:
+        by_shard.setdefault(router.shard_for_id(user_id), []).append(user_id)
+    return by_shard
+
+def test_users_and_their_loans_are_placed_on_the_shard_of_their_id(router: ShardRouter, client: TestClient):
+    user_ids = create_users(client, 12)
+
+    assert len(users_by_shard(router, user_ids)) == SHARD_COUNT
+    for user_id in user_ids:
+        shard = router.shard_for_id(user_id)
+        loan_id = create_loan(client, user_id)
+        assert router.shard_for_id(loan_id) == shard
+        with router.session(shard) as session:
+            user = session.get(User, user_id)
+            assert router.shard_for_email(user.email) == shard
+            assert [loan.id for loan in user.loans] == [loan_id]
+        assert client.get(f"/loan/{loan_id}/summary/12").status_code == 200
+        assert [loan["id"] for loan in client.get(f"/users/{user_id}/loans").json()] == [loan_id]
+    # shard 0's ids are the ones a single database file would have handed out
+    assert min(user_ids) == 1 and max(user_ids) > 2 << SHARD_ID_BITS
+    assert client.post("/users/", json={"email": "user3@null.null", "first_name": "Again", "last_name": "User"}).status_code == 400
+    assert client.post("/loans/", json={"amount": 1, "annual_interest_rate": 1, "term_months": 1, "user_id": 999}).status_code == 404
+
+def test_emails_of_users_created_before_sharding_stay_unique(router: ShardRouter, client: TestClient):
+    email = next(f"legacy{n}@null.null" for n in range(100) if router.shard_for_email(f"legacy{n}@null.null") != 0)
+    with router.session(0) as session:
+        session.add(User(email=email, first_name="Legacy", last_name="User"))
+        session.commit()
+
+    response = client.post("/users/", json={"email": email, "first_name": "Duplicate", "last_name": "User"})
+    bulk = client.post("/users/bulk", json=[{"email": email, "first_name": "Duplicate", "last_name": "User"}]).json()
+
+    assert response.status_code == 400
+    assert bulk["results"] == [{"index": 0, "error": "Email already exists"}]
+
+def test_loans_shared_across_shards_are_listed_with_the_users_own(router: ShardRouter, client: TestClient):
+    by_shard = users_by_shard(router, create_users(client, 12))
+    owner, target = by_shard[1][0], by_shard[2][0]
+    own_loan_ids = [create_loan(client, target, amount) for amount in (1000, 2000, 3000)]
+    shared_loan_ids = [create_loan(client, owner, amount) for amount in (4000, 5000)]
+
+    for loan_id in shared_loan_ids:
+        assert client.post(f"/loans/{loan_id}/share?target_user_id={target}").status_code == 200
+
+    assert client.post(f"/loans/{shared_loan_ids[0]}/share?target_user_id={target}").status_code == 400
+    assert client.post(f"/loans/{shared_loan_ids[0]}/share?target_user_id={(2 << SHARD_ID_BITS) + 999}").json()["detail"] == "Target user not found"
+    assert client.post(f"/loans/{(2 << SHARD_ID_BITS) + 999}/share?target_user_id={owner}").json()["detail"] == "Loan not found"
+    with router.session(2) as session:
+        assert len(session.execute(select(RemoteLoanLink)).all()) == 2
+    # in id order, so the loans of the owner's lower shard come first
+    loan_ids = shared_loan_ids + own_loan_ids
+    loans = client.get(f"/users/{target}/loans").json()
+    assert [loan["id"] for loan in loans] == loan_ids
+    assert loans[1]["amount"] == "5000.000000"
+    first_page = client.get(f"/users/{target}/loans?limit=4&fields=id")
+    assert [loan["id"] for loan in first_page.json()] == loan_ids[:4]
+    second_page = client.get(f"/users/{target}/loans?limit=4&fields=id&after={first_page.headers['X-Next-Cursor']}")
+    assert second_page.json() == [{"id": loan_ids[4]}]
+    assert "X-Next-Cursor" not in second_page.headers
+    summaries = client.get(f"/users/{target}/loans/summary?month=12&limit=1&after={loan_ids[0]}")
+    assert [loan["id"] for loan in summaries.json()] == loan_ids[1:2]
+    batch = client.post("/loans/batch/summary", json={"loan_ids": [shared_loan_ids[1], own_loan_ids[0]], "month": 12}).json()
+    assert [summary["loan_id"] for summary in batch] == [shared_loan_ids[1], own_loan_ids[0]]
+
+def test_other_shards_are_only_queried_for_remote_loans(router: ShardRouter, client: TestClient):
+    by_shard = users_by_shard(router, create_users(client, 12))
+    owner, target, loner = by_shard[0][0], by_shard[1][0], by_shard[1][1]
+    create_loan(client, target)
+    create_loan(client, loner)
+    assert client.post(f"/loans/{create_loan(client, owner)}/share?target_user_id={target}").status_code == 200
+    metrics_registry.clear()
+
+    client.get(f"/users/{loner}/loans")
+    loner_statements = parse_metrics(client.get("/metrics").text)
+    client.get(f"/users/{target}/loans")
+    target_statements = parse_metrics(client.get("/metrics").text)
+
+    route = 'http_request_sql_statements_total{method="GET",route="/users/{user_id}/loans"}'
+    # the user's loans, the user's remote links, and for the target the shared loan on its owner's shard
+    assert loner_statements[route] == 3
+    assert target_statements[route] - loner_statements[route] == 4
+
+def test_portfolios_include_loans_shared_from_other_shards(router: ShardRouter, client: TestClient, monkeypatch):
+    monkeypatch.setattr(config, "PORTFOLIO_ROLLUPS", True)
+    by_shard = users_by_shard(router, create_users(client, 12))
+    owner, target = by_shard[0][0], by_shard[2][0]
+    own_loan_id = create_loan(client, target, 20000, 5, 60)
+    shared_loan_id = create_loan(client, owner, 250000, 6.5, 360)
+    assert client.post(f"/loans/{shared_loan_id}/share?target_user_id={target}").status_code == 200
+    assert client.post(f"/loans/{shared_loan_id}/events", json={"kind": "prepayment", "month": 24, "amount": 10000}).status_code == 200
+
+    portfolio = client.get(f"/users/{target}/portfolio?month=36").json()
+
+    summaries = [client.get(f"/loan/{loan_id}/summary/36").json() for loan_id in (own_loan_id, shared_loan_id)]
+    assert portfolio["loans"] == 2
+    assert Decimal(str(portfolio["current principal balance"])) == sum(
+        Decimal(str(summary["current principal balance"])) for summary in summaries)
+    for shard in range(SHARD_COUNT):
+        with Session(router.engines[shard]) as session:
+            assert check_portfolios(session) == []
+
+def test_bulk_inserts_are_split_by_shard(router: ShardRouter, client: TestClient):
+    users = client.post("/users/bulk?chunk_size=5", json=[
+        {"email": f"bulk{n}@null.null", "first_name": "Bulk", "last_name": "User"} for n in range(10)]).json()
+    user_ids = [result["id"] for result in users["results"]]
+
+    loans = client.post("/loans/bulk", json=[
+        {"amount": 1000 * (n + 1), "annual_interest_rate": 5, "term_months": 12, "user_id": user_id} for n, user_id in enumerate(user_ids)
+    ] + [{"amount": 1000, "annual_interest_rate": 5, "term_months": 12, "user_id": 999}]).json()
+
+    assert users["inserted"] == 10 and len(set(user_ids)) == 10
+    assert len(users_by_shard(router, user_ids)) == SHARD_COUNT
+    assert loans["inserted"] == 10 and loans["results"][-1] == {"index": 10, "error": "User not found"}
+    for user_id, result in zip(user_ids, loans["results"]):
+        assert router.shard_for_id(result["id"]) == router.shard_for_id(user_id)
+        assert client.get(f"/users/{user_id}/loans").json()[0]["id"] == result["id"]
+    with router.session(router.shard_for_id(user_ids[-1])) as session:
+        assert session.get(Loan, loans["results"][9]["id"]).amount == Decimal("10000")
+
+def test_loan_book_import_spreads_records_over_the_shards_and_export_collects_them(router: ShardRouter):
+    shard_ids = [1, (1 << SHARD_ID_BITS) + 1, (2 << SHARD_ID_BITS) + 1]
+    users = "id,email,first_name,last_name\n" + "".join(f"{user_id},book{n}@null.null,Book,User\n" for n, user_id in enumerate(shard_ids))
+    loans = "id,amount,annual_interest_rate,term_months\n" + "".join(f"{loan_id},1000.000000,5.00000,12\n" for loan_id in shard_ids)
+    # each user owns the loan on their shard and has the next shard's loan shared with them
+    shares = "user_id,loan_id\n" + "".join(
+        f"{user_id},{loan_id}\n{user_id},{shard_ids[(n + 1) % 3]}\n" for n, (user_id, loan_id) in enumerate(zip(shard_ids, shard_ids)))
+
+    with router.session(0) as session:
+        counts = [
+            import_records(session, KINDS[kind], iter_records(io.StringIO(book), "csv"), chunk_size=4, router=router)
+            for kind, book in (("users", users), ("loans", loans), ("shares", shares))
+        ]
+        with pytest.raises(LoanBookError, match="loans \\[99\\]"):
+            import_records(session, KINDS["shares"], iter_records(io.StringIO("user_id,loan_id\n1,99\n"), "csv"), router=router)
+
+    assert counts == [(3, 3), (3, 3), (6, 6)]
+    for shard, record_id in enumerate(shard_ids):
+        with router.session(shard) as session:
+            assert session.execute(select(User.id)).scalars().all() == [record_id]
+            assert session.execute(select(RemoteLoanLink.loan_id)).scalars().all() == [shard_ids[(shard + 1) % 3]]
+    exported = io.StringIO()
+    connections = [engine.connect() for engine in router.read_engines]
+    write_records(exported, "csv", export_fields(KINDS["shares"]), itertools.chain.from_iterable(
+        iter_export(connection, kind) for connection in connections for kind in export_kinds(KINDS["shares"])))
+    for connection in connections:
+        connection.close()
+    assert sorted(exported.getvalue().splitlines()[1:]) == sorted(shares.splitlines()[1:])
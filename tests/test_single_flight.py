@@ -0,0 +1,77 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.metrics import MetricsRegistry
+from app.single_flight import SingleFlight
+
+@pytest.fixture(name="flight")
+def flight_fixture():
+    return SingleFlight("test", registry=MetricsRegistry())
+
+def run_concurrently(flight, key, function, callers):
+    # the first caller blocks inside function until every other caller is waiting on its call
+    release = threading.Event()
+    calls = []
+
+    def blocking_function():
+        calls.append(key)
+        release.wait(5)
+        return function()
+
+    def caller(_):
+        try:
+            return flight.do(key, blocking_function)
+        except Exception as error:
+            return error
+
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        futures = [executor.submit(caller, n) for n in range(callers)]
+        while flight.stats()["coalesced"] < callers - 1:
+            threading.Event().wait(0.001)
+        release.set()
+        results = [future.result() for future in futures]
+    return calls, results
+
+def test_concurrent_identical_calls_share_one_execution(flight):
+    result = object()
+
+    calls, results = run_concurrently(flight, "key", lambda: result, callers=8)
+
+    assert calls == ["key"]
+    assert all(shared is result for shared in results)
+    assert flight.stats() == {"in_flight": 0, "executions": 1, "coalesced": 7}
+
+def test_errors_propagate_to_every_waiting_caller(flight):
+    def fail():
+        raise ValueError("calculation failed")
+
+    calls, results = run_concurrently(flight, "key", fail, callers=4)
+
+    assert calls == ["key"]
+    assert all(isinstance(error, ValueError) and str(error) == "calculation failed" for error in results)
+    assert flight.in_flight() == 0
+    assert flight.do("key", lambda: "recovered") == "recovered"
+
+def test_finished_calls_are_not_cached(flight):
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2
+    assert flight.stats() == {"in_flight": 0, "executions": 2, "coalesced": 0}
+
+def test_different_keys_do_not_coalesce(flight):
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(lambda key: flight.do(key, lambda: key), ["a", "b"]))
+
+    assert results == ["a", "b"]
+    assert flight.stats()["coalesced"] == 0
+
+def test_flights_are_exported_as_metrics():
+    registry = MetricsRegistry()
+    flight = SingleFlight("schedule", registry=registry)
+    flight.do("key", lambda: None)
+
+    rendered = registry.render()
+
+    assert 'single_flight_executions_total{flight="schedule"} 1' in rendered
+    assert 'single_flight_coalesced_total{flight="schedule"} 0' in rendered